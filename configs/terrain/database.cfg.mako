@@ -18,6 +18,10 @@ shapefiles: 8/,2/,1/,0.5/
 tablenames: bl_2018_8m,bl_2018_2m,bl_2018_1m,bl_2018_0_5m
 modelnames: bl_2018_8m,bl_2018_2m,bl_2018_1m,bl_2018_0_5m
 lakes: /home/geodata/lakes/lakes.shp
+# zoom of the cells of the global geodetic grid partitioning the tables
+# (triangles larger than a cell go to the default partition), leave empty
+# for unpartitioned tables. Tables must be recreated when it changes.
+partitionZoom:
 
 # Paths must be absolute!
 [Reprojection]
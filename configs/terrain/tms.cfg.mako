@@ -7,10 +7,44 @@ profileName: not_used
 bucketpath: 1.0.0/ch.swisstopo.terrain.3d/default/ok/4326/
 # chunks per process (that's a maximum)
 maxChunks: 50
-# when using aws sqs queue, the name of the queue
+# work queue of the distributed mode: sqs (AWS SQS), database (a table of
+# the tiles database) or an SQLAlchemy url (e.g. sqlite:////var/tmp/queue.db)
+queueBackend: sqs
+# name of the queue
 sqsqueue: terrain_20150924
+# tiles (of average cost) per queue message, messages describe
+# rectangles of tiles so that one message can hold thousands of tiles
+messageTiles: 2000
+# number of threads writing the queue messages in parallel
+queueProducers: 8
+# seconds without messages before a queue worker stops
+# (increase it to start the workers while the queue is being filled)
+queueIdleTimeout: 60
+# seconds a queue message stays invisible to the other workers, extended
+# while a worker is processing it (a crashed worker releases it after that)
+queueVisibilityTimeout: 120
+# directory of the logs of the tiles already created (create --resume),
+# leave empty to disable them
+checkpoints: .tmp/checkpoints
+# find the triangles of the tiles with the index built by the tileindex
+# command (a lookup by tile instead of a spatial search), 1 to enable it
+# (the zooms never indexed or changed since are searched spatially)
+tileIndex: 0
+# rows of clipped triangles fetched at once through a server side cursor
+# for the tiles having more triangles according to the tile index (bounds
+# the memory of the workers on dense tiles), the other tiles fetch them all
+# at once with a prepared statement, 0 to never stream. Only the tile index
+# knows the number of triangles of a tile: without tileIndex: 1 (or on the
+# zooms not indexed) no tile is streamed and this setting has no effect.
+tileFetchSize: 10000
 # proc factor (total processes = factor * num_cpus_on_machine)
 procfactor: 1
+# order of the tiles within a zoom level: row (row by row, the default),
+# hilbert or morton (hilbert and morton keep consecutive tiles spatially
+# close, which helps the database caches)
+tileOrder: row
+# percentage of table blocks sampled by the stats command
+statsSamplePercent: 1
 
 [Extent]
 # below is region around thun
@@ -30,6 +64,9 @@ minLon: 5.86725126512748
 maxLon: 10.9209100671547
 minLat: 45.8026860136571
 maxLat: 47.8661652478939
+# optional footprint: WKT or path to a shapefile (EPSG:4326)
+# only the tiles of the extent intersecting it are created
+footprint:
 
 [Extensions]
 # watermask: 0 -> no watermask
@@ -39,6 +76,22 @@ watermask: 0
 # lighting: 1 -> include unit vectors
 lighting: 0
 
+[Costs]
+# cost model used to balance chunks and queue messages
+# uniform -> all tiles cost the same
+# density -> triangle density sampled from the db
+# timings -> tile timings of a previous run (local logs, not with --shard)
+# index -> exact triangle counts of the tile index (tileindex command)
+model: uniform
+# zoom of the density grid and percentage of table blocks sampled (density)
+densityZoom: 10
+densitySamplePercent: 1
+# timing files of a previous run (timings)
+timings: .tmp/timings_*.log
+# where each process writes its tile timings, %(pid)s is replaced
+# by the process id, e.g. .tmp/timings_%(pid)s.log (empty: disabled)
+timingsOutput:
+
 [Zooms]
 # Zoom level to tile
 tileMinZ: 14
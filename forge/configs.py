@@ -2,5 +2,14 @@
 
 import ConfigParser
 
-tmsConfig = ConfigParser.RawConfigParser()
-tmsConfig.read('configs/terrain/tms.cfg')
+_tmsConfig = None
+
+
+# Read on first use and cached
+def getTmsConfig():
+    global _tmsConfig
+    if _tmsConfig is None:
+        config = ConfigParser.RawConfigParser()
+        config.read('configs/terrain/tms.cfg')
+        _tmsConfig = config
+    return _tmsConfig
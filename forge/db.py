@@ -9,28 +9,31 @@ import sys
 import ConfigParser
 import sqlalchemy
 import multiprocessing
-from sqlalchemy.sql import exists, select, text
+from multiprocessing.pool import ThreadPool
+from sqlalchemy.sql import exists, select, text, func, cast, literal, and_
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.pool import NullPool
 from contextlib import contextmanager
+from geoalchemy2 import Geometry
 from quantized_mesh_tile.global_geodetic import GlobalGeodetic
 from poolmanager import PoolManager
 
-from forge.configs import tmsConfig
+from forge.configs import getTmsConfig
 import forge.lib.cartesian2d as c2d
 from forge.models import create_simplified_geom_table
 from forge.lib.tiles import TerrainTiles
-from forge.models.tables import modelsPyramid, Lakes
-from forge.lib.logs import getLogger
+from forge.models.tables import getModelsPyramid, Lakes, TileChanges, \
+    IngestedShapefiles, TileIndex, TileIndexZooms
+from forge.lib.ingest import ingestAction, shapefileStat, SKIP
+from forge.lib.tile_index import zoomsOfTable, invalidateExtents
+from forge.lib.logs import getLogger, startLogListener
 from forge.lib.shapefile_utils import ShpToGDALFeatures
 from forge.lib.helpers import BulkInsert, timestamp
 from forge.lib.helpers import cleanup, transformCoordinate
 
 
-loggingConfig = ConfigParser.RawConfigParser()
-loggingConfig.read('logging.cfg')
-logger = getLogger(loggingConfig, __name__, suffix='db_%s' % timestamp())
+logger = getLogger(__name__, suffix='db_%s' % timestamp())
 
 
 # Create pickable object
@@ -89,45 +92,153 @@ def reprojectShp(shpFilePath, args):
     return outFile
 
 
+# Features of a shapefile, only searched in the partitions holding them
+# when they are known
+def shapefileFeatures(model, shpFile, partitionKeys=None):
+    condition = model.shapefilepath == shpFile
+    if partitionKeys:
+        condition = and_(condition, model.partitionkey.in_(partitionKeys))
+    return condition
+
+
+# Records the extent of the features of a shapefile in the tile changes
+def recordChangedExtent(session, model, shpFile, partitionKeys=None):
+    extent = func.ST_SetSRID(
+        cast(func.ST_Extent(model.the_geom), Geometry), 4326)
+    query = select([
+        literal(model.__tablename__), literal(shpFile), extent
+    ]).where(shapefileFeatures(model, shpFile, partitionKeys)).having(
+        func.count() > 0)
+    session.execute(TileChanges.__table__.insert().from_select(
+        ['tablename', 'shapefilepath', 'the_geom'], query))
+
+
+# Extent of the features of a shapefile, None without any feature
+def featuresExtent(session, model, shpFile, partitionKeys=None):
+    extent = func.ST_Extent(model.the_geom)
+    row = session.query(
+        func.ST_XMin(extent), func.ST_YMin(extent),
+        func.ST_XMax(extent), func.ST_YMax(extent)
+    ).filter(shapefileFeatures(model, shpFile, partitionKeys)).one()
+    return tuple(row) if row[0] is not None else None
+
+
 def populateFeatures(args):
     pid = os.getpid()
     session = None
-    shpFile = args.shpFile
+    engine = None
+    sourceFile = args.shpFile
+    shpFile = sourceFile
     reproject = args.reproject
     keepfiles = args.keepfiles
-
-    if reproject:
-        try:
-            shpFile = reprojectShp(shpFile, args)
-        except Exception as e:
-            raise Exception(e)
+    # Forces the replacement of an unchanged shapefile
+    force = getattr(args, 'replace', False)
+    # Records the extents of the replaced features (see TileChanges)
+    trackChanges = getattr(args, 'trackChanges', force)
 
     try:
-        models = modelsPyramid.models
+        models = getModelsPyramid().models
         engine = sqlalchemy.create_engine(args.engineURL)
         session = scoped_session(sessionmaker(bind=engine))
         model = models[args.modelIndex]
 
-        if not os.path.exists(shpFile):
-            logger.error('[%s]: Shapefile %s does not exists' % (pid, shpFile))
+        if not os.path.exists(sourceFile):
+            logger.error('[%s]: Shapefile %s does not exists' % (
+                pid, sourceFile))
             sys.exit(1)
 
+        registered = session.query(IngestedShapefiles).filter(and_(
+            IngestedShapefiles.tablename == model.__tablename__,
+            IngestedShapefiles.shapefilepath == sourceFile
+        )).first()
+        (action, checksum) = ingestAction(registered, sourceFile, force=force)
+        (size, mtime) = shapefileStat(sourceFile)
+        if action == SKIP:
+            # Touched but identical, not to be hashed again next time
+            if (registered.size, registered.mtime) != (size, mtime):
+                registered.size = size
+                registered.mtime = mtime
+                session.commit()
+            logger.info('[%s]: Skipping %s, already loaded in %s' % (
+                pid, sourceFile, model.__tablename__))
+            return 0
+
+        if reproject:
+            shpFile = reprojectShp(sourceFile, args)
+
+        # Everything happens in one transaction: the features of the
+        # shapefile are either all replaced or left untouched
+        storedPaths = {shpFile: None}
+        if registered is not None:
+            storedPaths[registered.storedpath] = registered.partitionkeys
+        # The tile index of the zooms built from the table gets outdated
+        indexed = zoomsOfTable(session, TileIndexZooms, model.__tablename__)
+        changedExtents = []
+        # Also done for new shapefiles, in case they were loaded before
+        # the ingestions were recorded
+        for storedPath, keys in storedPaths.iteritems():
+            if trackChanges:
+                recordChangedExtent(session, model, storedPath, keys)
+            if indexed:
+                changedExtents.append(
+                    featuresExtent(session, model, storedPath, keys))
+            session.query(model).filter(
+                shapefileFeatures(model, storedPath, keys)
+            ).delete(synchronize_session=False)
+
         count = 1
+        partitions = model.__partitions__
+        partitionKeys = set()
         shp = ShpToGDALFeatures(shpFile)
         logger.info('[%s]: Processing %s' % (pid, shpFile))
-        bulk = BulkInsert(model, session, withAutoCommit=1000)
+        bulk = BulkInsert(model, session, withAutoCommit=1000,
+                          inTransaction=True)
         for feature in shp.getFeatures():
             polygon = feature.GetGeometryRef()
             # add shapefile path to dict
             # self.shpFilePath
-            bulk.add(dict(
+            row = dict(
                 shapefilepath=shpFile,
                 the_geom='SRID=4326;' + polygon.ExportToWkt()
-            ))
+            )
+            if partitions is not None:
+                (minX, maxX, minY, maxY) = polygon.GetEnvelope()
+                row['partitionkey'] = partitions.key((minX, minY, maxX, maxY))
+                partitionKeys.add(row['partitionkey'])
+            bulk.add(row)
             count += 1
         bulk.commit()
-        logger.info('[%s]: Commit %s features for %s.' % (pid, count, shpFile))
+        partitionKeys = sorted(partitionKeys) if partitions is not None \
+            else None
+        if trackChanges:
+            recordChangedExtent(session, model, shpFile, partitionKeys)
+        if indexed:
+            changedExtents.append(
+                featuresExtent(session, model, shpFile, partitionKeys))
+            invalidateExtents(
+                session, TileIndex, TileIndexZooms, model.__tablename__,
+                [e for e in changedExtents if e is not None],
+                tracked=trackChanges)
+
+        if registered is not None:
+            session.delete(registered)
+            session.flush()
+        session.add(IngestedShapefiles(
+            tablename=model.__tablename__,
+            shapefilepath=sourceFile,
+            storedpath=shpFile,
+            checksum=checksum,
+            size=size,
+            mtime=mtime,
+            features=count - 1,
+            partitionkeys=partitionKeys
+        ))
+        session.commit()
+        logger.info('[%s]: Commit %s features for %s (%s).' % (
+            pid, count, shpFile, action))
     except Exception as e:
+        if session is not None:
+            session.rollback()
         logger.error(e, exc_info=True)
         raise Exception(e)
     finally:
@@ -144,6 +255,25 @@ def populateFeatures(args):
     return count
 
 
+CONN_INFO = 'postgresql+psycopg2://%(user)s:%(password)s@%(host)s' \
+            ':%(port)d/%(database)s'
+
+
+# Url of the database for its regular user, without creating any engine
+def userURL(dbConfigFile):
+    config = ConfigParser.RawConfigParser()
+    config.read(dbConfigFile)
+    server = DB.Server(config)
+    database = DB.Database(config)
+    return CONN_INFO % dict(
+        user=database.user,
+        password=database.password,
+        host=server.host,
+        port=server.port,
+        database=database.name
+    )
+
+
 class DB:
 
     class Server:
@@ -178,8 +308,7 @@ class DB:
         self.adminConf = DB.Admin(config)
         self.databaseConf = DB.Database(config)
 
-        connInfo = 'postgresql+psycopg2://%(user)s:%(password)s@%(host)s' \
-                   ':%(port)d/%(database)s'
+        connInfo = CONN_INFO
         self.superEngine = sqlalchemy.create_engine(
             connInfo % dict(
                 user=self.adminConf.user,
@@ -315,10 +444,31 @@ class DB:
 
     def createTables(self):
         logger.info('Action: createTables()')
+        pyramid = getModelsPyramid()
         try:
-            for model in modelsPyramid.models:
+            for model in pyramid.models:
                 model.__table__.create(self.userEngine, checkfirst=True)
+            if pyramid.partitions is not None:
+                self.createPartitions()
             Lakes.__table__.create(self.userEngine, checkfirst=True)
+            TileChanges.__table__.create(self.userEngine, checkfirst=True)
+            IngestedShapefiles.__table__.create(
+                self.userEngine, checkfirst=True)
+            TileIndex.__table__.create(self.userEngine, checkfirst=True)
+            TileIndexZooms.__table__.create(self.userEngine, checkfirst=True)
+            # Registry created before the tables were partitioned
+            self.userEngine.execute(
+                'ALTER TABLE %(schema)s.%(table)s ADD COLUMN IF NOT EXISTS '
+                'partitionkeys integer[]' % dict(
+                    schema=IngestedShapefiles.__table__.schema,
+                    table=IngestedShapefiles.__tablename__))
+            # Tables created before features were replaced by shapefile
+            for model in pyramid.models:
+                self.userEngine.execute(
+                    'CREATE INDEX IF NOT EXISTS %(table)s_shapefilepath_idx '
+                    'ON %(schema)s.%(table)s (shapefilepath)' % dict(
+                        schema=model.__table__.schema,
+                        table=model.__tablename__))
         except ProgrammingError as e:
             logger.warning('Could not setup database on %(name)s'
                 ': %(err)s' % dict(
@@ -326,6 +476,81 @@ class DB:
                     err=str(e)
                 ))
 
+    # One partition per cell of the partition grid covering the pyramid
+    # (see partitionZoom), the features of the other cells and the large
+    # ones go to the default partition. The indexes of the parent tables
+    # are created on each partition.
+    def createPartitions(self):
+        logger.info('Action: createPartitions()')
+        partitions = getModelsPyramid().partitions
+        tiles = TerrainTiles(self.dbConfigFile, getTmsConfig(), time.time())
+        keys = partitions.cellsIntersecting(tiles.bounds) + \
+            [partitions.DEFAULT_KEY]
+        for model in getModelsPyramid().models:
+            for key in keys:
+                if key == partitions.DEFAULT_KEY:
+                    bound = 'DEFAULT'
+                else:
+                    bound = 'FOR VALUES IN (%s)' % key
+                self.userEngine.execute(
+                    'CREATE TABLE IF NOT EXISTS %(schema)s.%(partition)s '
+                    'PARTITION OF %(schema)s.%(table)s %(bound)s' % dict(
+                        schema=model.__table__.schema,
+                        partition=partitions.partitionName(
+                            model.__tablename__, key),
+                        table=model.__tablename__,
+                        bound=bound))
+            logger.info('%s partitions for table %s' % (
+                len(keys), model.__tablename__))
+
+    def _partitionNames(self, model):
+        query = text(
+            "SELECT n.nspname || '.' || c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE i.inhparent = to_regclass(:table) ORDER BY 1")
+        with self.userConnection() as conn:
+            return [row[0] for row in conn.execute(query, table='%s.%s' % (
+                model.__table__.schema, model.__tablename__))]
+
+    # Rebuilds the indexes and the statistics of the partitions of the
+    # pyramid tables, several partitions at a time
+    def reindexPartitions(self):
+        logger.info('Action: reindexPartitions()')
+
+        def reindex(partition):
+            tstart = time.time()
+            conn = engine.connect()
+            try:
+                conn.execute('REINDEX TABLE %s' % partition)
+                conn.execute('ANALYZE %s' % partition)
+            finally:
+                conn.close()
+            logger.info('Reindexed %s in %s' % (partition, str(
+                datetime.timedelta(seconds=time.time() - tstart))))
+
+        tstart = time.time()
+        partitions = []
+        for model in getModelsPyramid().models:
+            partitions += self._partitionNames(model)
+        if not partitions:
+            logger.info('No partitioned tables (see partitionZoom)')
+            return
+        # One connection per thread, outside of any transaction
+        engine = sqlalchemy.create_engine(
+            self.userEngine.url, poolclass=NullPool,
+            isolation_level='AUTOCOMMIT')
+        pool = ThreadPool(min(multiprocessing.cpu_count(), len(partitions)))
+        try:
+            pool.map(reindex, partitions, 1)
+        finally:
+            pool.close()
+            pool.join()
+            engine.dispose()
+        tend = time.time()
+        logger.info('%s partitions have been reindexed. It took %s' % (
+            len(partitions), str(datetime.timedelta(seconds=tend - tstart))))
+
     def setupDatabase(self):
         logger.info('Action: setupDatabase()')
         self.createSchema()
@@ -387,58 +612,94 @@ class DB:
                     finally:
                         del os.environ['PGPASSWORD']
 
-    def populateTables(self):
-        logger.info('Action: populateTables()')
+    def _featuresArguments(self, modelIndex, shp, replace=False,
+                           trackChanges=False):
+        reproject = self.config.get('Reprojection', 'reproject')
+        keepfiles = self.config.get('Reprojection', 'keepfiles')
+        return PopulateFeaturesArguments(
+            engineURL    = self.userEngine.url,
+            modelIndex   = modelIndex,
+            shpFile      = shp,
+            reproject    = True if reproject == '1' else False,
+            keepfiles    = True if keepfiles == '1' else False,
+            outDirectory = self.config.get('Reprojection', 'outDirectory'),
+            geosuiteCmd  = self.config.get('Reprojection', 'geosuiteCmd'),
+            fromPFrames  = self.config.get('Reprojection', 'fromPFrames'),
+            toPFrames    = self.config.get('Reprojection', 'toPFrames'),
+            fromAFrames  = self.config.get('Reprojection', 'fromAFrames'),
+            toAFrames    = self.config.get('Reprojection', 'toAFrames'),
+            logfile      = self.config.get('Reprojection', 'logfile'),
+            errorfile    = self.config.get('Reprojection', 'errorfile'),
+            replace      = replace,
+            trackChanges = trackChanges
+        )
 
-        reproject    = self.config.get('Reprojection', 'reproject')
-        keepfiles    = self.config.get('Reprojection', 'keepfiles')
+    def _checkReprojection(self):
         outDirectory = self.config.get('Reprojection', 'outDirectory')
-        geosuiteCmd  = self.config.get('Reprojection', 'geosuiteCmd')
-        fromPFrames  = self.config.get('Reprojection', 'fromPFrames')
-        toPFrames    = self.config.get('Reprojection', 'toPFrames')
-        fromAFrames  = self.config.get('Reprojection', 'fromAFrames')
-        toAFrames    = self.config.get('Reprojection', 'toAFrames')
-        logfile      = self.config.get('Reprojection', 'logfile')
-        errorfile    = self.config.get('Reprojection', 'errorfile')
-
+        geosuiteCmd = self.config.get('Reprojection', 'geosuiteCmd')
         if not os.path.exists(outDirectory):
             raise OSError('%s does not exist' % outDirectory)
         if not os.path.exists(geosuiteCmd):
             raise OSError('%s does not exist' % geosuiteCmd)
 
-        tstart = time.time()
-        models = modelsPyramid.models
-        featuresArgs = []
-        for i in range(0, len(models)):
-            model = models[i]
-            for shp in model.__shapefiles__:
-
-                featuresArgs.append(PopulateFeaturesArguments(
-                    engineURL    = self.userEngine.url,
-                    modelIndex   = i,
-                    shpFile      = shp,
-                    reproject    = True if reproject == '1' else False,
-                    keepfiles    = True if keepfiles == '1' else False,
-                    outDirectory = outDirectory,
-                    geosuiteCmd  = geosuiteCmd,
-                    fromPFrames  = fromPFrames,
-                    toPFrames    = toPFrames,
-                    fromAFrames  = fromAFrames,
-                    toAFrames    = toAFrames,
-                    logfile      = logfile,
-                    errorfile    = errorfile
-                ))
-
+    def _populate(self, featuresArgs):
         cpuCount = multiprocessing.cpu_count()
         numFiles = len(featuresArgs)
         numProcs = cpuCount if numFiles >= cpuCount else numFiles
+        startLogListener(logger.suffix)
         pm = PoolManager(numProcs=numProcs, factor=1)
         pm.imap_unordered(populateFeatures, featuresArgs, 1)
 
+    def populateTables(self):
+        logger.info('Action: populateTables()')
+        self._checkReprojection()
+
+        tstart = time.time()
+        # Shapefiles already loaded are skipped or, when they changed,
+        # replaced. Changes are only recorded once the tables were populated.
+        with self.userSession() as session:
+            trackChanges = session.query(IngestedShapefiles).first() is not None
+        models = getModelsPyramid().models
+        featuresArgs = []
+        for i in range(0, len(models)):
+            model = models[i]
+            for shp in model.__shapefiles__:
+                featuresArgs.append(self._featuresArguments(
+                    i, shp, trackChanges=trackChanges))
+        self._populate(featuresArgs)
+
         tend = time.time()
         logger.info('All tables have been created. It took %s' % str(
             datetime.timedelta(seconds=tend - tstart)))
 
+    # Replaces the features of the given shapefiles and records their
+    # extents, so that the affected tiles can be regenerated
+    # (see the update command of tms_writer.py)
+    def reingest(self, shapefiles):
+        logger.info('Action: reingest()')
+        self.setupDatabase()
+        self._checkReprojection()
+
+        tstart = time.time()
+        models = getModelsPyramid().models
+        featuresArgs = []
+        for shp in shapefiles:
+            found = False
+            for i in range(0, len(models)):
+                for modelShp in models[i].__shapefiles__:
+                    if os.path.abspath(modelShp) == os.path.abspath(shp):
+                        found = True
+                        featuresArgs.append(self._featuresArguments(
+                            i, modelShp, replace=True, trackChanges=True))
+            if not found:
+                raise ValueError(
+                    '%s is not a shapefile of the configured tables' % shp)
+        self._populate(featuresArgs)
+
+        tend = time.time()
+        logger.info('%s shapefiles have been reingested. It took %s' % (
+            len(featuresArgs), str(datetime.timedelta(seconds=tend - tstart))))
+
     def populateLakes(self):
         self.setupDatabase()
         logger.info('Action: populateLakes()')
@@ -471,7 +732,7 @@ class DB:
             # Once all features have been commited, start creating all
             # the simplified versions of the lakes
             logger.info('Simplifying lakes')
-            tiles = TerrainTiles(self.dbConfigFile, tmsConfig, time.time())
+            tiles = TerrainTiles(self.dbConfigFile, getTmsConfig(), time.time())
             geodetic = GlobalGeodetic(True)
             bounds = (tiles.minLon, tiles.minLat, tiles.maxLon, tiles.maxLat)
             zooms = range(tiles.tileMinZ, tiles.tileMaxZ + 1)
@@ -1,29 +1,29 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import time
 import datetime
 import logging
-import multiprocessing
-import ConfigParser
+import threading
 import boto.sqs
 from boto import connect_s3
 from boto.s3.key import Key
+from boto.s3.prefix import Prefix
+from boto.exception import S3ResponseError
 
 from forge.lib.helpers import timestamp
-from forge.configs import tmsConfig
+from forge.configs import getTmsConfig
 from forge.lib.logs import getLogger
-from poolmanager import PoolManager
+from forge.lib.pipeline import Pipeline, ThreadCounter, RateLimiter, \
+    retry, background
+from forge.lib.prefixes import prefixPartitions
+from forge.lib.inventory import InventorySummary, FORMATS, zoomOf
+from forge.lib.sync import SyncReport, diffListings, MISSING, CHANGED, EXTRA
 
 logging.getLogger('boto').setLevel(logging.CRITICAL)
 
-bucketName = tmsConfig.get('General', 'bucketName')
-profileName = tmsConfig.get('General', 'profileName')
-
-# Init logging
-loggingConfig = ConfigParser.RawConfigParser()
-loggingConfig.read('logging.cfg')
-log = getLogger(loggingConfig, __name__, suffix=timestamp())
+log = getLogger(__name__, suffix=timestamp())
 
 
 def _getS3Conn():
@@ -34,12 +34,26 @@ def _getS3Conn():
     return conn
 
 
-connS3 = _getS3Conn()
+def getBucketName():
+    return getTmsConfig().get('General', 'bucketName')
+
+
+# Connections per process id
+_connS3 = {}
+
+
+# Connected on first use, each process connects with its own: a forked
+# worker never shares the sockets of its parent
+def getS3Conn():
+    pid = os.getpid()
+    if pid not in _connS3:
+        _connS3[pid] = _getS3Conn()
+    return _connS3[pid]
 
 
 def getBucket():
     try:
-        bucket = connS3.get_bucket(bucketName)
+        bucket = getS3Conn().get_bucket(getBucketName())
     except Exception as e:
         raise Exception('Error during connection %s' % e)
     return bucket
@@ -56,116 +70,336 @@ def writeToS3(b, path, content, origin, bucketBasePath,
     k.set_contents_from_file(content, headers=headers)
 
 
-copycount = multiprocessing.Value('i', 0)
+_threadLocal = threading.local()
 
 
-def copyKey(args):
-    (keyname, prefix, toPrefix, t0) = args
-    try:
-        bucket = getBucket()
-        key = bucket.lookup(prefix + keyname)
-        key.copy(bucket.name, toPrefix + keyname)
-        copycount.value += 1
-        val = copycount.value
-        if val % 100 == 0:
-            log.info('Created %s copies in %s.' % (
-                val, str(datetime.timedelta(seconds=time.time() - t0))))
-            log.info('%s was copied to %s' % (prefix + keyname, toPrefix + keyname))
-    except Exception as e:
-        log.info('Caught an exception when copying %s exception: %s' % (keyname, str(e)))
+# boto connections are not thread safe, each thread keeps its own
+# connection (and its pool of HTTP connections) for all its requests
+def threadBucket():
+    (pid, bucket) = getattr(_threadLocal, 'bucket', (None, None))
+    if pid != os.getpid():
+        bucket = _getS3Conn().get_bucket(getBucketName(), validate=False)
+        _threadLocal.bucket = (os.getpid(), bucket)
+    return bucket
+
+
+# Request rate exceeded (SlowDown) or S3 internal errors, worth retrying
+def isRetryableS3Error(e):
+    return isinstance(e, S3ResponseError) and e.status in (500, 503)
 
 
-class S3KeyIterator:
+# Server side copy without any lookup, the key name comes from the listing.
+# The metadata and the headers (Content-Encoding...) are copied with the
+# object.
+def copyKey(srcName, dstName):
+    bucket = threadBucket()
+    retry(lambda: bucket.copy_key(dstName, getBucketName(), srcName),
+          isRetryableS3Error)
 
-    def __init__(self, prefix, toPrefix, t0):
-        self.bucketlist = getBucket().list(prefix=prefix)
-        self.prefix = prefix
-        self.toPrefix = toPrefix
-        self.t0 = t0
 
-    def __iter__(self):
-        for entry in self.bucketlist:
-            keyname = entry.name.split(self.prefix)[1]
-            yield (keyname, self.prefix, self.toPrefix, self.t0)
+def _logProgress(action, t0):
+    def progress(done, failed):
+        log.info('%s %s keys in %s (%s failed).' % (
+            action, done, str(datetime.timedelta(seconds=time.time() - t0)),
+            failed))
+    return progress
 
 
-def copyKeys(fromPrefix, toPrefix, zooms):
+# Copies the tiles of the given zooms from a prefix to another. The zooms
+# are listed in parallel by nbListers threads while nbWorkers threads copy
+# the listed keys.
+def copyKeys(fromPrefix, toPrefix, zooms, nbWorkers=64, nbListers=4):
     t0 = time.time()
-    copycount.value = 0
+    copiesByZoom = dict((zoom, ThreadCounter()) for zoom in zooms)
+
+    def listZoom(zoom):
+        prefix = '%s%s/' % (fromPrefix, zoom)
+        for key in threadBucket().list(prefix=prefix):
+            yield (zoom, key.name, toPrefix + key.name[len(fromPrefix):])
+
+    def copy(item):
+        (zoom, srcName, dstName) = item
+        try:
+            copyKey(srcName, dstName)
+        except Exception as e:
+            log.info('Caught an exception when copying %s exception: %s' % (
+                srcName, str(e)))
+            raise
+        copiesByZoom[zoom].add()
+
+    log.info('Copying zooms %s from %s to %s' % (
+        ', '.join(str(z) for z in zooms), fromPrefix, toPrefix))
+    pipeline = Pipeline(copy, nbWorkers=nbWorkers, nbProducers=nbListers)
+    pipeline.run(
+        [listZoom(zoom) for zoom in zooms],
+        progress=_logProgress('Created', t0))
+
     for zoom in zooms:
-        log.info('doing zoom ' + str(zoom))
-        t0zoom = time.time()
-        keys = S3KeyIterator(fromPrefix + str(zoom) + '/', toPrefix + str(zoom) + '/', t0)
-        cpuCount = multiprocessing.cpu_count()
-        pm = PoolManager(numProcs=cpuCount, factor=1)
-        pm.imap_unordered(copyKey, keys, 50)
-
-        log.info(
-            'It took %s to copy this zoomlevel (total %s)' %
-            (str(
-                datetime.timedelta(
-                    seconds=time.time() -
-                    t0zoom)),
-                copycount.value))
+        log.info('Zoom %s: %s copies' % (zoom, copiesByZoom[zoom].value))
     log.info(
-        'It took %s to copy for all zoomlevels (total %s)' %
-        (str(
-            datetime.timedelta(
-                seconds=time.time() -
-                t0)),
-     copycount.value))
+        'It took %s to copy for all zoomlevels (total %s, %s failed)' % (
+            str(datetime.timedelta(seconds=time.time() - t0)),
+            pipeline.done.value, pipeline.failed.value))
+
+
+# Maximum number of keys of a DeleteObjects request
+S3_MAX_DELETE_KEYS = 1000
+
+
+# Errors of single keys of a DeleteObjects request worth retrying
+S3_RETRYABLE_CODES = ('SlowDown', 'InternalError', 'ServiceUnavailable')
+
+
+# Deletes a batch of keys with one request, the keys failing with a
+# retryable error are deleted again. Returns the number of keys deleted
+# and the errors (boto.s3.multidelete.Error) of the other keys.
+def deleteKeys(names, retries=5, delay=0.1):
+    bucket = threadBucket()
+    nbDeleted = 0
+    errors = []
+    for attempt in xrange(0, retries + 1):
+        result = retry(lambda: bucket.delete_keys(names, quiet=True),
+                       isRetryableS3Error)
+        nbDeleted += len(names) - len(result.errors)
+        failed = []
+        for error in result.errors:
+            if error.code in S3_RETRYABLE_CODES:
+                failed.append(error)
+            else:
+                errors.append(error)
+        if not failed:
+            break
+        if attempt == retries:
+            errors += failed
+            break
+        names = [error.key for error in failed]
+        time.sleep(min(delay * 2 ** attempt, 10))
+    return (nbDeleted, errors)
+
+
+# Sub prefixes directly under a prefix and whether keys lie directly
+# under it (see prefixes.prefixPartitions)
+def _prefixListing(prefix):
+    subPrefixes = []
+    hasKeys = False
+    for entry in threadBucket().list(prefix=prefix, delimiter='/'):
+        if isinstance(entry, Prefix):
+            subPrefixes.append(entry.name)
+        else:
+            hasKeys = True
+    return (subPrefixes, hasKeys)
+
+
+# Keys of a partition (prefix, recursive) of prefixes.prefixPartitions
+def listPartition(partition):
+    (prefix, recursive) = partition
+    delimiter = '' if recursive else '/'
+    for entry in threadBucket().list(prefix=prefix, delimiter=delimiter):
+        if not isinstance(entry, Prefix):
+            yield entry
+
+
+# Entries (name relative to prefix, size, etag) of a listing
+def _listing(prefix, listPrefix):
+    for key in threadBucket().list(prefix=listPrefix):
+        yield (key.name[len(prefix):], key.size, key.etag)
+
+
+# Makes the tiles of the given zooms under toPrefix the same as the ones
+# under fromPrefix, copying only the missing or different tiles (same
+# size and ETag means same content) and, if delete is set, deleting the
+# extra ones. With dryRun nothing is changed. Returns the report of the
+# differences per zoom.
+def syncKeys(fromPrefix, toPrefix, zooms, delete=False, dryRun=False,
+             nbWorkers=64, nbListers=4):
+    t0 = time.time()
+    report = SyncReport(zooms)
+
+    def zoomActions(zoom):
+        # Both versions of a zoom are listed at the same time
+        diff = diffListings(
+            background(_listing(fromPrefix, '%s%s/' % (fromPrefix, zoom))),
+            background(_listing(toPrefix, '%s%s/' % (toPrefix, zoom))))
+        extra = []
+        for status, name in diff:
+            report.add(zoom, status)
+            if dryRun:
+                continue
+            if status in (MISSING, CHANGED):
+                yield ('copy', (fromPrefix + name, toPrefix + name))
+            elif status == EXTRA and delete:
+                extra.append(toPrefix + name)
+                if len(extra) == S3_MAX_DELETE_KEYS:
+                    yield ('delete', extra)
+                    extra = []
+        if extra:
+            yield ('delete', extra)
+
+    def apply(action):
+        (kind, args) = action
+        if kind == 'copy':
+            copyKey(*args)
+        else:
+            (nbDeleted, errors) = deleteKeys(args)
+            if errors:
+                raise Exception(
+                    '%s keys could not be deleted, first error: %s' % (
+                        len(errors), errors[0].message))
+
+    log.info('%s zooms %s from %s to %s' % (
+        'Comparing' if dryRun else 'Syncing',
+        ', '.join(str(z) for z in zooms), fromPrefix, toPrefix))
+    pipeline = Pipeline(apply, nbWorkers=nbWorkers, nbProducers=nbListers)
+    pipeline.run(
+        [zoomActions(zoom) for zoom in zooms],
+        progress=_logProgress('Applied', t0))
+    for action, e in pipeline.errors:
+        log.error('Could not %s %s: %s' % (action[0], action[1], e))
+
+    log.info('Differences per zoom%s:\n%s' % (
+        ' (dry run)' if dryRun else '', report))
+    log.info('It took %s to sync (%s requests, %s failed)' % (
+        str(datetime.timedelta(seconds=time.time() - t0)),
+        pipeline.done.value, pipeline.failed.value))
+    return report
 
 
 class S3Keys:
 
+    # Partitions (zooms, x columns) listed at the same time
+    nbListers = 8
+    # Requests in flight
+    nbWorkers = 16
+    # Keys deleted per second, S3 allows about 3500 per second and prefix
+    deleteRate = 3000
+
     def __init__(self, prefix, bucketBasePath):
         self.bucket = getBucket()
-        self.counter = 0
         self.prefix = bucketBasePath
         if prefix is not None:
             self.prefix += prefix
         else:
             raise Exception('One must define a prefix')
-        self.keysList = self.bucket.list(prefix=self.prefix)
+        # Tiles are stored under zoom/x/, partitions are the x columns
+        self.partitionDepth = max(0, 2 - prefix.count('/'))
+        self.bucketBasePath = bucketBasePath
+        self.deleted = ThreadCounter()
+        self.failed = ThreadCounter()
+
+    def partitions(self):
+        return prefixPartitions(
+            _prefixListing, self.prefix, self.partitionDepth)
 
     def delete(self):
-        keysToDelete = []
         print 'Are you sure you want to delete all tiles ' \
             'starting with %s? (y/n)' % self.prefix
         answer = raw_input('> ')
         if answer.lower() != 'y':
             sys.exit(1)
         print 'Deleting keys for prefix %s...' % self.prefix
-        for key in self.keysList:
-            keysToDelete.append(key)
-            if len(keysToDelete) % 1000 == 0:
-                self._deleteKeysResults(self.bucket.delete_keys(keysToDelete))
-                keysToDelete = []
-        if len(keysToDelete) > 0:
-            self._deleteKeysResults(self.bucket.delete_keys(keysToDelete))
-        print '%s keys have been deleted' % self.counter
-
-    def listKeys(self):
-        print 'Listing keys for prefix %s...' % self.prefix
-        for key in self.keysList:
-            print "{name}\t{size}\t{modified}".format(
-                name=key.name,
-                size=key.size,
-                modified=key.last_modified,
-            )
-            # So that one can interrput it from keyboard
-            time.sleep(.2)
+        t0 = time.time()
+        limiter = RateLimiter(self.deleteRate)
+
+        def batches(partition):
+            batch = []
+            for key in listPartition(partition):
+                batch.append(key.name)
+                if len(batch) == S3_MAX_DELETE_KEYS:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        def deleteBatch(names):
+            limiter.acquire(len(names))
+            self._deleteKeysResults(deleteKeys(names))
+
+        def report(*args):
+            seconds = time.time() - t0
+            print '%s keys deleted in %s (%.0f keys/s), %s errors' % (
+                self.deleted.value, str(datetime.timedelta(seconds=seconds)),
+                self.deleted.value / max(seconds, 1), self.failed.value)
+
+        partitions = self.partitions()
+        print 'Listing %s partitions with %s threads...' % (
+            len(partitions), self.nbListers)
+        pipeline = Pipeline(
+            deleteBatch, nbWorkers=self.nbWorkers, nbProducers=self.nbListers,
+            queueSize=2 * self.nbWorkers)
+        pipeline.run([batches(p) for p in partitions], progress=report)
+        for names, e in pipeline.errors:
+            print 'A batch starting with %s failed: %s' % (names[0], e)
+        report()
+        print '%s keys have been deleted' % self.deleted.value
+
+    # Lists the partitions in parallel, each key is written by write if
+    # given. Returns the summary per zoom and the number of keys which could
+    # not be recorded (e.g. failed writes), reported to stderr.
+    def _inventory(self, write=None):
+        t0 = time.time()
+        summary = InventorySummary()
+
+        def entries(partition):
+            for key in listPartition(partition):
+                yield (key.name, key.size, key.last_modified)
+
+        # A single consumer: the summary and the output need no lock
+        def record(entry):
+            summary.add(zoomOf(entry[0], self.bucketBasePath), entry[1])
+            if write is not None:
+                write(*entry)
+
+        def report(*args):
+            seconds = time.time() - t0
+            sys.stderr.write('%s keys listed in %s (%.0f keys/s)\n' % (
+                summary.nbKeys, str(datetime.timedelta(seconds=seconds)),
+                summary.nbKeys / max(seconds, 1)))
+
+        pipeline = Pipeline(
+            record, nbWorkers=1, nbProducers=self.nbListers)
+        pipeline.run(
+            [entries(p) for p in self.partitions()], progress=report)
+        report()
+        for entry, e in pipeline.errors:
+            sys.stderr.write('%s could not be recorded: %s\n' % (entry[0], e))
+        if pipeline.failed.value:
+            sys.stderr.write(
+                '%s keys could not be recorded, the summary is '
+                'incomplete\n' % pipeline.failed.value)
+        return (summary, pipeline.failed.value)
+
+    # Writes one line per key (fmt: tsv or jsonl) to output (stdout by
+    # default) and prints the summary per zoom. Returns the number of keys
+    # which could not be written.
+    def listKeys(self, output=None, fmt='tsv'):
+        sys.stderr.write('Listing keys for prefix %s...\n' % self.prefix)
+        formatLine = FORMATS[fmt]
+        f = sys.stdout if output is None else open(output, 'w')
+        try:
+            (summary, failed) = self._inventory(
+                lambda *entry: f.write(formatLine(*entry)))
+        finally:
+            if output is not None:
+                f.close()
+        sys.stderr.write('%s\n' % summary)
+        return failed
 
     def count(self):
         print 'Counting keys for prefix %s...' % self.prefix
-        nbKeys = len(list(self.keysList))
-        print '%s keys have been found for prefix %s' % (nbKeys, self.prefix)
+        (summary, failed) = self._inventory()
+        print summary
+        print '%s keys have been found for prefix %s' % (
+            summary.nbKeys, self.prefix)
+        return failed
 
+    # Called by several threads
     def _deleteKeysResults(self, results):
-        nbDeleted = len(results.deleted)
-        print '%s could not be deleted.' % len(results.errors)
-        print '%s have been deleted.' % nbDeleted
-        self.counter += len(results.deleted)
+        (nbDeleted, errors) = results
+        for error in errors:
+            print '%s could not be deleted: %s %s' % (
+                error.key, error.code, error.message)
+        self.deleted.add(nbDeleted)
+        self.failed.add(len(errors))
 
 
 def _getSQSConn():
@@ -176,14 +410,62 @@ def _getSQSConn():
     return conn
 
 
-connSQS = _getSQSConn()
+_connSQS = {}
 
 
-def getSQS():
-    return connSQS
+# boto connections are not thread safe, threads must use their own. The
+# shared connection is made on first use, once per process.
+def getSQS(shared=True):
+    if not shared:
+        return _getSQSConn()
+    pid = os.getpid()
+    if pid not in _connSQS:
+        _connSQS[pid] = _getSQSConn()
+    return _connSQS[pid]
 
 
 def writeSQSMessage(q, message):
     m = boto.sqs.message.Message()
     m.set_body(message)
     q.write(m)
+
+
+# SQS limits for SendMessageBatch
+SQS_MAX_BATCH_MESSAGES = 10
+SQS_MAX_BATCH_SIZE = 256 * 1024
+
+
+# Groups message bodies in batches respecting the SQS limits.
+# Bodies are base64 encoded like boto.sqs.message.Message does, so that
+# readers using the default message class can decode them.
+def sqsBatches(bodies):
+    batch = []
+    size = 0
+    for body in bodies:
+        encoded = boto.sqs.message.Message(body=body).get_body_encoded()
+        if batch and (len(batch) >= SQS_MAX_BATCH_MESSAGES or
+                      size + len(encoded) > SQS_MAX_BATCH_SIZE):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(encoded)
+        size += len(encoded)
+    if batch:
+        yield batch
+
+
+def writeSQSBatch(q, encodedBodies, retries=5):
+    entries = [(str(i), body, 0) for i, body in enumerate(encodedBodies)]
+    for attempt in range(0, retries + 1):
+        try:
+            results = q.write_batch(entries)
+        except Exception as e:
+            log.warning('SQS: batch write failed (%s), retrying' % e)
+        else:
+            if not results.errors:
+                return len(encodedBodies)
+            failed = set(error['id'] for error in results.errors)
+            entries = [entry for entry in entries if entry[0] in failed]
+        time.sleep(min(2 ** attempt * 0.1, 5))
+    raise Exception(
+        'SQS: %s messages could not be written' % len(entries))
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from shapely.geometry import box
+from shapely.ops import unary_union
+
+from forge.lib.planner import TileRangePlanner
+from forge.lib.footprint import Footprint
+
+
+# Union of changed extents (minX, minY, maxX, maxY)
+def changedGeometry(extents):
+    return unary_union([box(*extent) for extent in extents])
+
+
+# Planner of the tiles of one zoom level touched by a changed geometry,
+# None if no tile of the pyramid is touched. A change only touching the
+# edge of the extent or of the footprint (a line or a point once clipped)
+# touches no tile of the pyramid.
+def dirtyPlanner(bounds, zoom, geometry, footprint=None):
+    geometry = geometry.intersection(box(*bounds))
+    if footprint is not None:
+        geometry = geometry.intersection(footprint.geometry)
+    if geometry.is_empty or geometry.area == 0:
+        return None
+    return TileRangePlanner(
+        list(geometry.bounds), zoom, zoom, footprint=Footprint(geometry))
+
+
+# The changes only affect the zoom levels using the changed tables.
+# extentsByTable maps a table to its changed extents, tablenameByZoom
+# maps a zoom level to the table its tiles are created from.
+def dirtyPlanners(bounds, zooms, tablenameByZoom, extentsByTable,
+                  footprint=None):
+    planners = {}
+    geometries = {}
+    for zoom in zooms:
+        tablename = tablenameByZoom(zoom)
+        extents = extentsByTable.get(tablename)
+        if not extents:
+            continue
+        if tablename not in geometries:
+            geometries[tablename] = changedGeometry(extents)
+        planner = dirtyPlanner(
+            bounds, zoom, geometries[tablename], footprint=footprint)
+        if planner is not None:
+            planners[zoom] = planner
+    return planners
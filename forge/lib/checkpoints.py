@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# Records of the tiles already processed by TilerManager.create, so that an
+# interrupted run can be resumed.
+#
+# Each worker process appends the tiles it created or skipped to its own
+# log, 9 bytes per tile, flushed after each chunk of tiles. On resume the
+# logs are loaded in one bitmap per zoom covering the planned tile ranges,
+# which are then compacted into a single file. Filtering a tile is one
+# lookup in a numpy array.
+
+import os
+import glob
+import numpy
+
+
+TILE_RECORD = numpy.dtype([('z', '<u1'), ('x', '<u4'), ('y', '<u4')])
+
+LOG_EXTENSION = '.log'
+BITMAPS_FILE = 'completed.npz'
+
+
+class CheckpointWriter:
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+        self._tiles = []
+
+    def add(self, tileXYZ):
+        self._tiles.append(tileXYZ)
+
+    def flush(self):
+        if not self._tiles:
+            return
+        if self._f is None:
+            self._f = open(self.path, 'ab')
+        records = numpy.array(
+            [(z, x, y) for x, y, z in self._tiles], dtype=TILE_RECORD)
+        self._f.write(records.tostring())
+        self._f.flush()
+        self._tiles = []
+
+    def close(self):
+        self.flush()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def readLog(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    # A crash may leave a partially written record
+    nbRecords = len(data) // TILE_RECORD.itemsize
+    return numpy.frombuffer(
+        data[:nbRecords * TILE_RECORD.itemsize], dtype=TILE_RECORD)
+
+
+# Tiles already processed, restricted to the tiles of a planner
+class CompletedTiles:
+
+    def __init__(self, planner):
+        self.planner = planner
+        self.bitmaps = {}
+        for zoom in planner.zooms:
+            r = planner.zoomRange(zoom)
+            self.bitmaps[zoom] = numpy.zeros((r.yCount, r.xCount), dtype=bool)
+
+    # Loads the bitmaps and the logs of a checkpoint directory
+    @classmethod
+    def fromDirectory(cls, directory, planner):
+        completed = cls(planner)
+        bitmapsPath = os.path.join(directory, BITMAPS_FILE)
+        if os.path.exists(bitmapsPath):
+            completed.loadBitmaps(bitmapsPath)
+        for path in logFiles(directory):
+            completed.addRecords(readLog(path))
+        return completed
+
+    def add(self, zoom, xs, ys):
+        if zoom not in self.bitmaps:
+            return
+        r = self.planner.zoomRange(zoom)
+        xs = numpy.asarray(xs, dtype=numpy.int64)
+        ys = numpy.asarray(ys, dtype=numpy.int64)
+        inside = (xs >= r.minX) & (xs <= r.maxX) & \
+            (ys >= r.minY) & (ys <= r.maxY)
+        self.bitmaps[zoom][ys[inside] - r.minY, xs[inside] - r.minX] = True
+
+    def addRecords(self, records):
+        for zoom in numpy.unique(records['z']):
+            atZoom = records[records['z'] == zoom]
+            self.add(int(zoom), atZoom['x'], atZoom['y'])
+
+    def __contains__(self, tileXYZ):
+        (x, y, z) = tileXYZ
+        bitmap = self.bitmaps.get(z)
+        if bitmap is None:
+            return False
+        r = self.planner.zoomRange(z)
+        if x < r.minX or x > r.maxX or y < r.minY or y > r.maxY:
+            return False
+        return bool(bitmap[y - r.minY, x - r.minX])
+
+    def numberOfTiles(self):
+        return int(sum(b.sum() for b in self.bitmaps.values()))
+
+    def filter(self, tiles, tileXYZ=lambda t: t[1]):
+        for tile in tiles:
+            if tileXYZ(tile) not in self:
+                yield tile
+
+    # Bitmaps are stored packed, with the position of their first tile
+    def save(self, path):
+        arrays = {}
+        for zoom, bitmap in self.bitmaps.iteritems():
+            r = self.planner.zoomRange(zoom)
+            arrays['z%s' % zoom] = numpy.packbits(bitmap, axis=None)
+            arrays['z%s_range' % zoom] = numpy.array(
+                [r.minX, r.minY, r.xCount, r.yCount], dtype=numpy.int64)
+        # The file is replaced atomically
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            numpy.savez_compressed(f, **arrays)
+        os.rename(tmpPath, path)
+
+    def loadBitmaps(self, path):
+        arrays = numpy.load(path)
+        for name in arrays.files:
+            if name.endswith('_range'):
+                continue
+            zoom = int(name[1:])
+            minX, minY, xCount, yCount = arrays['%s_range' % name]
+            bits = numpy.unpackbits(arrays[name])[:xCount * yCount]
+            ys, xs = numpy.nonzero(bits.reshape((yCount, xCount)))
+            self.add(zoom, xs + minX, ys + minY)
+
+    # Merges the logs of the directory it was loaded from into its bitmaps
+    # file
+    def compact(self, directory):
+        logs = logFiles(directory)
+        self.save(os.path.join(directory, BITMAPS_FILE))
+        for path in logs:
+            os.remove(path)
+
+
+def logFiles(directory):
+    return sorted(glob.glob(os.path.join(directory, '*' + LOG_EXTENSION)))
+
+
+def logPath(directory, runId, pid):
+    return os.path.join(directory, '%s-%s%s' % (runId, pid, LOG_EXTENSION))
+
+
+# Removes the checkpoints of a previous run
+def clearDirectory(directory):
+    for path in logFiles(directory) + [os.path.join(directory, BITMAPS_FILE)]:
+        if os.path.exists(path):
+            os.remove(path)
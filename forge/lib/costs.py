@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import glob
+from sqlalchemy.sql.expression import text
+
+
+# Cost models predict the relative amount of work needed to create a tile.
+# The unit is arbitrary: an empty tile (one query round) costs about 1.
+# A deterministic model predicts the same costs on every machine, as the
+# shards require (see forge.lib.shards).
+class UniformCostModel:
+
+    deterministic = True
+
+    def cost(self, tileXYZ):
+        return 1.0
+
+
+class DensityCostModel:
+
+    # Number of triangles costing as much as one query round
+    TRIANGLES_PER_QUERY = 1000.0
+
+    deterministic = True
+
+    # counts: {tablename: {(x, y): nb of triangles}} at densityZoom
+    def __init__(self, counts, densityZoom, tablenameByZoom):
+        self.counts = counts
+        self.densityZoom = densityZoom
+        self.tablenameByZoom = tablenameByZoom
+        self._aggregated = {}
+
+    # Density grid of a table coarsened to a zoom lower than densityZoom
+    def _countsAtZoom(self, tablename, zoom):
+        key = (tablename, zoom)
+        if key not in self._aggregated:
+            shift = self.densityZoom - zoom
+            aggregated = {}
+            for (x, y), count in self.counts.get(tablename, {}).iteritems():
+                cell = (x >> shift, y >> shift)
+                aggregated[cell] = aggregated.get(cell, 0) + count
+            self._aggregated[key] = aggregated
+        return self._aggregated[key]
+
+    def triangles(self, tileXYZ):
+        x, y, z = tileXYZ
+        tablename = self.tablenameByZoom.get(z)
+        if z >= self.densityZoom:
+            shift = z - self.densityZoom
+            count = self.counts.get(tablename, {}).get(
+                (x >> shift, y >> shift), 0)
+            return float(count) / (4 ** shift)
+        return float(self._countsAtZoom(tablename, z).get((x, y), 0))
+
+    def cost(self, tileXYZ):
+        return 1.0 + self.triangles(tileXYZ) / self.TRIANGLES_PER_QUERY
+
+    @classmethod
+    def fromDB(cls, session, models, bounds, densityZoom, samplePercent=1.0):
+        # models: {zoom: model}
+        counts = {}
+        tablenameByZoom = {}
+        for zoom, model in models.iteritems():
+            tablename = model.__tablename__
+            tablenameByZoom[zoom] = tablename
+            if tablename not in counts:
+                counts[tablename] = sampledDensity(
+                    session, model, bounds, densityZoom, samplePercent)
+        return cls(counts, densityZoom, tablenameByZoom)
+
+
+# Exact number of triangles per tile, read from the tile index
+# (see forge.lib.tile_index)
+class TileIndexCostModel:
+
+    TRIANGLES_PER_QUERY = DensityCostModel.TRIANGLES_PER_QUERY
+
+    deterministic = True
+
+    # counts: {(x, y, z): nb of triangles}, tiles without triangles are missing
+    def __init__(self, counts):
+        self.counts = counts
+
+    def triangles(self, tileXYZ):
+        return float(self.counts.get(tuple(tileXYZ), 0))
+
+    def cost(self, tileXYZ):
+        return 1.0 + self.triangles(tileXYZ) / self.TRIANGLES_PER_QUERY
+
+
+# Seed of the table sample, every machine samples the same blocks
+SAMPLE_SEED = 0
+
+
+# Triangles per tile of the global geodetic TMS grid at a given zoom,
+# estimated from a sample of the table
+def sampledDensity(session, model, bounds, zoom, samplePercent):
+    tileSize = 180.0 / 2 ** zoom
+    query = text(
+        "SELECT floor((ST_XMin(%(geom)s) + 180.0) / :tileSize) AS x, "
+        "floor((ST_YMin(%(geom)s) + 90.0) / :tileSize) AS y, count(*) "
+        "FROM %(schema)s.%(table)s TABLESAMPLE SYSTEM (:percent) "
+        "REPEATABLE (:seed) "
+        "WHERE %(geom)s && ST_MakeEnvelope("
+        ":minX, :minY, :maxX, :maxY, 4326) "
+        "GROUP BY 1, 2" % dict(
+            geom='the_geom',
+            schema=model.__table_args__['schema'],
+            table=model.__tablename__
+        )
+    )
+    scale = 100.0 / samplePercent
+    density = {}
+    for x, y, count in session.execute(query, dict(
+            tileSize=tileSize, percent=samplePercent, seed=SAMPLE_SEED,
+            minX=bounds[0], minY=bounds[1], maxX=bounds[2], maxY=bounds[3])):
+        density[(int(x), int(y))] = count * scale
+    return density
+
+
+# The timings are read from the logs of the local machine
+class TimingsCostModel:
+
+    deterministic = False
+
+    # timings: {(x, y, z): seconds}
+    def __init__(self, timings, fallback=None):
+        self.timings = timings
+        self.fallback = fallback
+        # Mean time per zoom for the tiles missing in the timings
+        sums = {}
+        for (x, y, z), seconds in timings.iteritems():
+            total, n = sums.get(z, (0.0, 0))
+            sums[z] = (total + seconds, n + 1)
+        self.meanByZoom = dict(
+            (z, total / n) for z, (total, n) in sums.iteritems())
+        nbTimings = len(timings)
+        self.mean = sum(timings.itervalues()) / nbTimings \
+            if nbTimings > 0 else 1.0
+
+    def cost(self, tileXYZ):
+        tileXYZ = tuple(tileXYZ)
+        if tileXYZ in self.timings:
+            return self.timings[tileXYZ]
+        if self.fallback is not None:
+            return self.fallback.cost(tileXYZ)
+        return self.meanByZoom.get(tileXYZ[2], self.mean)
+
+    @classmethod
+    def fromLogs(cls, pattern, fallback=None):
+        timings = {}
+        for path in sorted(glob.glob(pattern)):
+            with open(path) as f:
+                for line in f:
+                    parsed = parseTiming(line)
+                    if parsed is not None:
+                        timings[parsed[0]] = parsed[1]
+        return cls(timings, fallback=fallback)
+
+
+# One line per tile: z x y seconds nbGeoms
+def formatTiming(tileXYZ, seconds, nbGeoms):
+    return '%s %s %s %.4f %s\n' % (
+        tileXYZ[2], tileXYZ[0], tileXYZ[1], seconds, nbGeoms)
+
+
+def parseTiming(line):
+    parts = line.split()
+    if len(parts) < 4:
+        return None
+    try:
+        z, x, y = int(parts[0]), int(parts[1]), int(parts[2])
+        seconds = float(parts[3])
+    except ValueError:
+        return None
+    return ((x, y, z), seconds)
+
+
+# Groups the tiles in chunks of roughly targetCost predicted work.
+# The tiles are streamed, only one chunk is kept in memory at a time.
+def balancedChunks(tiles, costModel, targetCost, maxTiles=None,
+                   tileXYZ=lambda t: t[1]):
+    chunk = []
+    chunkCost = 0.0
+    for tile in tiles:
+        chunk.append(tile)
+        chunkCost += costModel.cost(tileXYZ(tile))
+        if chunkCost >= targetCost or \
+                (maxTiles is not None and len(chunk) >= maxTiles):
+            yield chunk
+            chunk = []
+            chunkCost = 0.0
+    if chunk:
+        yield chunk
+
+
+def totalCost(tiles, costModel, tileXYZ=lambda t: t[1]):
+    return sum(costModel.cost(tileXYZ(t)) for t in tiles)
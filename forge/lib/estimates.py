@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+from forge.models import estimatedRowCountLiteral, estimatedExtentLiteral, \
+    sampledBBoxCountLiteral, partitionsLiteral
+
+
+# z value of the 95% confidence interval
+Z95 = 1.96
+
+
+class FeatureEstimate:
+
+    def __init__(self, count, low, high, method):
+        self.count = int(round(count))
+        self.low = int(math.floor(low))
+        self.high = int(math.ceil(high))
+        # One of 'exact', 'extent' or 'sample'
+        self.method = method
+
+    def perTile(self, nbTiles):
+        if nbTiles <= 0:
+            return None
+        return FeatureEstimate(
+            float(self.count) / nbTiles,
+            float(self.low) / nbTiles,
+            float(self.high) / nbTiles,
+            self.method)
+
+    def __repr__(self):
+        return 'FeatureEstimate(%s [%s, %s], %s)' % (
+            self.count, self.low, self.high, self.method)
+
+
+def exactEstimate(count):
+    return FeatureEstimate(count, count, count, 'exact')
+
+
+# Normal approximation of the binomial proportion of sampled rows
+# intersecting the bounds, scaled to the total number of rows
+def estimateFromSample(total, nbSampled, nbHits, z=Z95):
+    if nbSampled <= 0:
+        raise ValueError('An estimate requires at least one sampled row')
+    ratio = float(nbHits) / nbSampled
+    margin = z * math.sqrt(ratio * (1.0 - ratio) / nbSampled)
+    # Keep a margin of at least one row when no variance was observed
+    if margin == 0:
+        margin = 1.0 / nbSampled
+    low = max(0.0, ratio - margin) * total
+    high = min(1.0, ratio + margin) * total
+    return FeatureEstimate(ratio * total, low, high, 'sample')
+
+
+def containsExtent(bounds, extent):
+    return bounds[0] <= extent[0] and bounds[1] <= extent[1] and \
+        bounds[2] >= extent[2] and bounds[3] >= extent[3]
+
+
+def intersectsExtent(bounds, extent):
+    return bounds[0] <= extent[2] and bounds[2] >= extent[0] and \
+        bounds[1] <= extent[3] and bounds[3] >= extent[1]
+
+
+def unionExtents(extents):
+    if len(extents) == 0:
+        return None
+    return (
+        min(e[0] for e in extents), min(e[1] for e in extents),
+        max(e[2] for e in extents), max(e[3] for e in extents))
+
+
+class FeatureEstimator:
+
+    def __init__(self, session, samplePercent=1.0):
+        self.session = session
+        self.samplePercent = samplePercent
+        # Several zooms usually share the same table
+        self._cache = {}
+
+    def _estimatedExtent(self, schema, table):
+        try:
+            extent = tuple(self.session.execute(
+                estimatedExtentLiteral(schema, table)).fetchone())
+        except Exception:
+            # No statistics available on the geometry column
+            self.session.rollback()
+            return None
+        if None in extent:
+            return None
+        return extent
+
+    def _tableStats(self, model):
+        schema = model.__table_args__['schema']
+        table = model.__tablename__
+        key = '%s.%s' % (schema, table)
+        if key not in self._cache:
+            total = self.session.execute(
+                estimatedRowCountLiteral(schema, table)).scalar()
+            extent = None
+            if total is not None and total > 0:
+                partitions = self.session.execute(
+                    partitionsLiteral(schema, table)).fetchall()
+                if len(partitions) > 0:
+                    # The statistics of a partitioned table are the ones of
+                    # its partitions, empty partitions have no extent
+                    extents = [self._estimatedExtent(s, t)
+                               for (s, t, count) in partitions if count > 0]
+                    if None not in extents:
+                        extent = unionExtents(extents)
+                else:
+                    extent = self._estimatedExtent(schema, table)
+            self._cache[key] = (total, extent)
+        return self._cache[key]
+
+    def exact(self, model, bounds):
+        return exactEstimate(self.session.query(model).filter(
+            model.bboxIntersects(bounds)
+        ).count())
+
+    def estimate(self, model, bounds):
+        (total, extent) = self._tableStats(model)
+        # Table never analyzed (or empty): nothing to extrapolate from
+        if total is None or total <= 0:
+            return self.exact(model, bounds)
+        if extent is not None:
+            if containsExtent(bounds, extent):
+                return FeatureEstimate(total, total, total, 'extent')
+            if not intersectsExtent(bounds, extent):
+                return FeatureEstimate(0, 0, 0, 'extent')
+        (nbSampled, nbHits) = self.session.execute(
+            sampledBBoxCountLiteral(
+                model.__table_args__['schema'], model.__tablename__),
+            dict(minX=bounds[0], minY=bounds[1], maxX=bounds[2],
+                 maxY=bounds[3], percent=self.samplePercent)
+        ).fetchone()
+        # Small tables may produce empty samples, count them instead
+        if nbSampled == 0:
+            return self.exact(model, bounds)
+        return estimateFromSample(total, nbSampled, nbHits)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import math
+import numpy
+from shapely import wkt
+from shapely.geometry import box
+from shapely.ops import unary_union
+from shapely.prepared import prep
+
+
+# Lower left corner of the global geodetic TMS grid
+GRID_MINX = -180.0
+GRID_MINY = -90.0
+
+
+def _parts(geometry):
+    if geometry.is_empty:
+        return
+    if hasattr(geometry, 'geoms'):
+        for g in geometry.geoms:
+            for part in _parts(g):
+                yield part
+    else:
+        yield geometry
+
+
+# The polygon(s) (EPSG:4326) outside of which no tile is generated
+class Footprint:
+
+    def __init__(self, geometry):
+        self.geometry = geometry
+        self.prepared = prep(geometry)
+        self._masks = {}
+
+    @classmethod
+    def fromWKT(cls, wktString):
+        return cls(wkt.loads(wktString))
+
+    @classmethod
+    def fromShapefile(cls, shpFilePath):
+        from forge.lib.shapefile_utils import ShpToGDALFeatures
+        shp = ShpToGDALFeatures(shpFilePath)
+        geometries = []
+        for feature in shp.getFeatures():
+            ogrGeom = feature.GetGeometryRef()
+            ogrGeom.FlattenTo2D()
+            geometries.append(wkt.loads(ogrGeom.ExportToWkt()))
+        return cls(unary_union(geometries))
+
+    # Accepts a WKT string or a path to a shapefile, returns None if the
+    # footprint option is missing or empty
+    @classmethod
+    def fromConfig(cls, tmsConfig):
+        if not tmsConfig.has_option('Extent', 'footprint'):
+            return None
+        value = tmsConfig.get('Extent', 'footprint').strip()
+        if not value:
+            return None
+        if os.path.exists(value):
+            return cls.fromShapefile(value)
+        return cls.fromWKT(value)
+
+    # Boolean array of shape (yCount, xCount) flagging the tiles of
+    # a planner.ZoomRange intersecting the footprint.
+    # Within a row of tiles, a tile intersects the footprint if its x span
+    # overlaps the x span of one connected part of the footprint clipped
+    # to the row, so only one intersection is computed per row.
+    def mask(self, zRange):
+        key = (zRange.zoom, zRange.minX, zRange.minY, zRange.maxX, zRange.maxY)
+        if key in self._masks:
+            return self._masks[key]
+
+        size = zRange.tileSize
+        mask = numpy.zeros((zRange.yCount, zRange.xCount), dtype=bool)
+        minLon = GRID_MINX + zRange.minX * size
+        maxLon = GRID_MINX + (zRange.maxX + 1) * size
+        for y in xrange(zRange.minY, zRange.maxY + 1):
+            row = box(
+                minLon, GRID_MINY + y * size,
+                maxLon, GRID_MINY + (y + 1) * size)
+            if not self.prepared.intersects(row):
+                continue
+            for part in _parts(self.geometry.intersection(row)):
+                bounds = part.bounds
+                x0 = int(math.floor((bounds[0] - GRID_MINX) / size))
+                x1 = int(math.floor((bounds[2] - GRID_MINX) / size))
+                x0 = max(x0, zRange.minX) - zRange.minX
+                x1 = min(x1, zRange.maxX) - zRange.minX
+                mask[y - zRange.minY, x0:x1 + 1] = True
+        self._masks[key] = mask
+        return mask
+
+    def contains(self, zRange, x, y):
+        return bool(self.mask(zRange)[y - zRange.minY, x - zRange.minX])
+
+    def numberOfTiles(self, zRange):
+        return int(self.mask(zRange).sum())
@@ -108,33 +108,43 @@ class Bulk:
         self.n = self.n + 1
         self.rows.append(row)
 
-    def commit(self, model, session):
+    def flush(self, model, session):
         if self.n > 0:
             session.bulk_insert_mappings(
                 model,
                 self.rows
             )
-            session.commit()
             self.n = 0
             self.rows = list()
 
+    def commit(self, model, session):
+        if self.n > 0:
+            self.flush(model, session)
+            session.commit()
+
 
 class BulkInsert:
 
     NO_LIMIT = float('inf')
 
-    def __init__(self, model, session, withAutoCommit=None):
+    # With inTransaction, rows are only flushed, the caller commits
+    def __init__(self, model, session, withAutoCommit=None,
+                 inTransaction=False):
         self.model = model
         self.session = session
         self.autoCommit = withAutoCommit if withAutoCommit is not None else \
             BulkInsert.NO_LIMIT
+        self.inTransaction = inTransaction
         self.bulk = Bulk()
 
     def add(self, row):
         if self.bulk.n < self.autoCommit:
             self.bulk.add(row)
         else:
-            self.bulk.commit(self.model, self.session)
+            if self.inTransaction:
+                self.bulk.flush(self.model, self.session)
+            else:
+                self.bulk.commit(self.model, self.session)
             self.bulk = Bulk([row])
 
     def addN(self, rows):
@@ -142,5 +152,8 @@ class BulkInsert:
             self.add(row)
 
     def commit(self):
-        self.bulk.commit(self.model, self.session)
+        if self.inTransaction:
+            self.bulk.flush(self.model, self.session)
+        else:
+            self.bulk.commit(self.model, self.session)
         self.bulk = Bulk([])
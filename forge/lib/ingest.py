@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+
+
+# Files of a shapefile whose content is loaded in the database
+SHAPEFILE_EXTENSIONS = ['.shp', '.shx', '.dbf', '.prj']
+
+# What populate does with a shapefile
+SKIP = 'skip'
+LOAD = 'load'
+REPLACE = 'replace'
+
+
+def _shapefileFiles(shpFilePath):
+    base = os.path.splitext(shpFilePath)[0]
+    return [base + ext for ext in SHAPEFILE_EXTENSIONS
+            if os.path.exists(base + ext)]
+
+
+# Total size and last modification of the files of a shapefile,
+# cheap to compute and enough to tell that a shapefile did not change
+def shapefileStat(shpFilePath):
+    size = 0
+    mtime = 0.0
+    for path in _shapefileFiles(shpFilePath):
+        stat = os.stat(path)
+        size += stat.st_size
+        mtime = max(mtime, stat.st_mtime)
+    return (size, mtime)
+
+
+def shapefileChecksum(shpFilePath, blockSize=1 << 20):
+    md5 = hashlib.md5()
+    for path in _shapefileFiles(shpFilePath):
+        md5.update(os.path.splitext(path)[1])
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(blockSize), ''):
+                md5.update(block)
+    return md5.hexdigest()
+
+
+# Returns the action and the checksum of a shapefile. registered is the
+# record of its previous ingestion (checksum, size and mtime) or None.
+# The content is only hashed when the size or the mtime changed.
+def ingestAction(registered, shpFilePath, force=False):
+    if registered is None:
+        return (LOAD, shapefileChecksum(shpFilePath))
+    if not force and \
+            (registered.size, registered.mtime) == shapefileStat(shpFilePath):
+        return (SKIP, registered.checksum)
+    checksum = shapefileChecksum(shpFilePath)
+    if not force and checksum == registered.checksum:
+        return (SKIP, checksum)
+    return (REPLACE, checksum)
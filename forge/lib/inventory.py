@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+
+# One line per key
+def formatTSV(name, size, modified):
+    return '%s\t%s\t%s\n' % (name, size, modified)
+
+
+def formatJSONL(name, size, modified):
+    return json.dumps(dict(name=name, size=size, modified=modified)) + '\n'
+
+
+FORMATS = {
+    'tsv': formatTSV,
+    'jsonl': formatJSONL
+}
+
+
+# Zoom of a tile key (basePath/z/x/y.terrain), None for the other keys
+def zoomOf(name, basePath):
+    if not name.startswith(basePath):
+        return None
+    first = name[len(basePath):].split('/', 1)[0]
+    try:
+        return int(first)
+    except ValueError:
+        return None
+
+
+# Number of keys and size of the objects per zoom, in constant memory
+class InventorySummary:
+
+    def __init__(self):
+        # zoom: [nb of keys, total size, max size]
+        self.zooms = {}
+
+    def add(self, zoom, size):
+        stats = self.zooms.get(zoom)
+        if stats is None:
+            stats = self.zooms[zoom] = [0, 0, 0]
+        stats[0] += 1
+        stats[1] += size
+        stats[2] = max(stats[2], size)
+
+    @property
+    def nbKeys(self):
+        return sum(stats[0] for stats in self.zooms.itervalues())
+
+    @property
+    def totalSize(self):
+        return sum(stats[1] for stats in self.zooms.itervalues())
+
+    _lineFormat = '%6s %12s %16s %12s %12s'
+
+    def _line(self, label, nbKeys, total, maxSize):
+        mean = total / nbKeys if nbKeys > 0 else 0
+        return self._lineFormat % (label, nbKeys, total, mean, maxSize)
+
+    def __str__(self):
+        lines = [self._lineFormat % (
+            'zoom', 'keys', 'total size', 'mean size', 'max size')]
+        # The keys which are not tiles come last
+        for zoom in sorted(self.zooms, key=lambda z: (z is None, z)):
+            (nbKeys, total, maxSize) = self.zooms[zoom]
+            lines.append(self._line(
+                'other' if zoom is None else zoom, nbKeys, total, maxSize))
+        maxSize = max([stats[2] for stats in self.zooms.values()] + [0])
+        lines.append(self._line('all', self.nbKeys, self.totalSize, maxSize))
+        return '\n'.join(lines)
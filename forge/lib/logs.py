@@ -1,12 +1,186 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
+import atexit
+import threading
 import logging
 import logging.config
+import ConfigParser
+import multiprocessing
 
 
-def getLogger(config, name, suffix=''):
-    logFile = config.get('Logging', 'logfile')
-    logging.config.fileConfig('logging.cfg', defaults=dict(
-        logfile=logFile % dict(timestamp=suffix)
-    ))
-    return logging.getLogger(name)
+_configured = False
+# Process having applied the configuration, forked workers inherit it
+_configuredPid = None
+_configureLock = threading.Lock()
+
+# Records of the workers, see startLogListener
+_queue = None
+_listener = None
+
+
+# logging.cfg is read and applied once per process, when a message is first
+# logged. The log file is named after the suffix of the first logger used.
+# The workers forked once the log listener is started send their records
+# to it instead of writing the files themselves.
+def configureLogging(suffix=''):
+    global _configured, _configuredPid
+    with _configureLock:
+        if _configuredPid == os.getpid():
+            return
+        if not _configured:
+            config = ConfigParser.RawConfigParser()
+            config.read('logging.cfg')
+            logFile = config.get('Logging', 'logfile')
+            logging.config.fileConfig('logging.cfg', defaults=dict(
+                logfile=logFile % dict(timestamp=suffix)
+            ))
+            _configured = True
+        elif _queue is not None:
+            _sendToQueue(_queue)
+        _configuredPid = os.getpid()
+
+
+# The loggers having handlers (see logging.cfg) hand their records to the
+# queue instead
+def _sendToQueue(queue):
+    handler = QueueHandler(queue)
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)]
+    for logger in loggers:
+        if logger.handlers:
+            # Not closed, the files still belong to the listener
+            logger.handlers = [handler]
+
+
+# Stands for the logger of a module, importing the module has no side
+# effect
+class LazyLogger:
+
+    def __init__(self, name, suffix=''):
+        self.name = name
+        self.suffix = suffix
+
+    def __getattr__(self, attr):
+        if _configuredPid != os.getpid():
+            configureLogging(self.suffix)
+        return getattr(logging.getLogger(self.name), attr)
+
+
+def getLogger(name, suffix=''):
+    return LazyLogger(name, suffix=suffix)
+
+
+# Hands the records to a multiprocessing queue without ever blocking: when
+# the queue is full the record is dropped and counted, the number of
+# dropped records is reported with the next one.
+class QueueHandler(logging.Handler):
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    # Records are pickled, the message and the traceback are formatted
+    # here
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        if self.dropped:
+            record.msg = '%s (%s log records dropped)' % (
+                record.msg, self.dropped)
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+            self.dropped = 0
+        except Exception:
+            self.dropped += 1
+
+
+# Writes the records of the workers with the handlers of the process which
+# forked them, in a thread
+class LogListener:
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._thread = threading.Thread(target=self._listen)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            logger = logging.getLogger(record.name)
+            if logger.isEnabledFor(record.levelno):
+                logger.handle(record)
+
+    # Writes the records still in the queue
+    def stop(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+# To be called before forking workers: their records are sent through a
+# queue to a single listener of this process, so that the workers never
+# wait on the files and the lines of the workers are not interleaved
+def startLogListener(suffix='', maxRecords=10000):
+    global _queue, _listener
+    if _listener is not None:
+        return _listener
+    configureLogging(suffix)
+    _queue = multiprocessing.Queue(maxRecords)
+    _listener = LogListener(_queue)
+    _listener.start()
+    atexit.register(stopLogListener)
+    return _listener
+
+
+def stopLogListener():
+    global _queue, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _queue = None
+    _listener = None
+
+
+# Logs a summary of frequent events (e.g. skipped tiles) at most every
+# interval seconds instead of a message per event. message is formatted
+# with the number of events since the last summary (count), the pid and the
+# fields of the last event.
+class LogSummary:
+
+    def __init__(self, logger, message, interval=10, level=logging.INFO):
+        self.logger = logger
+        self.message = message
+        self.interval = interval
+        self.level = level
+        self.count = 0
+        self.fields = {}
+        self._last = time.time()
+
+    def add(self, **fields):
+        self.count += 1
+        self.fields = fields
+        if time.time() - self._last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        self._last = time.time()
+        if not self.count:
+            return
+        self.logger.log(self.level, self.message % dict(
+            self.fields, count=self.count, pid=os.getpid()))
+        self.count = 0
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# Work messages exchanged through the tiles queue.
+#
+# Legacy format: comma separated x,y,z triplets
+#     133,98,7,134,98,7
+# Version 2: a version token followed by rectangles of tiles
+#     v2;z,minX,minY,maxX,maxY;z,minX,minY,maxX,maxY
+# Workers raise MessageVersionError for versions they do not know, so that
+# the message can be left in the queue for an up to date worker.
+
+VERSION = 2
+
+
+class MessageVersionError(Exception):
+    pass
+
+
+class TileRectangle:
+
+    def __init__(self, zoom, minX, minY, maxX, maxY):
+        self.zoom = zoom
+        self.minX = minX
+        self.minY = minY
+        self.maxX = maxX
+        self.maxY = maxY
+
+    @property
+    def nbTiles(self):
+        return (self.maxX - self.minX + 1) * (self.maxY - self.minY + 1)
+
+    def __iter__(self):
+        for y in xrange(self.minY, self.maxY + 1):
+            for x in xrange(self.minX, self.maxX + 1):
+                yield (x, y, self.zoom)
+
+    def __eq__(self, other):
+        return self.toTuple() == other.toTuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def toTuple(self):
+        return (self.zoom, self.minX, self.minY, self.maxX, self.maxY)
+
+    def __repr__(self):
+        return 'TileRectangle%s' % (self.toTuple(),)
+
+
+# Covers a set of (x, y, z) tiles with rectangles: consecutive tiles of a
+# row form runs and identical runs of consecutive rows are merged.
+def toRectangles(tilesXYZ):
+    rows = {}
+    for x, y, z in tilesXYZ:
+        rows.setdefault(z, {}).setdefault(y, []).append(x)
+
+    rectangles = []
+    for z in sorted(rows):
+        # Rectangles still growing over y, keyed by their run (minX, maxX)
+        opened = {}
+        previousY = None
+        for y in sorted(rows[z]):
+            runs = []
+            xs = sorted(set(rows[z][y]))
+            start = xs[0]
+            for i in xrange(1, len(xs)):
+                if xs[i] != xs[i - 1] + 1:
+                    runs.append((start, xs[i - 1]))
+                    start = xs[i]
+            runs.append((start, xs[-1]))
+
+            stillOpened = {}
+            for run in runs:
+                if previousY == y - 1 and run in opened:
+                    rectangle = opened.pop(run)
+                    rectangle.maxY = y
+                else:
+                    rectangle = TileRectangle(z, run[0], y, run[1], y)
+                stillOpened[run] = rectangle
+            rectangles += opened.values()
+            opened = stillOpened
+            previousY = y
+        rectangles += opened.values()
+    rectangles.sort(key=lambda r: (r.zoom, r.minY, r.minX))
+    return rectangles
+
+
+def encodeTiles(tilesXYZ):
+    parts = ['v%s' % VERSION]
+    for r in toRectangles(tilesXYZ):
+        parts.append('%s,%s,%s,%s,%s' % r.toTuple())
+    return ';'.join(parts)
+
+
+def encodeLegacyTiles(tilesXYZ):
+    return ','.join('%s,%s,%s' % tuple(t) for t in tilesXYZ)
+
+
+# Returns the list of TileRectangle described by a message body.
+# Raises MessageVersionError for an unknown version and ValueError
+# for a malformed body.
+def decodeRectangles(body):
+    body = body.strip()
+    if not body.startswith('v'):
+        values = map(int, body.split(','))
+        if len(values) % 3 != 0:
+            raise ValueError('Legacy message must contain x,y,z triplets')
+        return [
+            TileRectangle(values[i + 2], values[i], values[i + 1],
+                          values[i], values[i + 1])
+            for i in xrange(0, len(values), 3)
+        ]
+
+    parts = body.split(';')
+    try:
+        version = int(parts[0][1:])
+    except ValueError:
+        raise ValueError('Invalid message version %s' % parts[0])
+    if version != VERSION:
+        raise MessageVersionError(
+            'Unsupported message version %s (supported: %s)' % (
+                version, VERSION))
+
+    rectangles = []
+    for part in parts[1:]:
+        values = map(int, part.split(','))
+        if len(values) != 5:
+            raise ValueError('Invalid rectangle %s' % part)
+        rectangle = TileRectangle(*values)
+        if rectangle.minX > rectangle.maxX or rectangle.minY > rectangle.maxY:
+            raise ValueError('Invalid rectangle %s' % part)
+        rectangles.append(rectangle)
+    return rectangles
+
+
+def decodeTiles(body):
+    for rectangle in decodeRectangles(body):
+        for tileXYZ in rectangle:
+            yield tileXYZ
+
+
+def nbTilesInMessage(body):
+    return sum(r.nbTiles for r in decodeRectangles(body))
+
+
+# Encodes tiles in one or more bodies of at most maxSize characters
+def encodeTilesWithin(tilesXYZ, maxSize):
+    tilesXYZ = list(tilesXYZ)
+    body = encodeTiles(tilesXYZ)
+    if len(body) <= maxSize or len(tilesXYZ) <= 1:
+        return [body]
+    half = len(tilesXYZ) // 2
+    return encodeTilesWithin(tilesXYZ[:half], maxSize) + \
+        encodeTilesWithin(tilesXYZ[half:], maxSize)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+
+# Coarse cells of the global geodetic TMS grid used as list partitions of
+# the pyramid tables (see partitionZoom in database.cfg).
+#
+# A triangle is stored in the cell of the lower left corner of its bbox, so
+# a triangle intersecting an extent has its corner in one of the cells
+# covering the extent or in the cells just left of and below them. The
+# triangles wider or higher than a cell go to the default partition, which
+# is always searched.
+class PartitionGrid:
+
+    DEFAULT_KEY = -1
+
+    def __init__(self, zoom):
+        self.zoom = zoom
+        self.cellSize = 180.0 / 2 ** zoom
+        self.nbColumns = 2 ** (zoom + 1)
+        self.nbRows = 2 ** zoom
+
+    def _column(self, lon):
+        column = int(math.floor((lon + 180.0) / self.cellSize))
+        return min(max(column, 0), self.nbColumns - 1)
+
+    def _row(self, lat):
+        row = int(math.floor((lat + 90.0) / self.cellSize))
+        return min(max(row, 0), self.nbRows - 1)
+
+    def cellKey(self, column, row):
+        return row * self.nbColumns + column
+
+    def cell(self, key):
+        return (key % self.nbColumns, key // self.nbColumns)
+
+    def cellBounds(self, key):
+        (column, row) = self.cell(key)
+        return (
+            -180.0 + column * self.cellSize,
+            -90.0 + row * self.cellSize,
+            -180.0 + (column + 1) * self.cellSize,
+            -90.0 + (row + 1) * self.cellSize
+        )
+
+    # Partition of a triangle given its bbox (minX, minY, maxX, maxY)
+    def key(self, bbox):
+        (minX, minY, maxX, maxY) = bbox
+        if maxX - minX > self.cellSize or maxY - minY > self.cellSize:
+            return self.DEFAULT_KEY
+        return self.cellKey(self._column(minX), self._row(minY))
+
+    # Cells covering an extent
+    def cellsIntersecting(self, bbox):
+        (minX, minY, maxX, maxY) = bbox
+        return [
+            self.cellKey(column, row)
+            for row in xrange(self._row(minY), self._row(maxY) + 1)
+            for column in xrange(self._column(minX), self._column(maxX) + 1)
+        ]
+
+    # Partitions possibly holding triangles intersecting an extent
+    def keysIntersecting(self, bbox):
+        (minX, minY, maxX, maxY) = bbox
+        keys = self.cellsIntersecting(
+            (minX - self.cellSize, minY - self.cellSize, maxX, maxY))
+        return keys + [self.DEFAULT_KEY]
+
+    @classmethod
+    def partitionName(cls, tablename, key):
+        if key == cls.DEFAULT_KEY:
+            return '%s_default' % tablename
+        return '%s_p%s' % (tablename, key)
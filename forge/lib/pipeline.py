@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+# Thread pipelines for the bucket operations (copy, sync, delete...).
+# These are I/O bound: many requests are kept in flight by threads, each
+# thread reusing its own connection (see boto_conn.threadBucket).
+
+import time
+import Queue
+import threading
+
+
+# Counter updated by many threads without any lock: each thread increments
+# its own slot, the value is the sum of the slots
+class ThreadCounter:
+
+    def __init__(self):
+        self._local = threading.local()
+        self._slots = []
+        # Only taken once per thread, when its slot is created
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        try:
+            slot = self._local.slot
+        except AttributeError:
+            slot = self._local.slot = [0]
+            with self._lock:
+                self._slots.append(slot)
+        slot[0] += n
+
+    @property
+    def value(self):
+        return sum(slot[0] for slot in list(self._slots))
+
+
+# Calls call until it succeeds, waiting longer after each retryable error
+# (e.g. S3 SlowDown), other errors are raised right away
+def retry(call, retryable, retries=5, delay=0.1, maxDelay=10):
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            if attempt >= retries or not retryable(e):
+                raise
+        time.sleep(min(delay * 2 ** attempt, maxDelay))
+        attempt += 1
+
+
+# Limits the rate of the requests of all the threads (token bucket).
+# rate is in requests per second, None for no limit.
+class RateLimiter:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    # Waits until n requests can be made
+    def acquire(self, n=1):
+        if not self.rate:
+            return
+        n = min(n, self.capacity)
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return
+                wait = (n - self._tokens) / float(self.rate)
+            time.sleep(wait)
+
+
+_END = object()
+
+
+# Iterates over an iterable consumed ahead by a thread, e.g. to list
+# several prefixes of a bucket at the same time. Errors of the thread are
+# raised by the iteration.
+def background(iterable, queueSize=10000):
+    q = Queue.Queue(queueSize)
+    error = []
+
+    def produce():
+        try:
+            for item in iterable:
+                q.put(item)
+        except Exception as e:
+            error.append(e)
+        finally:
+            q.put(_END)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = q.get()
+        if item is _END:
+            break
+        yield item
+    if error:
+        raise error[0]
+
+
+# Runs work(item) on nbWorkers threads for the items of several sources
+# (iterables, e.g. key listings). The sources are consumed by nbProducers
+# threads through a bounded queue: producing and consuming overlap and the
+# memory stays bounded whatever the number of items.
+class Pipeline:
+
+    # Failures kept with their exception
+    maxErrors = 100
+
+    def __init__(self, work, nbWorkers=32, nbProducers=1, queueSize=10000):
+        self.work = work
+        self.nbWorkers = nbWorkers
+        self.nbProducers = nbProducers
+        self.queueSize = queueSize
+        self.done = ThreadCounter()
+        self.failed = ThreadCounter()
+        self.errors = []
+        self._producerError = None
+
+    def _produce(self, sources, q):
+        try:
+            while True:
+                try:
+                    source = sources.pop(0)
+                except IndexError:
+                    return
+                for item in source:
+                    q.put(item)
+        except Exception as e:
+            self._producerError = e
+            # Nothing left to produce by anyone
+            del sources[:]
+
+    def _consume(self, q):
+        while True:
+            item = q.get()
+            if item is _END:
+                return
+            try:
+                self.work(item)
+                self.done.add()
+            except Exception as e:
+                self.failed.add()
+                if len(self.errors) < self.maxErrors:
+                    self.errors.append((item, e))
+
+    @staticmethod
+    def _start(target, args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    # progress(done, failed) is called every progressInterval seconds.
+    # Returns the number of items processed, errors of the producers
+    # are raised once the workers stopped.
+    def run(self, sources, progress=None, progressInterval=10):
+        q = Queue.Queue(self.queueSize)
+        sources = list(sources)
+        producers = [
+            self._start(self._produce, (sources, q))
+            for i in xrange(0, self.nbProducers)]
+        workers = [
+            self._start(self._consume, (q,))
+            for i in xrange(0, self.nbWorkers)]
+
+        def wait(threads):
+            for thread in threads:
+                # join with a timeout so that the main thread stays
+                # interruptible and can report the progress
+                while thread.is_alive():
+                    thread.join(progressInterval)
+                    if progress is not None and thread.is_alive():
+                        progress(self.done.value, self.failed.value)
+
+        wait(producers)
+        for i in xrange(0, self.nbWorkers):
+            q.put(_END)
+        wait(workers)
+        if self._producerError is not None:
+            raise self._producerError
+        return self.done.value
+
+
+# Chains stages of threads through bounded queues, e.g. download, compress
+# and upload: each stage works on some items while the others work on other
+# items. stages are [(function, nbThreads)], an item goes through the
+# functions in order, each one receiving the result of the previous one.
+# A function returning None drops the item.
+class StagedPipeline:
+
+    # Failures kept with their exception
+    maxErrors = 100
+
+    def __init__(self, stages, queueSize=100):
+        self.stages = stages
+        self.queueSize = queueSize
+        # Items out of the last stage
+        self.done = ThreadCounter()
+        self.failed = ThreadCounter()
+        # (stage index, item, exception)
+        self.errors = []
+        self._feedError = None
+
+    def _feed(self, items, q):
+        try:
+            for item in items:
+                q.put(item)
+        except Exception as e:
+            self._feedError = e
+        finally:
+            for i in xrange(0, self.stages[0][1]):
+                q.put(_END)
+
+    def _work(self, index, inQ, outQ, finished):
+        function = self.stages[index][0]
+        try:
+            while True:
+                item = inQ.get()
+                if item is _END:
+                    return
+                try:
+                    result = function(item)
+                except Exception as e:
+                    self.failed.add()
+                    if len(self.errors) < self.maxErrors:
+                        self.errors.append((index, item, e))
+                    continue
+                if result is None:
+                    continue
+                if outQ is None:
+                    self.done.add()
+                else:
+                    outQ.put(result)
+        finally:
+            # The last thread of a stage to finish ends the next stage
+            with finished[1]:
+                finished[0] += 1
+                last = finished[0] == self.stages[index][1]
+            if last and outQ is not None:
+                for i in xrange(0, self.stages[index + 1][1]):
+                    outQ.put(_END)
+
+    # progress(done, failed) is called every progressInterval seconds.
+    # Returns the number of items out of the last stage.
+    def run(self, items, progress=None, progressInterval=10):
+        queues = [Queue.Queue(self.queueSize) for stage in self.stages]
+        threads = [Pipeline._start(self._feed, (items, queues[0]))]
+        for index, (function, nbThreads) in enumerate(self.stages):
+            outQ = queues[index + 1] if index + 1 < len(queues) else None
+            finished = [0, threading.Lock()]
+            threads += [
+                Pipeline._start(
+                    self._work, (index, queues[index], outQ, finished))
+                for i in xrange(0, nbThreads)]
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(progressInterval)
+                if progress is not None and thread.is_alive():
+                    progress(self.done.value, self.failed.value)
+        if self._feedError is not None:
+            raise self._feedError
+        return self.done.value
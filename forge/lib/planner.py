@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import math
+from gatilegrid import getTileGrid
+from gatilegrid.tilegrids import EPSG4326_METERS_PER_UNIT
+
+
+def tileGrid(bounds):
+    # Same grid definition as the one used by forge.lib.tiles.grid
+    return getTileGrid(4326)(
+        extent=bounds, originCorner='bottom-left', tmsCompatible=True)
+
+
+class ZoomRange:
+
+    def __init__(self, zoom, minX, minY, maxX, maxY, tileSize):
+        self.zoom = zoom
+        self.minX = minX
+        self.minY = minY
+        self.maxX = maxX
+        self.maxY = maxY
+        # Tile side in degrees
+        self.tileSize = tileSize
+
+    @property
+    def xCount(self):
+        return self.maxX - self.minX + 1
+
+    @property
+    def yCount(self):
+        return self.maxY - self.minY + 1
+
+    @property
+    def nbTiles(self):
+        return self.xCount * self.yCount
+
+    def __contains__(self, tileXY):
+        x, y = tileXY
+        return self.minX <= x <= self.maxX and self.minY <= y <= self.maxY
+
+    def __repr__(self):
+        return 'ZoomRange(%s, x=[%s, %s], y=[%s, %s])' % (
+            self.zoom, self.minX, self.maxX, self.minY, self.maxY)
+
+    # Approximate length in meters of the diagonal of a tile
+    # centered at a given latitude (equirectangular approximation)
+    def tileDiagonal(self, lat):
+        side = self.tileSize * EPSG4326_METERS_PER_UNIT
+        dx = side * math.cos(math.radians(lat))
+        return math.sqrt(dx * dx + side * side)
+
+
+# Pure arithmetic description of the tile pyramid covering an extent.
+# No database nor any I/O is involved.
+# An optional footprint.Footprint restricts the tiles to the ones
+# intersecting a polygon.
+class TileRangePlanner:
+
+    def __init__(self, bounds, minZoom, maxZoom, footprint=None):
+        self.bounds = tuple(bounds)
+        self.tileMinZ = minZoom
+        self.tileMaxZ = maxZoom
+        self.footprint = footprint
+        self.grid = tileGrid(self.bounds)
+        self.ranges = {}
+        for zoom in xrange(minZoom, maxZoom + 1):
+            self.ranges[zoom] = self._zoomRange(zoom)
+
+    @classmethod
+    def fromTerrainTiles(cls, tiles):
+        return cls(tiles.bounds, tiles.tileMinZ, tiles.tileMaxZ,
+                   footprint=tiles.footprint)
+
+    def _zoomRange(self, zoom):
+        [minRow, minCol, maxRow, maxCol] = self.grid.getExtentAddress(zoom)
+        return ZoomRange(
+            zoom, minCol, minRow, maxCol, maxRow, self.grid.tileSize(zoom))
+
+    @property
+    def zooms(self):
+        return range(self.tileMinZ, self.tileMaxZ + 1)
+
+    def zoomRange(self, zoom):
+        return self.ranges[zoom]
+
+    def numberOfTilesAtZoom(self, zoom):
+        if self.footprint is not None:
+            return self.footprint.numberOfTiles(self.ranges[zoom])
+        return self.ranges[zoom].nbTiles
+
+    def numberOfTiles(self):
+        return sum(self.numberOfTilesAtZoom(z) for z in self.zooms)
+
+    def inFootprint(self, x, y, zoom):
+        if self.footprint is None:
+            return True
+        return self.footprint.contains(self.ranges[zoom], x, y)
+
+    def _iterRangeTiles(self):
+        for zoom in self.zooms:
+            r = self.ranges[zoom]
+            for y in xrange(r.minY, r.maxY + 1):
+                for x in xrange(r.minX, r.maxX + 1):
+                    yield (x, y, zoom)
+
+    # Yields (x, y, z) in the same order as forge.lib.tiles.grid
+    # without computing the bounds of each tile
+    def iterTiles(self):
+        for x, y, zoom in self._iterRangeTiles():
+            if self.inFootprint(x, y, zoom):
+                yield (x, y, zoom)
+
+    # Tiles of the extent lying outside of the footprint
+    def iterOutsideTiles(self):
+        if self.footprint is None:
+            return
+        for x, y, zoom in self._iterRangeTiles():
+            if not self.inFootprint(x, y, zoom):
+                yield (x, y, zoom)
+
+    def tileBounds(self, zoom, x, y):
+        return self.grid.tileBounds(zoom, x, y)
+
+    def tileDiagonal(self, zoom):
+        lat = (self.bounds[1] + self.bounds[3]) / 2.0
+        return self.ranges[zoom].tileDiagonal(lat)
+
+    def __contains__(self, tileXYZ):
+        x, y, z = tileXYZ
+        if z not in self.ranges:
+            return False
+        return (x, y) in self.ranges[z] and self.inFootprint(x, y, z)
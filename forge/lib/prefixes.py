@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+
+# Splits the keys under a prefix in disjoint partitions that can be listed
+# at the same time: the sub prefixes ("directories", i.e. zooms then x
+# columns for the tiles) found down to depth levels.
+# listPrefix(prefix) returns the sub prefixes directly under a prefix and
+# whether some keys lie directly under it.
+# Returns [(prefix, recursive)]: a partition that is not recursive only
+# holds the keys directly under its prefix.
+def prefixPartitions(listPrefix, prefix, depth):
+    partitions = []
+    level = [prefix]
+    for i in xrange(0, depth):
+        nextLevel = []
+        for p in level:
+            (subPrefixes, hasKeys) = listPrefix(p)
+            if hasKeys:
+                partitions.append((p, not subPrefixes))
+            nextLevel += subPrefixes
+        level = nextLevel
+    return partitions + [(p, True) for p in level]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import Queue
+from collections import OrderedDict
+
+
+# Maximum visibility timeout accepted by SQS (12 hours)
+MAX_VISIBILITY_TIMEOUT = 43200
+
+# Default visibility of the messages, in seconds
+DEFAULT_VISIBILITY_TIMEOUT = 120
+
+
+# Work left in a message, shared between the worker and the heartbeat
+class MessageWork:
+
+    def __init__(self, nbTiles):
+        self.nbTiles = nbTiles
+        self.nbDone = 0
+
+    @property
+    def remaining(self):
+        return max(0, self.nbTiles - self.nbDone)
+
+
+# Keeps the messages being processed (or prefetched) invisible for the
+# other workers. The visibility is extended proportionally to the work
+# left in front of each message, so that a crashed worker only locks its
+# messages for about one visibility timeout.
+class VisibilityHeartbeat(threading.Thread):
+
+    def __init__(self, changeVisibility, visibilityTimeout, secondsPerTile=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.changeVisibility = changeVisibility
+        self.visibilityTimeout = visibilityTimeout
+        self.interval = max(1, visibilityTimeout // 4)
+        self.secondsPerTile = secondsPerTile
+        # message -> (MessageWork, deadline)
+        self._tracked = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def track(self, message, work):
+        with self._lock:
+            self._tracked[message] = (
+                work, time.time() + self.visibilityTimeout)
+
+    def work(self, message):
+        with self._lock:
+            tracked = self._tracked.get(message)
+        return tracked[0] if tracked is not None else None
+
+    def untrack(self, message):
+        with self._lock:
+            self._tracked.pop(message, None)
+
+    # Exponential moving average of the time spent per tile
+    def tileDone(self, seconds):
+        self.secondsPerTile = 0.9 * self.secondsPerTile + 0.1 * seconds
+
+    def timeoutFor(self, tilesAhead):
+        timeout = int(tilesAhead * self.secondsPerTile * 1.5) + \
+            2 * self.interval
+        return max(self.visibilityTimeout,
+                   min(timeout, MAX_VISIBILITY_TIMEOUT))
+
+    def beat(self):
+        now = time.time()
+        with self._lock:
+            tracked = list(self._tracked.items())
+        tilesAhead = 0
+        for message, (work, deadline) in tracked:
+            tilesAhead += work.remaining
+            # Only extend when the deadline gets close
+            if deadline - now > 2 * self.interval:
+                continue
+            timeout = self.timeoutFor(tilesAhead)
+            try:
+                self.changeVisibility(message, timeout)
+            except Exception:
+                continue
+            with self._lock:
+                if message in self._tracked:
+                    self._tracked[message] = (work, now + timeout)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.beat()
+
+    def stop(self):
+        self._stopped.set()
+
+
+# Reads the next message in the background while the current one is
+# being processed. Prefetched messages are tracked by the heartbeat. The
+# read errors are reported to logger.
+class MessagePrefetcher(threading.Thread):
+
+    def __init__(self, read, release, countTiles, heartbeat, depth=1,
+                 logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.read = read
+        self.release = release
+        self.countTiles = countTiles
+        self.heartbeat = heartbeat
+        self.logger = logger
+        self._messages = Queue.Queue(maxsize=depth)
+        self._stopped = threading.Event()
+        # Time spent by the worker waiting on the queue
+        self.waited = 0.0
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                message = self.read()
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.warning(
+                        'Failed to read a message from the queue: %s' % e,
+                        exc_info=True)
+                time.sleep(1)
+                continue
+            if message is None:
+                continue
+            if self._stopped.is_set():
+                self._release(message)
+                break
+            try:
+                nbTiles = self.countTiles(message)
+            except Exception:
+                nbTiles = 1
+            self.heartbeat.track(message, MessageWork(nbTiles))
+            while True:
+                if self._stopped.is_set():
+                    self._release(message)
+                    return
+                try:
+                    self._messages.put(message, timeout=1)
+                    break
+                except Queue.Full:
+                    continue
+
+    # Makes a message visible again for the other workers
+    def _release(self, message):
+        self.heartbeat.untrack(message)
+        try:
+            self.release(message)
+        except Exception:
+            pass
+
+    # Returns the next message or None if none arrived within timeout
+    def get(self, timeout):
+        t0 = time.time()
+        try:
+            return self._messages.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+        finally:
+            self.waited += time.time() - t0
+
+    # Releases the messages prefetched but never handed to the worker. The
+    # thread is joined first (it may be waiting on read), so that it cannot
+    # queue a message once drained.
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        while True:
+            try:
+                self._release(self._messages.get_nowait())
+            except Queue.Empty:
+                break
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+# Work queues of the distributed mode (createqueue / createtiles).
+#
+# SQSQueue uses AWS SQS. DBQueue keeps the messages in a table of a
+# PostgreSQL or SQLite database, so that several nodes of a local network
+# (or several processes of a single machine) can share the work without any
+# cloud service. A read message is leased: it stays invisible to the other
+# workers until its visibility timeout expires, unless it is deleted or its
+# visibility is changed with the receipt returned by the read.
+
+import time
+import uuid
+import sqlalchemy
+from sqlalchemy import MetaData, Table, Column, Integer, Float, String, \
+    Text, and_, select, func
+from sqlalchemy.sql import literal, literal_column
+
+
+class QueueMessage:
+
+    def __init__(self, body, handle):
+        self.body = body
+        # Backend specific reference to the message
+        self.handle = handle
+
+
+class SQSQueue:
+
+    def __init__(self, name, shared=True):
+        from forge.lib.boto_conn import getSQS
+        self.name = name
+        self.shared = shared
+        self.conn = getSQS(shared=shared)
+        self._q = None
+
+    @property
+    def q(self):
+        if self._q is None:
+            self._q = self.conn.get_queue(self.name)
+        return self._q
+
+    # boto connections are not thread safe, threads must use their own
+    def copy(self):
+        return SQSQueue(self.name, shared=False)
+
+    def exists(self):
+        return self.q is not None
+
+    def create(self, visibilityTimeout):
+        self._q = self.conn.create_queue(
+            self.name, visibility_timeout=visibilityTimeout)
+        # Assure queue is kept for maximum of 14 weeks (aws limit).
+        # default would be 4 days.
+        self.conn.set_queue_attribute(
+            self._q, 'MessageRetentionPeriod', 1209600)
+
+    def delete(self):
+        self.conn.delete_queue(self.q)
+        self._q = None
+
+    def count(self):
+        return self.q.count()
+
+    def stats(self):
+        return self.conn.get_queue_attributes(self.q)
+
+    def write(self, bodies):
+        from forge.lib.boto_conn import sqsBatches, writeSQSBatch
+        nbMessages = 0
+        for batch in sqsBatches(bodies):
+            nbMessages += writeSQSBatch(self.q, batch)
+        return nbMessages
+
+    def read(self, visibilityTimeout, waitTime=20):
+        # 20 is maximum wait time
+        m = self.q.read(
+            visibility_timeout=visibilityTimeout,
+            wait_time_seconds=min(waitTime, 20))
+        if m is None:
+            return None
+        return QueueMessage(m.get_body(), m)
+
+    def changeVisibility(self, message, timeout):
+        self.conn.change_message_visibility(
+            self.q, message.handle.receipt_handle, timeout)
+
+    def deleteMessage(self, message):
+        self.q.delete_message(message.handle)
+
+
+metadata = MetaData()
+
+queuesTable = Table(
+    'forge_queues', metadata,
+    Column('name', String(255), primary_key=True),
+    Column('visibility_timeout', Integer, nullable=False),
+)
+
+messagesTable = Table(
+    'forge_queue_messages', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('queue', String(255), nullable=False, index=True),
+    Column('body', Text, nullable=False),
+    # Epoch (database clock) at which the message can be read again
+    Column('visible_at', Float, nullable=False, default=0.0),
+    Column('receipt', String(32)),
+    Column('receive_count', Integer, nullable=False, default=0),
+)
+
+
+# Current epoch according to the database, so that the leases of all
+# the nodes use the same clock
+def _now(dialectName):
+    if dialectName == 'postgresql':
+        return literal_column('extract(epoch from clock_timestamp())')
+    elif dialectName == 'sqlite':
+        return literal_column("((julianday('now') - 2440587.5) * 86400.0)")
+    raise ValueError('Unsupported queue database %s' % dialectName)
+
+
+class DBQueue:
+
+    # Rows inserted per statement
+    writeBatchSize = 500
+    # Seconds between two polls of an empty queue
+    pollInterval = 1
+
+    def __init__(self, name, url, engine=None):
+        self.name = name
+        self.url = url
+        if engine is None:
+            connectArgs = {}
+            if url.startswith('sqlite'):
+                # Writers of other processes lock the whole file
+                connectArgs['timeout'] = 60
+            engine = sqlalchemy.create_engine(url, connect_args=connectArgs)
+        self.engine = engine
+        self.dialectName = engine.dialect.name
+        self.now = _now(self.dialectName)
+
+    # SQLAlchemy engines are thread safe
+    def copy(self):
+        return DBQueue(self.name, self.url, engine=self.engine)
+
+    def exists(self):
+        if not self.engine.has_table(queuesTable.name):
+            return False
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select([queuesTable.c.name]).where(
+                    queuesTable.c.name == self.name)
+            ).first() is not None
+
+    def create(self, visibilityTimeout):
+        metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(queuesTable.insert().values(
+                name=self.name, visibility_timeout=visibilityTimeout))
+
+    def delete(self):
+        with self.engine.begin() as conn:
+            conn.execute(messagesTable.delete().where(
+                messagesTable.c.queue == self.name))
+            conn.execute(queuesTable.delete().where(
+                queuesTable.c.name == self.name))
+
+    def _count(self, conn, visible):
+        if visible:
+            condition = messagesTable.c.visible_at <= self.now
+        else:
+            condition = messagesTable.c.visible_at > self.now
+        return conn.execute(
+            select([func.count()]).select_from(messagesTable).where(and_(
+                messagesTable.c.queue == self.name, condition))
+        ).scalar()
+
+    def count(self):
+        with self.engine.connect() as conn:
+            return self._count(conn, True)
+
+    # Same keys as the SQS queue attributes
+    def stats(self):
+        with self.engine.connect() as conn:
+            return {
+                'ApproximateNumberOfMessages': self._count(conn, True),
+                'ApproximateNumberOfMessagesNotVisible':
+                    self._count(conn, False)
+            }
+
+    def write(self, bodies):
+        nbMessages = 0
+        rows = []
+        with self.engine.connect() as conn:
+            for body in bodies:
+                rows.append(dict(
+                    queue=self.name, body=body, visible_at=0.0,
+                    receive_count=0))
+                if len(rows) >= self.writeBatchSize:
+                    conn.execute(messagesTable.insert(), rows)
+                    nbMessages += len(rows)
+                    rows = []
+            if rows:
+                conn.execute(messagesTable.insert(), rows)
+                nbMessages += len(rows)
+        return nbMessages
+
+    def _lease(self, conn, visibilityTimeout, receipt):
+        t = messagesTable
+        available = and_(t.c.queue == self.name, t.c.visible_at <= self.now)
+        # Anonymous bind parameters, psycopg2 chokes on the ones named
+        # after the literal column
+        lease = dict(
+            visible_at=self.now + literal(visibilityTimeout),
+            receipt=receipt, receive_count=t.c.receive_count + 1)
+        if self.dialectName == 'postgresql':
+            # Concurrent readers skip the rows being leased instead of
+            # waiting for them
+            candidate = select([t.c.id]).where(available).order_by(
+                t.c.id).limit(1).with_for_update(skip_locked=True)
+            return conn.execute(
+                t.update().where(t.c.id == candidate.as_scalar())
+                .values(**lease).returning(t.c.id, t.c.body)
+            ).first()
+        # SQLite serializes the writers: the update only succeeds if no
+        # other reader leased the message in the meantime
+        row = conn.execute(
+            select([t.c.id, t.c.body]).where(available).order_by(
+                t.c.id).limit(1)
+        ).first()
+        if row is None:
+            return None
+        result = conn.execute(
+            t.update().where(and_(t.c.id == row.id, available))
+            .values(**lease))
+        if result.rowcount != 1:
+            return False
+        return row
+
+    # Returns a QueueMessage or None if no message could be leased
+    # within waitTime seconds
+    def read(self, visibilityTimeout, waitTime=20):
+        tEnd = time.time() + waitTime
+        while True:
+            receipt = uuid.uuid4().hex
+            with self.engine.begin() as conn:
+                row = self._lease(conn, visibilityTimeout, receipt)
+            if row:
+                return QueueMessage(row[1], (row[0], receipt))
+            # Lost a race, try again right away
+            if row is False:
+                continue
+            if time.time() >= tEnd:
+                return None
+            time.sleep(min(self.pollInterval, max(0, tEnd - time.time())))
+
+    def _leased(self, message):
+        messageId, receipt = message.handle
+        return and_(
+            messagesTable.c.id == messageId,
+            messagesTable.c.receipt == receipt)
+
+    # Does nothing if the lease expired and the message was read again
+    def changeVisibility(self, message, timeout):
+        with self.engine.begin() as conn:
+            conn.execute(messagesTable.update().where(
+                self._leased(message)).values(
+                    visible_at=self.now + literal(timeout)))
+
+    def deleteMessage(self, message):
+        with self.engine.begin() as conn:
+            conn.execute(messagesTable.delete().where(self._leased(message)))
+
+
+# url is None for SQS or an SQLAlchemy database url
+def openQueue(name, url=None):
+    if url is None:
+        return SQSQueue(name)
+    return DBQueue(name, url)
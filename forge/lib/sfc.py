@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# Space filling curves over the tile grid.
+# order is the number of bits per coordinate: the curve covers a square
+# of 2 ** order tiles per side.
+
+ROW = 'row'
+MORTON = 'morton'
+HILBERT = 'hilbert'
+
+ORDERS = (ROW, MORTON, HILBERT)
+
+
+def mortonKey(x, y, order):
+    key = 0
+    for i in xrange(order - 1, -1, -1):
+        key = (key << 2) | (((y >> i) & 1) << 1) | ((x >> i) & 1)
+    return key
+
+
+def hilbertKey(x, y, order):
+    key = 0
+    n = 1 << order
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        key += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return key
+
+
+def curveKey(name):
+    if name == MORTON:
+        return mortonKey
+    elif name == HILBERT:
+        return hilbertKey
+    raise ValueError('Unknown space filling curve %s' % name)
+
+
+# Number of bits needed to address the global geodetic grid at a zoom
+# (2 ** (zoom + 1) tiles over x, 2 ** zoom tiles over y)
+def orderAtZoom(zoom):
+    return zoom + 1
+
+
+# Yields the (x, y) tiles of a rectangle following a curve.
+# The rectangle is cut in aligned blocks of 2 ** blockBits tiles per side.
+# A curve visits each aligned block entirely before leaving it, so sorting
+# the blocks and then the tiles of each block gives the exact curve order
+# while only keeping one block of tiles in memory.
+def iterRange(minX, minY, maxX, maxY, order, curve=HILBERT, blockBits=4):
+    key = curveKey(curve)
+    blockBits = min(blockBits, order)
+    blockOrder = order - blockBits
+    blocks = [
+        (bx, by)
+        for by in xrange(minY >> blockBits, (maxY >> blockBits) + 1)
+        for bx in xrange(minX >> blockBits, (maxX >> blockBits) + 1)
+    ]
+    blocks.sort(key=lambda b: key(b[0], b[1], blockOrder))
+    blockSize = 1 << blockBits
+    for bx, by in blocks:
+        x0 = max(minX, bx * blockSize)
+        x1 = min(maxX, (bx + 1) * blockSize - 1)
+        y0 = max(minY, by * blockSize)
+        y1 = min(maxY, (by + 1) * blockSize - 1)
+        cells = [
+            (x, y) for y in xrange(y0, y1 + 1) for x in xrange(x0, x1 + 1)
+        ]
+        cells.sort(key=lambda c: key(c[0], c[1], order))
+        for cell in cells:
+            yield cell
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import time
+import datetime
+import cStringIO
+
+
+# One of count independent parts of a pyramid.
+# The tiles, in the order of TerrainTiles (zoom by zoom, along the space
+# filling curve within a zoom), are cut in count contiguous ranges of about
+# the same predicted cost. A range of the curve is a compact area, so each
+# shard keeps the locality of the tile order. Every machine computes the
+# same ranges from the same config and a deterministic cost model, the
+# plans recorded in the manifests of the other shards are checked (see
+# conflictingShards).
+class Shard:
+
+    def __init__(self, index, count):
+        if count < 1 or index < 0 or index >= count:
+            raise ValueError('Invalid shard %s/%s' % (index, count))
+        self.index = index
+        self.count = count
+        # Summary of the tiles of the shard, filled by filter
+        self.nbTiles = 0
+        self.cost = 0.0
+        self.zooms = {}
+
+    # Parses i/N, shards are numbered from 0 to N - 1
+    @classmethod
+    def parse(cls, value):
+        try:
+            index, count = [int(v) for v in value.split('/')]
+        except ValueError:
+            raise ValueError('Invalid shard %s, expected i/N' % value)
+        return cls(index, count)
+
+    def __str__(self):
+        return '%s/%s' % (self.index, self.count)
+
+    # Shard of a tile whose cost starts at cumulative, the middle of the
+    # tile decides so that expensive tiles are split fairly
+    def indexAt(self, cumulative, cost, total):
+        if total <= 0:
+            return 0
+        index = int((cumulative + cost / 2.0) * self.count / total)
+        return min(index, self.count - 1)
+
+    # Yields the tiles belonging to this shard. total is the cost of all
+    # the tiles (see costs.totalCost).
+    def filter(self, tiles, costModel, total, tileXYZ=lambda t: t[1]):
+        cumulative = 0.0
+        for tile in tiles:
+            xyz = tileXYZ(tile)
+            cost = costModel.cost(xyz)
+            index = self.indexAt(cumulative, cost, total)
+            cumulative += cost
+            if index < self.index:
+                continue
+            elif index > self.index:
+                # Ranges are contiguous, nothing left for this shard
+                break
+            self._add(xyz, cost)
+            yield tile
+
+    def _add(self, xyz, cost):
+        self.nbTiles += 1
+        self.cost += cost
+        zoom = self.zooms.setdefault(
+            xyz[2], dict(nbTiles=0, first=list(xyz[:2]), last=None))
+        zoom['nbTiles'] += 1
+        zoom['last'] = list(xyz[:2])
+
+    def manifestName(self):
+        return 'shard-%s-of-%s.json' % (self.index, self.count)
+
+    # Completion manifest of the shard. plan describes the pyramid, so that
+    # manifests of shards computed with different settings can be told apart.
+    def manifest(self, plan, t0, tilesCreated, tilesSkipped):
+        tend = time.time()
+        return json.dumps(dict(
+            shard=str(self),
+            index=self.index,
+            count=self.count,
+            plan=plan,
+            nbTiles=self.nbTiles,
+            cost=self.cost,
+            zooms=dict((str(z), v) for z, v in self.zooms.iteritems()),
+            tilesCreated=tilesCreated,
+            tilesSkipped=tilesSkipped,
+            started=datetime.datetime.utcfromtimestamp(t0).isoformat(),
+            finished=datetime.datetime.utcfromtimestamp(tend).isoformat(),
+            seconds=tend - t0
+        ), indent=2, sort_keys=True)
+
+
+# Manifest as written to the bucket (gzipped) or locally
+def parseManifest(content):
+    if content[:2] == '\x1f\x8b':
+        content = gzip.GzipFile(fileobj=cStringIO.StringIO(content)).read()
+    return json.loads(content)
+
+
+def samePlan(plan, other):
+    if sorted(plan) != sorted(other):
+        return False
+    for key, value in plan.iteritems():
+        if key == 'totalCost':
+            if abs(value - other[key]) > 1e-9 * max(1.0, abs(value)):
+                return False
+        elif value != other[key]:
+            return False
+    return True
+
+
+# The other shards of the same split whose manifest records another plan:
+# their ranges do not match the ranges of shard
+def conflictingShards(manifests, shard, plan):
+    conflicts = []
+    for manifest in manifests:
+        if manifest.get('count') != shard.count or \
+                manifest.get('index') == shard.index:
+            continue
+        if not samePlan(manifest.get('plan', {}), plan):
+            conflicts.append(manifest['shard'])
+    return sorted(conflicts)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Differential sync of two versions of the tiles in the bucket. S3 lists
+# the keys sorted by name, so both listings are merged in a single pass
+# with a constant memory: only the missing or different tiles are copied,
+# the extra ones are optionally deleted.
+
+MISSING = 'missing'
+CHANGED = 'changed'
+EXTRA = 'extra'
+UNCHANGED = 'unchanged'
+
+STATUSES = [MISSING, CHANGED, EXTRA, UNCHANGED]
+
+
+# Listing entries are (name relative to the prefix, size, etag) sorted by
+# name. Yields (status, name) for each name of either listing.
+def diffListings(srcEntries, dstEntries):
+    srcEntries = iter(srcEntries)
+    dstEntries = iter(dstEntries)
+    src = next(srcEntries, None)
+    dst = next(dstEntries, None)
+    while src is not None or dst is not None:
+        if dst is None or (src is not None and src[0] < dst[0]):
+            yield (MISSING, src[0])
+            src = next(srcEntries, None)
+        elif src is None or dst[0] < src[0]:
+            yield (EXTRA, dst[0])
+            dst = next(dstEntries, None)
+        else:
+            if src[1:] == dst[1:]:
+                yield (UNCHANGED, src[0])
+            else:
+                yield (CHANGED, src[0])
+            src = next(srcEntries, None)
+            dst = next(dstEntries, None)
+
+
+# Keys of a sorted sequence not in a sorted listing of names, the keys
+# found in the listing are counted by skipped (a pipeline.ThreadCounter)
+def missingKeys(keys, names, skipped):
+    for status, key in diffListings(
+            ((key,) for key in keys), ((name,) for name in names)):
+        if status == MISSING:
+            yield key
+        elif status == UNCHANGED:
+            skipped.add()
+
+
+# Number of tiles of each status per zoom. Each zoom must be updated by a
+# single thread.
+class SyncReport:
+
+    def __init__(self, zooms):
+        self.zooms = list(zooms)
+        self.counts = dict(
+            (zoom, dict((status, 0) for status in STATUSES))
+            for zoom in self.zooms)
+
+    def add(self, zoom, status):
+        self.counts[zoom][status] += 1
+
+    def total(self, status):
+        return sum(self.counts[zoom][status] for zoom in self.zooms)
+
+    def __str__(self):
+        lines = ['zoom %s' % ' '.join('%10s' % s for s in STATUSES)]
+        for zoom in self.zooms:
+            lines.append('%4s %s' % (zoom, ' '.join(
+                '%10s' % self.counts[zoom][s] for s in STATUSES)))
+        lines.append('all  %s' % ' '.join(
+            '%10s' % self.total(s) for s in STATUSES))
+        return '\n'.join(lines)
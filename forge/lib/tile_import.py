@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Imports tiles served over HTTP into the bucket (see utils.copyAGITiles).
+# Downloads, compressions and uploads run concurrently in a staged
+# pipeline, the tiles already in the bucket being skipped.
+
+import gzip
+import threading
+import cStringIO
+import requests
+
+from forge.lib.pipeline import StagedPipeline, ThreadCounter
+
+
+# Same compression as helpers.gzipFileObject. zlib releases the GIL while
+# compressing, so threads compress in parallel.
+def gzipBytes(content, compresslevel=5):
+    compressed = cStringIO.StringIO()
+    gz = gzip.GzipFile(fileobj=compressed, mode='w',
+                       compresslevel=compresslevel)
+    gz.write(content)
+    gz.close()
+    return compressed.getvalue()
+
+
+class HTTPTileSource:
+
+    def __init__(self, baseURL, headers=None, timeout=60):
+        self.baseURL = baseURL
+        self.headers = headers or {}
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # Each download thread keeps its own keep-alive session
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update(self.headers)
+        return session
+
+    def fetch(self, key):
+        url = '%s%s' % (self.baseURL, key)
+        r = self.session.get(url, timeout=self.timeout)
+        if r.status_code != requests.codes.ok:
+            raise Exception('Failed to request %s, status code: %s' % (
+                url, r.status_code
+            ))
+        return r.content
+
+
+class TileImporter:
+
+    # fetch(key) returns the content of a tile, store(key, data) writes the
+    # gzipped tile
+    def __init__(self, fetch, store, nbDownloads=16, nbCompressors=4,
+                 nbUploads=16, queueSize=100):
+        self.fetch = fetch
+        self.store = store
+        self.skipped = ThreadCounter()
+        self.pipeline = StagedPipeline([
+            (self._download, nbDownloads),
+            (self._compress, nbCompressors),
+            (self._upload, nbUploads),
+        ], queueSize=queueSize)
+
+    def _download(self, key):
+        return (key, self.fetch(key))
+
+    def _compress(self, item):
+        (key, content) = item
+        return (key, gzipBytes(content))
+
+    def _upload(self, item):
+        (key, data) = item
+        self.store(key, data)
+        return key
+
+    def _missing(self, keys, existing):
+        for key in keys:
+            if key in existing:
+                self.skipped.add()
+            else:
+                yield key
+
+    # Imports the tiles whose key is not in existing (resume), returns the
+    # number of tiles imported
+    def run(self, keys, existing=frozenset(), progress=None,
+            progressInterval=10):
+        return self.pipeline.run(
+            self._missing(keys, existing), progress=progress,
+            progressInterval=progressInterval)
+
+    @property
+    def failed(self):
+        return self.pipeline.failed.value
+
+    @property
+    def errors(self):
+        return self.pipeline.errors
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# Optional index of the triangles overlapping each tile, materialized after
+# the ingestion by the tileindex command of tms_writer.py. When it is used
+# (tileIndex in tms.cfg), the triangles of a tile are found with a primary
+# key lookup followed by fetches by id instead of a spatial search, and the
+# number of triangles of each tile is known exactly (see
+# costs.TileIndexCostModel). Tiles without any triangle have no row, so
+# the index of a zoom is only used once it was completely built from the
+# current table of the zoom (see TileIndexZooms in forge/models/tables.py).
+
+import math
+from sqlalchemy.sql.expression import text
+
+
+# Cuts the tile ranges of a planner in bands of rows of at most maxTiles
+# tiles, each band being indexed by one statement: (zoom, minX, minY,
+# maxX, maxY)
+def indexBands(planner, maxTiles):
+    for zoom in planner.zooms:
+        r = planner.zoomRange(zoom)
+        nbRows = max(1, maxTiles // r.xCount)
+        for minY in xrange(r.minY, r.maxY + 1, nbRows):
+            yield (zoom, r.minX, minY, r.maxX, min(minY + nbRows - 1, r.maxY))
+
+
+# Extent of a band in the global geodetic TMS grid
+def bandBounds(band, tileSize):
+    (zoom, minX, minY, maxX, maxY) = band
+    return (
+        -180.0 + minX * tileSize,
+        -90.0 + minY * tileSize,
+        -180.0 + (maxX + 1) * tileSize,
+        -90.0 + (maxY + 1) * tileSize
+    )
+
+
+# Each triangle is expanded to the tiles of the band its bbox covers (the
+# lower bound includes the tile whose edge it touches), then the tiles it
+# does not intersect are discarded, as in tiler.createTile. partitionKeys
+# restricts the search to some partitions of a partitioned table.
+def indexBandLiteral(model, indexModel, partitionKeys=None):
+    partitionFilter = ''
+    if partitionKeys is not None:
+        partitionFilter = 'AND f.partitionkey IN (%s) ' % ', '.join(
+            str(int(key)) for key in partitionKeys)
+    return text(
+        "INSERT INTO %(index)s (zoom, x, y, tablename, ids, nbtriangles) "
+        "SELECT :zoom, gx.x, gy.y, :tablename, "
+        "array_agg(f.id ORDER BY f.id), count(*) "
+        "FROM %(table)s f "
+        "CROSS JOIN LATERAL generate_series("
+        "greatest(ceil((ST_XMin(f.the_geom) + 180.0) / :tileSize)::int - 1, "
+        ":minX), "
+        "least(floor((ST_XMax(f.the_geom) + 180.0) / :tileSize)::int, "
+        ":maxX)) AS gx(x) "
+        "CROSS JOIN LATERAL generate_series("
+        "greatest(ceil((ST_YMin(f.the_geom) + 90.0) / :tileSize)::int - 1, "
+        ":minY), "
+        "least(floor((ST_YMax(f.the_geom) + 90.0) / :tileSize)::int, "
+        ":maxY)) AS gy(y) "
+        "WHERE f.the_geom && "
+        "ST_MakeEnvelope(:minLon, :minLat, :maxLon, :maxLat, 4326) "
+        "AND ST_Intersects(f.the_geom, ST_MakeEnvelope("
+        "-180.0 + gx.x * :tileSize, -90.0 + gy.y * :tileSize, "
+        "-180.0 + (gx.x + 1) * :tileSize, -90.0 + (gy.y + 1) * :tileSize, "
+        "4326)) %(partitions)s"
+        "GROUP BY gx.x, gy.y" % dict(
+            partitions=partitionFilter,
+            index='%s.%s' % (
+                indexModel.__table_args__['schema'], indexModel.__tablename__),
+            table='%s.%s' % (
+                model.__table_args__['schema'], model.__tablename__)
+        )
+    )
+
+
+def _inBand(indexModel, band):
+    (zoom, minX, minY, maxX, maxY) = band
+    return [
+        indexModel.zoom == zoom,
+        indexModel.x.between(minX, maxX),
+        indexModel.y.between(minY, maxY)
+    ]
+
+
+# (Re)builds the rows of a band from the table of its zoom level, returns
+# the number of tiles having triangles
+def buildBand(session, indexModel, model, band, tileSize):
+    (zoom, minX, minY, maxX, maxY) = band
+    bounds = bandBounds(band, tileSize)
+    (minLon, minLat, maxLon, maxLat) = bounds
+    partitions = getattr(model, '__partitions__', None)
+    partitionKeys = None
+    if partitions is not None:
+        partitionKeys = partitions.keysIntersecting(bounds)
+    session.query(indexModel).filter(
+        *_inBand(indexModel, band)).delete(synchronize_session=False)
+    literal = indexBandLiteral(model, indexModel, partitionKeys=partitionKeys)
+    result = session.execute(literal, dict(
+        zoom=zoom, tablename=model.__tablename__, tileSize=tileSize,
+        minX=minX, minY=minY, maxX=maxX, maxY=maxY,
+        minLon=minLon, minLat=minLat, maxLon=maxLon, maxLat=maxLat))
+    session.commit()
+    return result.rowcount
+
+
+def hasTriangles(session, indexModel, tileXYZ):
+    (x, y, z) = tileXYZ
+    return session.query(indexModel.zoom).filter(
+        indexModel.zoom == z, indexModel.x == x, indexModel.y == y
+    ).first() is not None
+
+
+# Zooms whose index was completely built from the table they now use
+# (tablenameByZoom) and is up to date
+def upToDateZooms(session, zoomsModel, tablenameByZoom):
+    rows = session.query(zoomsModel.zoom, zoomsModel.tablename).filter(
+        zoomsModel.stale.is_(False))
+    return frozenset(
+        zoom for zoom, tablename in rows
+        if tablenameByZoom.get(zoom) == tablename)
+
+
+def markIndexed(session, zoomsModel, zoom, tablename):
+    session.query(zoomsModel).filter(zoomsModel.zoom == zoom).delete(
+        synchronize_session=False)
+    session.add(zoomsModel(zoom=zoom, tablename=tablename, stale=False))
+
+
+# The stale zooms whose changed tiles were all reindexed
+def markRefreshed(session, zoomsModel, zooms):
+    session.query(zoomsModel).filter(
+        zoomsModel.zoom.in_(list(zooms)), zoomsModel.stale.is_(True)
+    ).update({'stale': False}, synchronize_session=False)
+
+
+# Zooms whose index was built from a table
+def zoomsOfTable(session, zoomsModel, tablename):
+    return [zoom for zoom, in session.query(zoomsModel.zoom).filter(
+        zoomsModel.tablename == tablename)]
+
+
+# Range of the tiles of a zoom overlapping an extent, as indexed by
+# indexBandLiteral (the tiles whose edge the extent touches included)
+def tileRange(zoom, extent):
+    tileSize = 180.0 / 2 ** zoom
+    (minLon, minLat, maxLon, maxLat) = extent
+    return (
+        int(math.ceil((minLon + 180.0) / tileSize)) - 1,
+        int(math.ceil((minLat + 90.0) / tileSize)) - 1,
+        int(math.floor((maxLon + 180.0) / tileSize)),
+        int(math.floor((maxLat + 90.0) / tileSize))
+    )
+
+
+# The features of a table changed within extents: the rows of their tiles
+# are deleted and the zooms built from the table are either flagged stale
+# (tracked, the update command reindexes the changed tiles) or forgotten
+# (only the tileindex command rebuilds them)
+def invalidateExtents(session, indexModel, zoomsModel, tablename, extents,
+                      tracked=False):
+    zooms = zoomsOfTable(session, zoomsModel, tablename)
+    for zoom in zooms:
+        for extent in extents:
+            (minX, minY, maxX, maxY) = tileRange(zoom, extent)
+            session.query(indexModel).filter(
+                *_inBand(indexModel, (zoom, minX, minY, maxX, maxY))
+            ).delete(synchronize_session=False)
+    query = session.query(zoomsModel).filter(
+        zoomsModel.tablename == tablename)
+    if tracked:
+        query.update({'stale': True}, synchronize_session=False)
+    else:
+        query.delete(synchronize_session=False)
+    return zooms
+
+
+# Number of triangles of the tiles of a planner having some:
+# {(x, y, z): nb of triangles}
+def triangleCounts(session, indexModel, planner):
+    counts = {}
+    for zoom in planner.zooms:
+        r = planner.zoomRange(zoom)
+        query = session.query(
+            indexModel.x, indexModel.y, indexModel.nbtriangles
+        ).filter(*_inBand(indexModel, (zoom, r.minX, r.minY, r.maxX, r.maxY)))
+        for x, y, count in query:
+            counts[(x, y, zoom)] = count
+    return counts
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# Queries of createTile as server side prepared statements. The SQL of the
+# statements of a zoom level is built once per process and prepared once
+# per connection (PREPARE), then each tile only sends its bounds (EXECUTE):
+# no expression tree is built nor compiled per tile and PostgreSQL reuses
+# its plans. The clipped triangles of dense tiles are rather streamed
+# through a server side cursor (see TileQueries.clippedRings).
+
+import re
+import numpy as np
+
+# Side of the square in which the corners of a tile are matched (see
+# helpers.createBBox)
+CORNER_TOLERANCE = 0.01
+
+
+class PreparedStatement:
+
+    # params: [(name, PostgreSQL type)] of the parameters $1, $2... of sql
+    def __init__(self, name, sql, params):
+        self.name = name
+        self.sql = sql
+        self.params = params
+
+    def prepareLiteral(self):
+        return 'PREPARE %s (%s) AS %s' % (
+            self.name, ', '.join(t for n, t in self.params), self.sql)
+
+    def executeLiteral(self):
+        return 'EXECUTE %s (%s)' % (
+            self.name, ', '.join('%%(%s)s' % n for n, t in self.params))
+
+    # connection is a DBAPI connection of a pool (Engine.raw_connection),
+    # its info lasts as long as the database session
+    def prepare(self, connection):
+        prepared = connection.info.setdefault('preparedStatements', set())
+        if self.name in prepared:
+            return
+        cursor = connection.cursor()
+        try:
+            cursor.execute(self.prepareLiteral())
+        finally:
+            cursor.close()
+        prepared.add(self.name)
+
+    # The statement itself with the values in place of its parameters.
+    # A cursor cannot be declared for the EXECUTE of a prepared statement.
+    def queryLiteral(self):
+        types = dict(self.params)
+
+        def placeholder(m):
+            name = self.params[int(m.group(1)) - 1][0]
+            return '%%(%s)s::%s' % (name, types[name])
+        return re.sub(r'\$(\d+)', placeholder, self.sql.replace('%', '%%'))
+
+    def execute(self, connection, values):
+        self.prepare(connection)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(self.executeLiteral(), values)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    # Yields the rows by batches of fetchSize through a named (server side)
+    # cursor: the client never holds more than a batch of the result set
+    def stream(self, connection, values, fetchSize):
+        cursor = connection.cursor(self.name)
+        try:
+            cursor.execute(self.queryLiteral(), values)
+            while True:
+                rows = cursor.fetchmany(fetchSize)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+# Numbers the parameters of a statement in the order of their first use
+class _Params:
+
+    def __init__(self):
+        self.params = []
+
+    def __call__(self, name, pgType):
+        names = [n for n, t in self.params]
+        if name not in names:
+            self.params.append((name, pgType))
+            names.append(name)
+        return '$%s' % (names.index(name) + 1)
+
+
+def _table(model):
+    return '%s.%s' % (model.__table_args__['schema'], model.__tablename__)
+
+
+# The statements of the tiles of one zoom level. With indexModel, the
+# triangles are fetched by id (see forge/lib/tile_index.py). With lakeModel,
+# the watermask is computed.
+class TileQueries:
+
+    def __init__(self, model, indexModel=None, lakeModel=None):
+        self.model = model
+        self.indexModel = indexModel
+        self.lakeModel = lakeModel
+        self.partitions = getattr(model, '__partitions__', None)
+        name = model.__tablename__
+        if indexModel is not None:
+            name += '_indexed'
+        self.corners = self._cornersStatement('tile_corners_%s' % name)
+        self.clip = self._clipStatement('tile_clip_%s' % name)
+        self.ids = None
+        if indexModel is not None:
+            self.ids = self._idsStatement('tile_ids_%s' % name)
+        self.watermask = None
+        if lakeModel is not None:
+            self.watermask = self._watermaskStatement(
+                'tile_watermask_%s' % lakeModel.__tablename__)
+
+    def _bounds(self, p):
+        return [p(name, 'float8') for name in ('minx', 'miny', 'maxx', 'maxy')]
+
+    # Triangles possibly intersecting an envelope
+    def _candidates(self, p, envelope):
+        if self.indexModel is not None:
+            conditions = ['f.id = ANY(%s)' % p('ids', 'bigint[]')]
+        else:
+            conditions = [
+                'f.the_geom && %s' % envelope,
+                'ST_Intersects(f.the_geom, %s)' % envelope
+            ]
+        if self.partitions is not None:
+            conditions.append(
+                'f.partitionkey = ANY(%s)' % p('partitionkeys', 'int[]'))
+        return ' AND '.join(conditions)
+
+    # Height of the triangles at the 4 corners of the tile: (minX, minY),
+    # (minX, maxY), (maxX, maxY), (maxX, minY), in a single row of (id,
+    # EWKB point) pairs
+    def _cornersStatement(self, name):
+        p = _Params()
+        (minX, minY, maxX, maxY) = self._bounds(p)
+        offset = CORNER_TOLERANCE / 2
+        subqueries = []
+        for i, (x, y) in enumerate(
+                [(minX, minY), (minX, maxY), (maxX, maxY), (maxX, minY)]):
+            point = 'ST_SetSRID(ST_MakePoint(%s, %s, 0), 4326)' % (x, y)
+            envelope = 'ST_MakeEnvelope(%s - %s, %s - %s, %s + %s, %s + %s, ' \
+                '4326)' % (x, offset, y, offset, x, offset, y, offset)
+            subqueries.append(
+                '(SELECT f.id, ST_AsEWKB(_interpolate_height_on_plane('
+                'f.the_geom, %(point)s)) AS h FROM %(table)s f '
+                'WHERE %(candidates)s AND ST_Intersects(f.the_geom, '
+                '%(point)s)) AS p%(i)s' % dict(
+                    point=point, table=_table(self.model), i=i,
+                    candidates=self._candidates(p, envelope)))
+        sql = 'SELECT %s FROM %s' % (
+            ', '.join('p%s.id, p%s.h' % (i, i) for i in range(0, 4)),
+            ', '.join(subqueries))
+        return PreparedStatement(name, sql, p.params)
+
+    # Triangles clipped by the tile, one row per triangle (see
+    # PackedRingsBuilder): its id, the number of points of its exterior ring
+    # and the coordinates of the ring as little endian float64 (x, y, z),
+    # the WKB of the ring without its 9 bytes header. The intersections
+    # which are not polygons (touching edges) are left out.
+    def _clipStatement(self, name):
+        p = _Params()
+        envelope = 'ST_MakeEnvelope(%s, %s, %s, %s, 4326)' % tuple(
+            self._bounds(p))
+        sql = "SELECT c.id, ST_NPoints(c.ring), " \
+            "substring(ST_AsBinary(c.ring, 'NDR') FROM 10) " \
+            "FROM (SELECT f.id, ST_ExteriorRing(ST_Intersection(" \
+            "f.the_geom, %s)) AS ring FROM %s f WHERE %s) AS c " \
+            "WHERE c.ring IS NOT NULL" % (
+                envelope, _table(self.model), self._candidates(p, envelope))
+        return PreparedStatement(name, sql, p.params)
+
+    def _idsStatement(self, name):
+        p = _Params()
+        sql = 'SELECT ids FROM %s WHERE zoom = %s AND x = %s AND y = %s' % (
+            _table(self.indexModel), p('zoom', 'smallint'), p('x', 'int'),
+            p('y', 'int'))
+        return PreparedStatement(name, sql, p.params)
+
+    def _watermaskStatement(self, name):
+        p = _Params()
+        envelope = 'ST_MakeEnvelope(%s, %s, %s, %s, 4326)' % tuple(
+            self._bounds(p))
+        sql = "SELECT ST_DumpValues(bgdi_watermask_rasterize(%s, 256, 256, " \
+            "'%s', 'the_geom'), 1, False)" % (envelope, _table(self.lakeModel))
+        return PreparedStatement(name, sql, p.params)
+
+    # Parameters of the statements of a tile
+    def values(self, bounds, tileXYZ=None, ids=None):
+        (minX, minY, maxX, maxY) = bounds
+        values = dict(minx=minX, miny=minY, maxx=maxX, maxy=maxY)
+        if tileXYZ is not None:
+            (values['x'], values['y'], values['zoom']) = tileXYZ
+        if ids is not None:
+            values['ids'] = list(ids)
+        if self.partitions is not None:
+            # Also covers the squares of the corners
+            offset = CORNER_TOLERANCE / 2
+            values['partitionkeys'] = self.partitions.keysIntersecting(
+                (minX - offset, minY - offset, maxX + offset, maxY + offset))
+        return values
+
+    def triangleIds(self, connection, bounds, tileXYZ):
+        rows = self.ids.execute(connection, self.values(bounds, tileXYZ))
+        return rows[0][0] if rows else []
+
+    def watermaskValues(self, connection, bounds):
+        rows = self.watermask.execute(connection, self.values(bounds))
+        return rows[0][0] if rows else []
+
+    # Rows of (id, EWKB point) pairs, see _cornersStatement
+    def cornerRows(self, connection, bounds, ids=None):
+        return self.corners.execute(connection, self.values(bounds, ids=ids))
+
+    # Only the tiles known to have more than fetchSize triangles (with the
+    # tile index, never without it) are streamed by batches of fetchSize through a server
+    # side cursor. Their statement is then planned for the tile, the ids
+    # inlined. The other tiles use the prepared statement.
+    def isStreamed(self, ids, fetchSize):
+        return fetchSize > 0 and ids is not None and len(ids) > fetchSize
+
+    def clippedRings(self, connection, bounds, ids=None, fetchSize=0):
+        values = self.values(bounds, ids=ids)
+        builder = PackedRingsBuilder(nbRings=len(ids) if ids else 0)
+        if self.isStreamed(ids, fetchSize):
+            for rows in self.clip.stream(connection, values, fetchSize):
+                builder.add(rows)
+        else:
+            builder.add(self.clip.execute(connection, values))
+        return builder.packed()
+
+
+# Accumulates rows of the clip statement into arrays growing by doubling
+# their size, the coordinates being copied in a bytearray as they come: the
+# batches of rows can be released once added
+class PackedRingsBuilder:
+
+    # nbRings: expected number of rings, e.g. the number of triangles found
+    # in the tile index
+    def __init__(self, nbRings=0):
+        nbRings = max(nbRings, 16)
+        self.ids = np.empty(nbRings, dtype=np.int64)
+        self.lengths = np.empty(nbRings, dtype=np.int64)
+        self.blob = bytearray()
+        self.nbRings = 0
+
+    def _reserve(self, nbRings):
+        if nbRings <= len(self.ids):
+            return
+        size = max(nbRings, 2 * len(self.ids))
+        for attr in ('ids', 'lengths'):
+            array = np.empty(size, dtype=np.int64)
+            array[:self.nbRings] = getattr(self, attr)[:self.nbRings]
+            setattr(self, attr, array)
+
+    def add(self, rows):
+        start = self.nbRings
+        self._reserve(start + len(rows))
+        for i, (fid, length, ring) in enumerate(rows, start):
+            self.ids[i] = fid
+            self.lengths[i] = length
+            self.blob += ring
+        self.nbRings = start + len(rows)
+
+    def packed(self):
+        n = self.nbRings
+        coords = np.frombuffer(self.blob, dtype='<f8').reshape(-1, 3) \
+            if self.blob else np.zeros((0, 3))
+        return PackedRings(self.ids[:n], self.lengths[:n], coords)
+
+
+# Exterior rings (closed) of clipped triangles decoded without any Python
+# object per vertex: the coordinates of all the rings are in one (n, 3)
+# array
+class PackedRings:
+
+    def __init__(self, ids, lengths, coords):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.offsets[1:])
+        self.coords = coords
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Sets the height of the points of the ring of a triangle located at
+    # point (x, y, z), e.g. at a corner of the tile
+    def setHeight(self, fid, point):
+        found = np.flatnonzero(self.ids == fid)
+        if len(found) == 0:
+            return
+        i = found[0]
+        if not self.coords.flags.writeable:
+            self.coords = self.coords.copy()
+        ring = self.coords[self.offsets[i]:self.offsets[i + 1]]
+        ring[(ring[:, 0] == point[0]) & (ring[:, 1] == point[1]), 2] = point[2]
+
+    # The rings without their closing point, as the encoder expects them:
+    # triangles as views of the coordinates, the others as lists (they are
+    # split into triangles by the encoder)
+    def rings(self):
+        rings = []
+        for i in xrange(0, len(self.ids)):
+            ring = self.coords[self.offsets[i]:self.offsets[i + 1] - 1]
+            rings.append(ring if len(ring) == 3 else ring.tolist())
+        return rings
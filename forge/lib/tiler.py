@@ -2,10 +2,13 @@
 
 import os
 import time
+import json
 import datetime
+import cStringIO
 import ConfigParser
 import multiprocessing
-from sqlalchemy.sql import and_
+from multiprocessing.pool import ThreadPool
+from sqlalchemy.sql import func
 from sqlalchemy.orm.exc import NoResultFound
 from geoalchemy2 import WKBElement
 from geoalchemy2.shape import to_shape
@@ -13,240 +16,375 @@ from quantized_mesh_tile import encode
 from gatilegrid import getTileGrid
 from poolmanager import PoolManager
 
-import forge.lib.cartesian2d as c2d
-from forge.db import DB
+from forge.db import DB, userURL
 from forge.terrain.metadata import TerrainMetadata
-from forge.models.tables import modelsPyramid
+from forge.models.tables import getModelsPyramid, TileChanges, TileIndex, \
+    TileIndexZooms
 from forge.lib.tiles import TerrainTiles, QueueTerrainTiles
-from forge.lib.boto_conn import getBucket, writeToS3, getSQS, writeSQSMessage
-from forge.lib.helpers import timestamp, transformCoordinate, createBBox
-from forge.lib.logs import getLogger
-
-
-# Init logging
-loggingConfig = ConfigParser.RawConfigParser()
-loggingConfig.read('logging.cfg')
-logger = getLogger(loggingConfig, __name__, suffix=timestamp())
+from forge.lib.planner import TileRangePlanner
+from forge.lib.changes import dirtyPlanners
+from forge.lib.estimates import FeatureEstimator
+from forge.lib.messages import decodeRectangles, encodeTilesWithin, \
+    nbTilesInMessage, MessageVersionError
+from forge.lib.queue_worker import VisibilityHeartbeat, MessagePrefetcher, \
+    DEFAULT_VISIBILITY_TIMEOUT
+from forge.lib.costs import UniformCostModel, DensityCostModel, \
+    TimingsCostModel, TileIndexCostModel, balancedChunks, totalCost, \
+    formatTiming
+from forge.lib.tile_queries import TileQueries
+from forge.lib.tile_index import indexBands, buildBand, hasTriangles, \
+    triangleCounts, upToDateZooms, markIndexed, markRefreshed
+from forge.lib.checkpoints import CheckpointWriter, CompletedTiles, \
+    logPath, clearDirectory
+from forge.lib.boto_conn import getBucket, writeToS3
+from forge.lib.shards import Shard, parseManifest, conflictingShards
+from forge.lib.queues import openQueue
+from forge.lib.helpers import timestamp, gzipFileObject
+from forge.lib.logs import getLogger, startLogListener, LogSummary
+
+
+logger = getLogger(__name__, suffix=timestamp())
 
 
 # shared counter
 tilecount = multiprocessing.Value('i', 0)
 skipcount = multiprocessing.Value('i', 0)
 
-visibility_timeout = 3600
+# Default visibility of the queue messages, extended by the workers as long
+# as they are processing them
+visibility_timeout = DEFAULT_VISIBILITY_TIMEOUT
+
+# Keeps SQS messages (base64 encoded) below the 256KB limit
+maxSQSMessageSize = 128 * 1024
+
+# Written by the metadata command, updated by the update command
+layerJSONPath = '.tmp/layer.json'
+
+# Completion manifests of the shards (see TilerManager.create)
+shardsDir = '.tmp/shards'
+
+# Find the triangles of the tiles with the tile index (see TilerManager)
+useTileIndex = False
+
+# Zooms whose tile index is complete and up to date, the triangles of the
+# other zooms are searched spatially (see TilerManager)
+indexedZooms = frozenset()
+
+# Rows of clipped triangles fetched at once through a server side cursor
+# by the tiles having more, 0 to always fetch them all with the prepared
+# statement (see TileQueries.clippedRings)
+tileFetchSize = 10000
+
+# Maximum number of tiles indexed by one statement of the tileindex command
+tileIndexBandTiles = 4096
+
+# Per process file receiving the time spent on each tile (see TilerManager)
+timingsOutput = None
+_timingsFile = None
+
+
+def _writeTiming(tileXYZ, seconds, nbGeoms):
+    global _timingsFile
+    if not timingsOutput:
+        return
+    if _timingsFile is None:
+        _timingsFile = open(timingsOutput % dict(pid=os.getpid()), 'a', 1)
+    _timingsFile.write(formatTiming(tileXYZ, seconds, nbGeoms))
+
+
+# Per process log of the tiles created or skipped (see TilerManager.create)
+checkpointDir = None
+checkpointRunId = None
+_checkpoint = None
+
+
+def _recordTile(tileXYZ):
+    global _checkpoint
+    if not checkpointDir:
+        return
+    if _checkpoint is None:
+        _checkpoint = CheckpointWriter(
+            logPath(checkpointDir, checkpointRunId, os.getpid()))
+    _checkpoint.add(tileXYZ)
+
+
+def _flushCheckpoint():
+    if _checkpoint is not None:
+        _checkpoint.flush()
+
+
+# Per process summaries of the tiles created and skipped, logged at most
+# every tileLogInterval seconds and at the end of each chunk
+tileLogInterval = 10
+createdLog = LogSummary(
+    logger, '[%(pid)s] Wrote %(count)s tiles, last %(key)s (%(rings)s '
+    'rings). %(elapsed)s to write %(created)s tiles. '
+    '(total processed: %(total)s)', interval=tileLogInterval)
+skippedLog = LogSummary(
+    logger, '[%(pid)s] Skipped %(count)s tiles because no features found, '
+    'last %(key)s (%(skipped)s skipped from %(total)s total)',
+    interval=tileLogInterval)
+
+
+def _flushTileLogs():
+    createdLog.flush()
+    skippedLog.flush()
 
 
 def createTileFromQueue(tq):
     pid = os.getpid()
     try:
-        (qName, t0, dbConfigFile, bucketBasePath, hasLighting, hasWatermask) = tq
-        sqs = getSQS()
-        q = sqs.get_queue(qName)
-        geodetic = getTileGrid(4326)(tmsCompatible=True)
+        (qName, queueURL, t0, dbConfigFile, bucketBasePath, hasLighting,
+         hasWatermask, idleTimeout, visibilityTimeout) = tq
+        q = openQueue(qName, queueURL)
+        # The heartbeat and the prefetcher use their own connection
+        hq = q.copy()
+        pq = q.copy()
+        heartbeat = VisibilityHeartbeat(hq.changeVisibility, visibilityTimeout)
+        prefetcher = MessagePrefetcher(
+            lambda: pq.read(visibilityTimeout, 20),
+            lambda m: pq.changeVisibility(m, 0),
+            lambda m: nbTilesInMessage(m.body),
+            heartbeat, logger=logger)
+        heartbeat.start()
+        prefetcher.start()
+        # Tiles addresses are TMS addresses (origin at the bottom left)
+        geodetic = getTileGrid(4326)(
+            originCorner='bottom-left', tmsCompatible=True)
         # we do this as long as we are finding messages in the queue
+        # (the queue may still be filled while we are consuming it)
+        tStart = time.time()
+        idleSince = tStart
+        nbMessages = 0
         while True:
-            parseOk = True
+            m = prefetcher.get(20)
+            if m is None:
+                if time.time() - idleSince < idleTimeout:
+                    continue
+                logger.info(
+                    '[%s] No more messages found. Closing process' % pid)
+                break
+            idleSince = time.time()
+
+            body = m.body
             try:
-                # 20 is maximum wait time
-                m = q.read(
-                    visibility_timeout=visibility_timeout,
-                    wait_time_seconds=20
-                )
-                if m is None:
-                    logger.info(
-                        '[%s] No more messages found. Closing process' % pid)
-                    break
-                body = m.get_body()
-                tiles = map(int, body.split(','))
+                rectangles = decodeRectangles(body)
+            except MessageVersionError as e:
+                # Leave it to a worker knowing this version
+                heartbeat.untrack(m)
+                logger.warning(
+                    '[%s] %s. Leaving message in the queue [%s]' % (
+                        pid, e, body))
+                continue
             except Exception as e:
-                parseOk = False
-
-            if not parseOk or len(tiles) % 3 != 0:
-                msgBody = m.get_body()
+                heartbeat.untrack(m)
                 logger.warning(
                     '[%s] Unparsable message received.'
-                    'Skipping...and removing message [%s]' % (pid, msgBody)
+                    'Skipping...and removing message [%s]' % (pid, body)
                 )
-                q.delete_message(m)
+                q.deleteMessage(m)
                 continue
 
-            for i in range(0, len(tiles), 3):
-                try:
-                    tileXYZ = [tiles[i], tiles[i + 1], tiles[i + 2]]
-                    tilebounds = geodetic.tileBounds(
-                        tileXYZ[2], tileXYZ[0], tileXYZ[1]
-                    )
-                    createTile(
-                        (tilebounds, tileXYZ, t0, dbConfigFile,
-                         bucketBasePath, hasLighting, hasWatermask)
-                    )
-                except Exception as e:
-                    logger.error(
-                        '[%s] Error while processing '
-                        'specific tile %s' % (pid, str(e)), exc_info=True)
+            work = heartbeat.work(m)
+            for rectangle in rectangles:
+                for tileXYZ in rectangle:
+                    tTile = time.time()
+                    try:
+                        tilebounds = geodetic.tileBounds(
+                            tileXYZ[2], tileXYZ[0], tileXYZ[1]
+                        )
+                        createTile(
+                            (tilebounds, tileXYZ, t0, dbConfigFile,
+                             bucketBasePath, hasLighting, hasWatermask)
+                        )
+                    except Exception as e:
+                        logger.error(
+                            '[%s] Error while processing '
+                            'specific tile %s' % (pid, str(e)), exc_info=True)
+                    if work is not None:
+                        work.nbDone += 1
+                    heartbeat.tileDone(time.time() - tTile)
 
             # when successfull, we delete the message from the queue
-            logger.info('[%s] Successfully treated an SQS message: %s' % (
+            heartbeat.untrack(m)
+            logger.info('[%s] Successfully treated a queue message: %s' % (
                 pid, body))
-            q.delete_message(m)
+            _flushTileLogs()
+            q.deleteMessage(m)
+            nbMessages += 1
+
+        # Messages prefetched in the meantime are made visible again
+        prefetcher.stop()
+        heartbeat.stop()
+        elapsed = time.time() - tStart
+        logger.info(
+            '[%s] Treated %s messages in %s, waited on the queue for %s '
+            '(%.1f%% idle)' % (
+                pid, nbMessages, str(datetime.timedelta(seconds=elapsed)),
+                str(datetime.timedelta(seconds=prefetcher.waited)),
+                100.0 * prefetcher.waited / elapsed if elapsed else 0.0))
     except Exception as e:
         logger.error(
             '[%s] Error occured during processing. '
             'Halting process ' % str(e), exc_info=True)
 
 
+def createTileChunk(chunk):
+    for tile in chunk:
+        createTile(tile)
+    _flushCheckpoint()
+    _flushTileLogs()
+    return len(chunk)
+
+
+# The database of the tiles, one per process: its connections and the
+# statements prepared on them are reused by all the tiles of the process
+_tileDBs = {}
+
+
+def _tileDB(dbConfigFile):
+    key = (os.getpid(), dbConfigFile)
+    if key not in _tileDBs:
+        _tileDBs[key] = DB(dbConfigFile)
+    return _tileDBs[key]
+
+
+# Statements of the tiles per zoom (see forge/lib/tile_queries.py)
+_tileQueries = {}
+
+
+def _queriesByZoom(zoom, hasWatermask):
+    indexed = zoom in indexedZooms
+    key = (zoom, indexed, bool(hasWatermask))
+    if key not in _tileQueries:
+        pyramid = getModelsPyramid()
+        _tileQueries[key] = TileQueries(
+            pyramid.getModelByZoom(zoom),
+            indexModel=TileIndex if indexed else None,
+            lakeModel=pyramid.getLakeModelByZoom(zoom) if hasWatermask
+            else None)
+    return _tileQueries[key]
+
+
 def createTile(tile):
-    session = None
+    connection = None
     pid = os.getpid()
+    tstart = time.time()
 
     try:
         (bounds, tileXYZ, t0, dbConfigFile, bucketBasePath,
             hasLighting, hasWatermask) = tile
 
-        db = DB(dbConfigFile)
         bucketKey = '%s/%s/%s.terrain' % (
             tileXYZ[2], tileXYZ[0], tileXYZ[1])
-        with db.userSession() as session:
-            bucket = getBucket()
-
-            # Get the model according to the zoom level
-            model = modelsPyramid.getModelByZoom(tileXYZ[2])
-
-            watermask = []
-            if hasWatermask:
-                lakeModel = modelsPyramid.getLakeModelByZoom(tileXYZ[2])
-                query = session.query(
-                    lakeModel.watermaskRasterize(bounds).label('watermask')
-                )
-                for q in query:
-                    watermask = q.watermask
-
-            # Get the interpolated point at the 4 corners
-            # 0: (minX, minY), 1: (minX, maxY),
-            # 2: (maxX, maxY), 3: (maxX, minY)
-            pts = [
-                (bounds[0], bounds[1], 0),
-                (bounds[0], bounds[3], 0),
-                (bounds[2], bounds[3], 0),
-                (bounds[2], bounds[1], 0)
-            ]
-
-            def toSubQuery(x):
-                return session.query(
-                    model.id, model.interpolateHeightOnPlane(pts[x])
-                ).filter(
-                    and_(
-                        model.bboxIntersects(createBBox(pts[x], 0.01)),
-                        model.pointIntersects(pts[x])
-                    )
-                ).subquery('p%s' % x)
-            subqueries = [toSubQuery(i) for i in range(0, len(pts))]
-
-            # Get the height of the corner points as postgis cannot properly
-            # clip a polygon
-            cornerPts = {}
-            step = 2
-            j = step
-            query = session.query(*subqueries)
-            for q in query:
-                for i in range(0, len(q), step):
-                    sub = q[i:j]
-                    j += step
-                    cornerPts[sub[0]] = list(
-                        to_shape(WKBElement(sub[1])).coords
-                    )
-
-            # Clip using the bounds
-            clippedGeometry = model.bboxClippedGeom(bounds)
-            query = session.query(
-                model.id,
-                clippedGeometry.label('clip')
-            ).filter(model.bboxIntersects(bounds))
-
-            geomCoords = []
-            for q in query:
-                coords = list(to_shape(q.clip).exterior.coords)
-                if q.id in cornerPts:
-                    pt = cornerPts[q.id][0]
-                    for i in range(0, len(coords)):
-                        c = coords[i]
-                        if c[0] == pt[0] and c[1] == pt[1]:
-                            coords[i] = [c[0], c[1], pt[2]]
-                geomCoords.append(coords)
-
-            nbGeoms = len(geomCoords)
-            if nbGeoms > 0:
-                try:
-                    terrainTile = encode(geomCoords,
-                                         bounds=bounds,
-                                         autocorrectGeometries=True,
-                                         hasLighting=hasLighting,
-                                         watermask=watermask)
-                except Exception as e:
-                    msg = '[%s] --------- ERROR ------- occured while ' % pid
-                    msg += 'encoding terrain tile\n'
-                    msg += '[%s]: %s' % (pid, e)
-                    logger.error(msg, exc_info=True)
-                    raise Exception(e)
-
-                writeToS3(
-                    bucket,
-                    bucketKey,
-                    terrainTile.toBytesIO(gzipped=True),
-                    model.__tablename__,
-                    bucketBasePath,
-                    contentType=terrainTile.getContentType()
+        connection = _tileDB(dbConfigFile).userEngine.raw_connection()
+        bucket = getBucket()
+
+        # Get the model and the statements according to the zoom level
+        model = getModelsPyramid().getModelByZoom(tileXYZ[2])
+        queries = _queriesByZoom(tileXYZ[2], hasWatermask)
+
+        watermask = []
+        if hasWatermask:
+            watermask = queries.watermaskValues(connection, bounds)
+
+        # With the tile index, the triangles are fetched by id
+        ids = None
+        if tileXYZ[2] in indexedZooms:
+            ids = queries.triangleIds(connection, bounds, tileXYZ)
+
+        # Get the height of the corner points as postgis cannot properly
+        # clip a polygon
+        cornerPts = {}
+        step = 2
+        j = step
+        for q in queries.cornerRows(connection, bounds, ids=ids):
+            for i in range(0, len(q), step):
+                sub = q[i:j]
+                j += step
+                cornerPts[sub[0]] = list(
+                    to_shape(WKBElement(sub[1])).coords
                 )
-                tend = time.time()
-                tilecount.value += 1
-                tilesCreated = tilecount.value
-                total = tilesCreated + skipcount.value
-                if tilesCreated % 1000 == 0:
-                    logger.info(
-                        '[%s] Last tile %s (%s rings). '
-                        '%s to write %s tiles. (total processed: %s)' % (
-                            pid,
-                            bucketKey,
-                            nbGeoms,
-                            str(datetime.timedelta(seconds=tend - t0)),
-                            tilesCreated,
-                            total
-                        )
-                    )
 
-            else:
-                skipcount.value += 1
-                val = skipcount.value
-                total = val + tilecount.value
-                # TODO: Who is one?
-                # One should write an empyt tile
-                logger.info(
-                    '[%s] Skipping %s %s because no features found '
-                    'for this tile (%s skipped from %s total)' % (
-                        pid, bucketKey, bounds, val, total
-                    )
-                )
+        # Clip using the bounds, the triangles come packed in arrays
+        clipped = queries.clippedRings(
+            connection, bounds, ids=ids, fetchSize=tileFetchSize)
+        for fid, pt in cornerPts.items():
+            clipped.setHeight(fid, pt[0])
+
+        nbGeoms = len(clipped)
+        if nbGeoms > 0:
+            try:
+                terrainTile = encode(clipped.rings(),
+                                     bounds=bounds,
+                                     autocorrectGeometries=True,
+                                     hasLighting=hasLighting,
+                                     watermask=watermask)
+            except Exception as e:
+                msg = '[%s] --------- ERROR ------- occured while ' % pid
+                msg += 'encoding terrain tile\n'
+                msg += '[%s]: %s' % (pid, e)
+                logger.error(msg, exc_info=True)
+                raise Exception(e)
+
+            writeToS3(
+                bucket,
+                bucketKey,
+                terrainTile.toBytesIO(gzipped=True),
+                model.__tablename__,
+                bucketBasePath,
+                contentType=terrainTile.getContentType()
+            )
+            tend = time.time()
+            tilecount.value += 1
+            tilesCreated = tilecount.value
+            createdLog.add(
+                key=bucketKey, rings=nbGeoms,
+                elapsed=str(datetime.timedelta(seconds=tend - t0)),
+                created=tilesCreated,
+                total=tilesCreated + skipcount.value)
+
+        else:
+            skipcount.value += 1
+            val = skipcount.value
+            # TODO: Who is one?
+            # One should write an empyt tile
+            skippedLog.add(
+                key=bucketKey, skipped=val, total=val + tilecount.value)
+        _writeTiming(tileXYZ, time.time() - tstart, nbGeoms)
+        _recordTile(tileXYZ)
     except Exception as e:
         logger.error(e, exc_info=True)
         raise Exception(e)
     finally:
-        db.userEngine.dispose()
+        # Back to the pool of the process (rolled back), the connection
+        # stays open
+        if connection is not None:
+            connection.close()
 
     return 0
 
 
+def hasTerrain(session, bounds, tileXYZ):
+    if tileXYZ[2] in indexedZooms:
+        return hasTriangles(session, TileIndex, tileXYZ)
+    # Get the model according to the zoom level
+    model = getModelsPyramid().getModelByZoom(tileXYZ[2])
+    query = session.query(model.id).filter(
+        model.bboxIntersects(bounds)
+    ).limit(1)
+    try:
+        query.one()
+    except NoResultFound:
+        return False
+    return True
+
+
 def scanTerrain(tMeta, tile, session, tilecount):
     try:
         (bounds, tileXYZ, t0, dbConfigFile, bucketBasePath, hasLighting, hasWatermask) = tile
 
-        # Get the model according to the zoom level
-        model = modelsPyramid.getModelByZoom(tileXYZ[2])
-        query = session.query(model.id).filter(
-            model.bboxIntersects(bounds)
-        ).limit(1)
-        try:
-            query.one()
-        except NoResultFound as e:
+        if not hasTerrain(session, bounds, tileXYZ):
             tMeta.removeTile(tileXYZ[0], tileXYZ[1], tileXYZ[2])
     except Exception as e:
         logger.error(e, exc_info=True)
@@ -260,6 +398,22 @@ def scanTerrain(tMeta, tile, session, tilecount):
     return tMeta
 
 
+def buildTileIndexBand(task):
+    db = None
+    try:
+        (dbConfigFile, band, tileSize) = task
+        db = DB(dbConfigFile)
+        with db.userSession() as session:
+            model = getModelsPyramid().getModelByZoom(band[0])
+            return buildBand(session, TileIndex, model, band, tileSize)
+    except Exception as e:
+        logger.error(e, exc_info=True)
+        raise Exception(e)
+    finally:
+        if db is not None:
+            db.userEngine.dispose()
+
+
 class TilerManager:
 
     def __init__(self, dbConfigFile, tmsConfigFile):
@@ -268,34 +422,267 @@ class TilerManager:
         tmsConfig = ConfigParser.RawConfigParser()
         tmsConfig.read(tmsConfigFile)
         self.tmsConfig = tmsConfig
+        self._setupTileIndex()
+        self._setupFetchSize()
+
+    # Before the workers are forked, they inherit the setting
+    def _setupTileIndex(self):
+        global useTileIndex
+        useTileIndex = False
+        if self.tmsConfig.has_option('General', 'tileIndex'):
+            useTileIndex = self.tmsConfig.getboolean('General', 'tileIndex')
+
+    def _setupFetchSize(self):
+        global tileFetchSize
+        tileFetchSize = 10000
+        if self.tmsConfig.has_option('General', 'tileFetchSize'):
+            tileFetchSize = self.tmsConfig.getint('General', 'tileFetchSize')
+
+    # Before the workers are forked, they inherit the zooms whose index is
+    # used. The index of a zoom never built, built from another table or
+    # outdated by a reingestion would silently drop triangles.
+    def _setupIndexedZooms(self):
+        global indexedZooms
+        indexedZooms = frozenset()
+        if not useTileIndex:
+            return
+        pyramid = getModelsPyramid()
+        tablenameByZoom = {}
+        for zoom in range(self.tmsConfig.getint('Zooms', 'tileMinZ'),
+                          self.tmsConfig.getint('Zooms', 'tileMaxZ') + 1):
+            model = pyramid.getModelByZoom(zoom)
+            if model is not None:
+                tablenameByZoom[zoom] = model.__tablename__
+        db = DB(self.dbConfigFile)
+        try:
+            with db.userSession() as session:
+                indexedZooms = upToDateZooms(
+                    session, TileIndexZooms, tablenameByZoom)
+        finally:
+            db.userEngine.dispose()
+        missing = sorted(set(tablenameByZoom) - indexedZooms)
+        if missing:
+            logger.warning(
+                'The tile index of the zooms %s is missing or outdated (run '
+                'the tileindex command), their triangles are searched '
+                'spatially' % ', '.join(str(z) for z in missing))
+
+    # The models are declared before the workers are forked, they inherit
+    # them. The workers log through the log listener of this process.
+    def _poolManager(self, procfactor):
+        getModelsPyramid()
+        self._setupIndexedZooms()
+        startLogListener(logger.suffix)
+        return PoolManager(factor=procfactor)
+
+    def _setupTimings(self):
+        global timingsOutput
+        timingsOutput = None
+        if self.tmsConfig.has_option('Costs', 'timingsOutput'):
+            timingsOutput = self.tmsConfig.get('Costs', 'timingsOutput')
+
+    # Returns the tiles already processed when resuming, otherwise clears
+    # the checkpoints of the previous run
+    def _setupCheckpoints(self, planner, resume):
+        global checkpointDir, checkpointRunId
+        checkpointDir = '.tmp/checkpoints'
+        if self.tmsConfig.has_option('General', 'checkpoints'):
+            checkpointDir = self.tmsConfig.get('General', 'checkpoints')
+        checkpointRunId = int(self.t0)
+        if not checkpointDir:
+            return None
+        if not os.path.exists(checkpointDir):
+            os.makedirs(checkpointDir)
+        if not resume:
+            clearDirectory(checkpointDir)
+            return None
+        completed = CompletedTiles.fromDirectory(checkpointDir, planner)
+        completed.compact(checkpointDir)
+        logger.info('Resuming, %s tiles were already processed' % (
+            completed.numberOfTiles()))
+        return completed
+
+    def _costModel(self, planner):
+        name = 'uniform'
+        if self.tmsConfig.has_option('Costs', 'model'):
+            name = self.tmsConfig.get('Costs', 'model')
+        if name == 'timings':
+            return TimingsCostModel.fromLogs(
+                self.tmsConfig.get('Costs', 'timings'))
+        elif name == 'density':
+            densityZoom = self.tmsConfig.getint('Costs', 'densityZoom')
+            samplePercent = 1.0
+            if self.tmsConfig.has_option('Costs', 'densitySamplePercent'):
+                samplePercent = self.tmsConfig.getfloat(
+                    'Costs', 'densitySamplePercent')
+            models = dict(
+                (z, getModelsPyramid().getModelByZoom(z)) for z in planner.zooms)
+            db = DB(self.dbConfigFile)
+            try:
+                with db.userSession() as session:
+                    return DensityCostModel.fromDB(
+                        session, models, planner.bounds, densityZoom,
+                        samplePercent)
+            finally:
+                db.userEngine.dispose()
+        elif name == 'index':
+            db = DB(self.dbConfigFile)
+            try:
+                with db.userSession() as session:
+                    return TileIndexCostModel(
+                        triangleCounts(session, TileIndex, planner))
+            finally:
+                db.userEngine.dispose()
+        elif name != 'uniform':
+            raise ValueError('Unknown cost model %s' % name)
+        return UniformCostModel()
+
+    # Returns the cost model and the predicted cost of all the tiles
+    def _planCost(self, planner):
+        costModel = self._costModel(planner)
+        return (costModel, totalCost(
+            planner.iterTiles(), costModel, tileXYZ=lambda t: t))
+
+    # Returns the cost model and the cost of a chunk, the predicted work
+    # of a chunk being equivalent to the work of maxChunks average tiles
+    def _chunkCost(self, planner, maxChunks, planCost=None):
+        (costModel, total) = planCost or self._planCost(planner)
+        nbTiles = planner.numberOfTiles()
+        meanCost = 1.0
+        if nbTiles > 0:
+            meanCost = total / nbTiles
+        logger.info('Using %s with an average cost of %s per tile' % (
+            costModel.__class__.__name__, meanCost))
+        return (costModel, maxChunks * meanCost)
+
+    def _balancedChunks(self, tiles, planner, maxChunks, maxTiles=None,
+                        planCost=None):
+        (costModel, targetCost) = self._chunkCost(
+            planner, maxChunks, planCost=planCost)
+        return balancedChunks(
+            tiles, costModel, targetCost, maxTiles=maxTiles)
+
+    # Settings the shards of a pyramid must share
+    def _shardPlan(self, tiles, planCost):
+        return dict(
+            bounds=list(tiles.bounds),
+            minZoom=tiles.tileMinZ,
+            maxZoom=tiles.tileMaxZ,
+            order=tiles.order,
+            footprint=tiles.footprint is not None,
+            costModel=planCost[0].__class__.__name__,
+            totalCost=planCost[1]
+        )
+
+    # The manifest is kept locally and next to the tiles in the bucket
+    def _writeShardManifest(self, shard, manifest):
+        if not os.path.exists(shardsDir):
+            os.makedirs(shardsDir)
+        with open(os.path.join(shardsDir, shard.manifestName()), 'w') as f:
+            f.write(manifest)
+        bucketBasePath = self.tmsConfig.get('General', 'bucketpath')
+        try:
+            writeToS3(
+                getBucket(),
+                'shards/%s' % shard.manifestName(),
+                gzipFileObject(cStringIO.StringIO(manifest)),
+                'shard',
+                bucketBasePath,
+                contentType='application/json'
+            )
+        except Exception as e:
+            logger.error(
+                'Shard manifest could not be written to S3: %s' % e,
+                exc_info=True)
 
-    def create(self):
+    # Manifests of the shards of the pyramid found in the bucket
+    def _shardManifests(self):
+        bucketBasePath = self.tmsConfig.get('General', 'bucketpath')
+        return [
+            parseManifest(key.get_contents_as_string())
+            for key in getBucket().list(prefix=bucketBasePath + 'shards/')]
+
+    def _conflictingShards(self, shard, plan):
+        try:
+            manifests = self._shardManifests()
+        except Exception as e:
+            logger.warning(
+                'Shard manifests could not be read from S3: %s' % e,
+                exc_info=True)
+            return []
+        return conflictingShards(manifests, shard, plan)
+
+    # The machines compute their ranges independently: the cost model must
+    # predict the same costs everywhere and the shards already created must
+    # have used the same plan
+    def _checkShard(self, shard, costModel, plan):
+        if not getattr(costModel, 'deterministic', False):
+            raise ValueError(
+                'The %s differs from one machine to another, it cannot be '
+                'used with --shard' % costModel.__class__.__name__)
+        conflicts = self._conflictingShards(shard, plan)
+        if conflicts:
+            raise ValueError(
+                'Shards %s were created with another plan (cost model, '
+                'total cost, bounds...) than shard %s, remove their '
+                'manifests to recreate the whole pyramid' % (
+                    ', '.join(conflicts), shard))
+
+    # shard restricts the creation to one forge.lib.shards.Shard, resume
+    # skips the tiles processed by the previous run
+    def create(self, shard=None, resume=False):
         def callback(counter, result):
-            if not counter % 10000:
-                logger.info('counter: %s' % counter)
-                logger.info('result: %s' % result)
+            if not counter % 100:
+                logger.info('chunks: %s' % counter)
+                logger.info('tiles in last chunk: %s' % result)
 
         self.t0 = time.time()
 
         tilecount.value = 0
         skipcount.value = 0
+        self._setupTimings()
 
         tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, self.t0)
+        planner = TileRangePlanner.fromTerrainTiles(tiles)
+        # Before the workers are forked, they inherit the settings
+        completed = self._setupCheckpoints(planner, resume)
+        planCost = self._planCost(planner)
+        if shard is not None:
+            self._checkShard(
+                shard, planCost[0], self._shardPlan(tiles, planCost))
         procfactor = int(self.tmsConfig.get('General', 'procfactor'))
 
-        pm = PoolManager(factor=procfactor)
+        pm = self._poolManager(procfactor)
         maxChunks = int(self.tmsConfig.get('General', 'maxChunks'))
 
-        nbTiles = self.numOfTiles()
+        nbTiles = planner.numberOfTiles()
+        tilesIter = tiles
+        if shard is not None:
+            # Approximately, shards are balanced by cost
+            nbTiles = nbTiles // shard.count
+            tilesIter = shard.filter(tiles, planCost[0], planCost[1])
+            logger.info('Creating shard %s' % shard)
+        if completed is not None:
+            if shard is not None:
+                # Only the tiles of the shard, counted with a copy of it
+                counter = Shard(shard.index, shard.count)
+                nbTiles = sum(
+                    1 for t in counter.filter(tiles, planCost[0], planCost[1])
+                    if t[1] not in completed)
+            else:
+                nbTiles = max(0, nbTiles - completed.numberOfTiles())
+            tilesIter = completed.filter(tilesIter)
         tilesPerProc = int(nbTiles / pm.nbOfProcesses)
         if tilesPerProc < maxChunks:
             maxChunks = tilesPerProc
         if maxChunks < 1:
             maxChunks = 1
 
+        chunks = self._balancedChunks(
+            tilesIter, planner, maxChunks, planCost=planCost)
         logger.info('Starting creation of %s tiles (%s per chunk)' % (
             nbTiles, maxChunks))
-        pm.imap_unordered(createTile, tiles, maxChunks, callback=callback)
+        pm.imap_unordered(createTileChunk, chunks, 1, callback=callback)
 
         tend = time.time()
         logger.info('It took %s to create %s tiles (%s were skipped)' % (
@@ -303,34 +690,216 @@ class TilerManager:
             tilecount.value,
             skipcount.value
         ))
+        if shard is not None:
+            plan = self._shardPlan(tiles, planCost)
+            self._writeShardManifest(shard, shard.manifest(
+                plan, self.t0, tilecount.value, skipcount.value))
+            # A shard started meanwhile with other settings
+            conflicts = self._conflictingShards(shard, plan)
+            if conflicts:
+                logger.error(
+                    'Shards %s were created with another plan than shard '
+                    '%s, their tiles may overlap or leave gaps' % (
+                        ', '.join(conflicts), shard))
+
+    # Regenerates the tiles touched by the changes recorded when
+    # shapefiles are reingested (see DB.reingest) and updates layer.json
+    def update(self):
+        def callback(counter, result):
+            if not counter % 100:
+                logger.info('chunks: %s' % counter)
+
+        self.t0 = time.time()
+        tilecount.value = 0
+        skipcount.value = 0
+        self._setupTimings()
+
+        tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, self.t0)
+        db = DB(self.dbConfigFile)
+        extentsByTable = {}
+        try:
+            with db.userSession() as session:
+                changes = session.query(
+                    TileChanges.id, TileChanges.tablename,
+                    func.ST_XMin(TileChanges.the_geom),
+                    func.ST_YMin(TileChanges.the_geom),
+                    func.ST_XMax(TileChanges.the_geom),
+                    func.ST_YMax(TileChanges.the_geom)
+                ).filter(TileChanges.regenerated == None).all()
+        finally:
+            db.userEngine.dispose()
+        if not changes:
+            logger.info('No changes to regenerate')
+            return
+        for change in changes:
+            extentsByTable.setdefault(change[1], []).append(change[2:])
+
+        planners = dirtyPlanners(
+            tiles.bounds, range(tiles.tileMinZ, tiles.tileMaxZ + 1),
+            lambda z: getModelsPyramid().getModelByZoom(z).__tablename__,
+            extentsByTable, footprint=tiles.footprint)
+
+        def dirtyTiles():
+            for zoom in sorted(planners):
+                planner = planners[zoom]
+                r = planner.zoomRange(zoom)
+                for tile in tiles.iterPartition((zoom, r.minY, r.maxY), planner):
+                    yield tile
+
+        if useTileIndex:
+            self._buildTileIndex(planners.values(), complete=False)
+
+        nbTiles = sum(p.numberOfTiles() for p in planners.values())
+        procfactor = int(self.tmsConfig.get('General', 'procfactor'))
+        pm = self._poolManager(procfactor)
+        maxChunks = int(self.tmsConfig.get('General', 'maxChunks'))
+        maxChunks = max(1, min(maxChunks, nbTiles // pm.nbOfProcesses))
+        logger.info('Regenerating %s tiles touched by %s changes' % (
+            nbTiles, len(changes)))
+        pm.imap_unordered(
+            createTileChunk,
+            balancedChunks(dirtyTiles(), UniformCostModel(), maxChunks),
+            1, callback=callback)
+
+        self._updateMetadata(tiles, dirtyTiles())
+
+        db = DB(self.dbConfigFile)
+        try:
+            with db.userSession() as session:
+                session.query(TileChanges).filter(
+                    TileChanges.id.in_([c[0] for c in changes])
+                ).update({'regenerated': func.now()},
+                         synchronize_session=False)
+                session.commit()
+        finally:
+            db.userEngine.dispose()
+
+        tend = time.time()
+        logger.info('It took %s to regenerate %s tiles (%s were skipped)' % (
+            str(datetime.timedelta(seconds=tend - self.t0)),
+            tilecount.value,
+            skipcount.value
+        ))
+
+    # Builds the tile index of the whole pyramid, to be run after the
+    # ingestion (see forge/lib/tile_index.py)
+    def buildTileIndex(self):
+        self.t0 = time.time()
+        self._buildTileIndex([self._planner()])
+
+    # complete: the planners cover the zooms, which are then recorded as
+    # indexed, otherwise only the stale zooms get refreshed (see update)
+    def _buildTileIndex(self, planners, complete=True):
+        def callback(counter, result):
+            nbIndexed[0] += result
+            nbBands[0] += 1
+            if not counter % 100:
+                logger.info('bands: %s (%s tiles with triangles)' % (
+                    counter, nbIndexed[0]))
 
-    # Create AWS sqs queue with all the tiles to create
+        t0 = time.time()
+        nbIndexed = [0]
+        nbBands = [0]
+        tasks = []
+        for planner in planners:
+            for band in indexBands(planner, tileIndexBandTiles):
+                tasks.append((
+                    self.dbConfigFile, band,
+                    planner.zoomRange(band[0]).tileSize))
+        procfactor = int(self.tmsConfig.get('General', 'procfactor'))
+        pm = self._poolManager(procfactor)
+        logger.info('Indexing the triangles of %s bands of tiles' % len(tasks))
+        pm.imap_unordered(buildTileIndexBand, tasks, 1, callback=callback)
+        tend = time.time()
+        logger.info('It took %s to index %s tiles with triangles' % (
+            str(datetime.timedelta(seconds=tend - t0)), nbIndexed[0]))
+        if nbBands[0] < len(tasks):
+            logger.error(
+                '%s bands could not be indexed, the index of their zooms '
+                'is not used' % (len(tasks) - nbBands[0]))
+            return
+        zooms = set(z for planner in planners for z in planner.zooms)
+        pyramid = getModelsPyramid()
+        db = DB(self.dbConfigFile)
+        try:
+            with db.userSession() as session:
+                if complete:
+                    for zoom in zooms:
+                        markIndexed(
+                            session, TileIndexZooms, zoom,
+                            pyramid.getModelByZoom(zoom).__tablename__)
+                else:
+                    markRefreshed(session, TileIndexZooms, zooms)
+                session.commit()
+        finally:
+            db.userEngine.dispose()
+
+    # Updates the availability of the given tiles in layer.json
+    def _updateMetadata(self, tiles, changedTiles):
+        if not os.path.exists(layerJSONPath):
+            logger.warning(
+                '%s not found, run the metadata command' % layerJSONPath)
+            return
+        with open(layerJSONPath, 'r') as f:
+            available = json.load(f)['available']
+        tMeta = self._terrainMetadata(tiles)
+        masks = tMeta.availabilityMasks(available)
+        self._setupIndexedZooms()
+        db = DB(self.dbConfigFile)
+        try:
+            with db.userSession() as session:
+                for tile in changedTiles:
+                    (bounds, (x, y, z)) = tile[:2]
+                    minX = tMeta.metadata[z]['x'][0]
+                    minY = tMeta.metadata[z]['y'][0]
+                    masks[z][y - minY, x - minX] = hasTerrain(
+                        session, bounds, (x, y, z))
+        finally:
+            db.userEngine.dispose()
+        tMeta.removeUnavailable(masks)
+        with open(layerJSONPath, 'w') as f:
+            f.write(tMeta.toJSON())
+
+    # None for AWS SQS, otherwise the SQLAlchemy url of the queue database
+    def _queueURL(self):
+        backend = 'sqs'
+        if self.tmsConfig.has_option('General', 'queueBackend'):
+            backend = self.tmsConfig.get('General', 'queueBackend').strip()
+        if backend == 'sqs':
+            return None
+        elif backend == 'database':
+            # The tiles database (see database.cfg), as its regular user
+            return userURL(self.dbConfigFile)
+        return backend
+
+    # Create the work queue with all the tiles to create
     # based on current configuration as well as meta data
     def createQueue(self):
         queueName = self.tmsConfig.get('General', 'sqsqueue')
         maxChunks = int(self.tmsConfig.get('General', 'maxChunks'))
+        # Tiles (of average cost) per message
+        if self.tmsConfig.has_option('General', 'messageTiles'):
+            maxChunks = self.tmsConfig.getint('General', 'messageTiles')
         self.t0 = time.time()
         if len(queueName) <= 0:
             logger.error('Missing queueName')
             return
         try:
-            sqs = getSQS()
-            q = sqs.get_queue(queueName)
-            if q is not None:
+            q = openQueue(queueName, self._queueURL())
+            if q.exists():
                 logger.error(
                     'Queue already exists. Can\'t overwrite'
                     ' existing queue. [%s]' % (queueName))
                 return
 
-            # queue with default message visiblity time of 3600.
-            # So each message is blocked for other users for 3600 seconds.
-            # Default would be 30 seconds.
-            # It's that high because each message contains maxChunks tiles
-            q = sqs.create_queue(
-                queueName, visibility_timeout=visibility_timeout)
-            # Assure queue is kept for maximum of 14 weeks (aws limit).
-            # default would be 4 days.
-            sqs.set_queue_attribute(q, 'MessageRetentionPeriod', 1209600)
+            # Short default visibility so that the messages of a crashed
+            # worker come back quickly, the workers extend the visibility
+            # of the messages they are processing (see queue_worker)
+            visibilityTimeout = visibility_timeout
+            if self.tmsConfig.has_option('General', 'queueVisibilityTimeout'):
+                visibilityTimeout = self.tmsConfig.getint(
+                    'General', 'queueVisibilityTimeout')
+            q.create(visibilityTimeout)
         except Exception as e:
             logger.error(
                 'Error during creation of queue:\n' + str(e), exc_info=True)
@@ -344,41 +913,61 @@ class TilerManager:
 
         logger.info('Queue ' + queueName + ' has been created')
         tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, self.t0)
-        nbTiles = self.numOfTiles()
+        planner = TileRangePlanner.fromTerrainTiles(tiles)
+        nbTiles = planner.numberOfTiles()
+        nbProducers = 4
+        if self.tmsConfig.has_option('General', 'queueProducers'):
+            nbProducers = self.tmsConfig.getint('General', 'queueProducers')
+        totalcount = 0
+        messagecount = 0
         try:
+            (costModel, targetCost) = self._chunkCost(planner, maxChunks)
+            # Several partitions per producer so that they all end together
+            partitions = tiles.partitions(
+                max(maxChunks, nbTiles // (nbProducers * 4)))
             logger.info(
-                'Starting creation of SQS queue with approx. '
-                '%s tiles)' % (nbTiles))
-            totalcount = 0
-            tcount = 0
-            messagecount = 0
-            msg = ''
-            for tile in tiles:
-                (bounds, tileXYZ, t0, dbConfigFile,
-                 bucketBasePath, hasLighting, hasWatermask) = tile
-                if msg:
-                    msg += ','
-                msg += ('%s,%s,%s' % (
-                    str(tileXYZ[0]), str(tileXYZ[1]), str(tileXYZ[2])
-                ))
-                tcount += 1
-                if tcount >= maxChunks:
-                    messagecount += 1
-                    writeSQSMessage(q, msg)
-                    tcount = 0
-                    msg = ''
-                totalcount = totalcount + 1
-            if msg:
-                messagecount += 1
-                writeSQSMessage(q, msg)
+                'Starting creation of queue with approx. '
+                '%s tiles (%s partitions, %s producers)' % (
+                    nbTiles, len(partitions), nbProducers))
+
+            def produce(partition):
+                # Each thread uses its own connection
+                producerQueue = q.copy()
+                chunks = balancedChunks(
+                    tiles.iterPartition(partition, planner), costModel,
+                    targetCost)
+                nbTilesSent = [0]
+
+                def bodies():
+                    for chunk in chunks:
+                        nbTilesSent[0] += len(chunk)
+                        for body in encodeTilesWithin(
+                                (tile[1] for tile in chunk),
+                                maxSQSMessageSize):
+                            yield body
+                nbMessages = producerQueue.write(bodies())
+                return (nbMessages, nbTilesSent[0])
+
+            pool = ThreadPool(nbProducers)
+            try:
+                for nbMessages, nbTilesSent in pool.imap_unordered(
+                        produce, partitions):
+                    messagecount += nbMessages
+                    totalcount += nbTilesSent
+                    logger.info(
+                        '%s messages representing %s tiles written' % (
+                            messagecount, totalcount))
+            finally:
+                pool.close()
+                pool.join()
         except Exception as e:
             logger.error(
-                'Error during writing of sqs message:\n' + str(e),
+                'Error during writing of queue message:\n' + str(e),
                 exc_info=True)
 
         tend = time.time()
         logger.info(
-            'It took %s to create %s message in SQS gueue '
+            'It took %s to create %s message in queue '
             'representing %s tiles' % (
                 str(datetime.timedelta(seconds=tend - self.t0)),
                 messagecount, totalcount
@@ -393,9 +982,7 @@ class TilerManager:
             logger.error('Missing queueName')
             return
         try:
-            sqs = getSQS()
-            q = sqs.get_queue(queueName)
-            sqs.delete_queue(q)
+            openQueue(queueName, self._queueURL()).delete()
         except Exception as e:
             logger.error(
                 'Error during deletion of queue:\n' + str(e), exc_info=True)
@@ -405,6 +992,7 @@ class TilerManager:
     def createTiles(self):
         tilecount.value = 0
         skipcount.value = 0
+        self._setupTimings()
         queueName = self.tmsConfig.get('General', 'sqsqueue')
         self.t0 = time.time()
         if len(queueName) <= 0:
@@ -412,13 +1000,14 @@ class TilerManager:
             return
         procfactor = int(self.tmsConfig.get('General', 'procfactor'))
 
-        pm = PoolManager(factor=procfactor)
+        pm = self._poolManager(procfactor)
         qtiles = QueueTerrainTiles(
             queueName,
             self.dbConfigFile,
             self.tmsConfig,
             self.t0,
-            pm.nbOfProcesses
+            pm.nbOfProcesses,
+            queueURL=self._queueURL()
         )
 
         logger.info('Starting creation of tiles from queue %s ' % (queueName))
@@ -438,9 +1027,7 @@ class TilerManager:
             logger.error('Missing queueName')
             return
         try:
-            sqs = getSQS()
-            q = sqs.get_queue(queueName)
-            attrs = sqs.get_queue_attributes(q)
+            attrs = openQueue(queueName, self._queueURL()).stats()
         except Exception as e:
             logger.error(
                 'Error during statistics collection:\n' + str(e),
@@ -448,8 +1035,7 @@ class TilerManager:
             return
         logger.info(attrs)
 
-    def metadata(self):
-        t0 = time.time()
+    def _terrainMetadata(self, tiles):
         basePath = self.tmsConfig.get('General', 'bucketpath')
         baseUrls = []
         url = 'https://terrain.dev.bgdi.ch'
@@ -462,9 +1048,7 @@ class TilerManager:
         #    url += '/%s{z}/{x}/{y}.terrain?v={version}' % basePath
         #    baseUrls.append(url)
 
-        db = DB('configs/terrain/database.cfg')
-        tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, t0)
-        tMeta = TerrainMetadata(
+        return TerrainMetadata(
             bounds=tiles.bounds,
             minzoom=tiles.tileMinZ,
             maxzoom=tiles.tileMaxZ,
@@ -473,6 +1057,18 @@ class TilerManager:
             hasWatermask=tiles.hasWatermask,
             baseUrls=baseUrls)
 
+    def metadata(self):
+        t0 = time.time()
+        self._setupIndexedZooms()
+        db = DB('configs/terrain/database.cfg')
+        tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, t0)
+        tMeta = self._terrainMetadata(tiles)
+
+        # Tiles outside of the footprint are never created
+        planner = TileRangePlanner.fromTerrainTiles(tiles)
+        for x, y, z in planner.iterOutsideTiles():
+            tMeta.removeTile(x, y, z)
+
         try:
             with db.userSession() as session:
                 tilecount = 1
@@ -490,65 +1086,64 @@ class TilerManager:
         finally:
             db.userEngine.dispose()
 
-        with open('.tmp/layer.json', 'w') as f:
+        with open(layerJSONPath, 'w') as f:
             f.write(tMeta.toJSON())
 
-    def _stats(self, withDb=True):
-        self.t0 = time.time()
-        total = 0
+    def _planner(self):
+        tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, time.time())
+        return TileRangePlanner.fromTerrainTiles(tiles)
 
+    def _statsMessage(self, planner, estimatesPerZoom=None):
+        estimatesPerZoom = estimatesPerZoom or {}
         msg = '\n'
-        tiles = TerrainTiles(self.dbConfigFile, self.tmsConfig, self.t0)
-        geodetic = getTileGrid(4326)(tmsCompatible=True)
-        bounds = (tiles.minLon, tiles.minLat, tiles.maxLon, tiles.maxLat)
-        zooms = range(tiles.tileMinZ, tiles.tileMaxZ + 1)
+        for zoom in planner.zooms:
+            zRange = planner.zoomRange(zoom)
+            nbTiles = planner.numberOfTilesAtZoom(zoom)
+            estimate = estimatesPerZoom.get(zoom)
+            length = int(round(planner.tileDiagonal(zoom)))
+            msg += 'At zoom %s:\n' % zoom
+            msg += 'We expect %s tiles overall\n' % nbTiles
+            msg += 'Min X is %s, Max X is %s\n' % (zRange.minX, zRange.maxX)
+            msg += '%s columns over X\n' % zRange.xCount
+            msg += 'Min Y is %s, Max Y is %s\n' % (zRange.minY, zRange.maxY)
+            msg += '%s rows over Y\n' % zRange.yCount
+            msg += '\n'
+            msg += 'A tile side is around %s meters\n' % length
+            if nbTiles > 0 and estimate is not None:
+                perTile = estimate.perTile(nbTiles)
+                msg += 'We have an average of about %s triangles ' \
+                       'per tile\n' % perTile.count
+                if estimate.method != 'exact':
+                    msg += '(95%% confidence interval: %s to %s, ' \
+                           'estimated from %s)\n' % (
+                               perTile.low, perTile.high, estimate.method)
+            msg += '\n\n'
+        msg += '%s tiles in total.' % planner.numberOfTiles()
+        return msg
+
+    def _stats(self, withDb=True, exact=False):
+        self.t0 = time.time()
+        planner = self._planner()
+        if not withDb:
+            return (planner.numberOfTiles(), self._statsMessage(planner))
 
-        db = DB('configs/terrain/database.cfg')
+        samplePercent = 1.0
+        if self.tmsConfig.has_option('General', 'statsSamplePercent'):
+            samplePercent = self.tmsConfig.getfloat(
+                'General', 'statsSamplePercent')
+
+        estimatesPerZoom = {}
+        db = DB(self.dbConfigFile)
         try:
             with db.userSession() as session:
-                for i in xrange(0, len(zooms)):
-                    zoom = zooms[i]
-                    model = modelsPyramid.getModelByZoom(zoom)
-                    nbObjects = None
-                    if withDb:
-                        nbObjects = session.query(model).filter(
-                            model.bboxIntersects(bounds)
-                        ).count()
-                    # top letf corner
-                    tileMinX, tileMinY = geodetic.tileAddress(
-                        zoom,
-                        [bounds[0], bounds[3]]
-                    )
-                    # bottom right
-                    tileMaxX, tileMaxY = geodetic.tileAddress(
-                        zoom,
-                        [bounds[2], bounds[1]]
-                    )
-                    tileBounds = geodetic.tileBounds(zoom, tileMinX, tileMinY)
-                    xCount = tileMaxX - tileMinX + 1
-                    yCount = tileMaxY - tileMinY + 1
-                    nbTiles = xCount * yCount
-                    total += nbTiles
-                    pointA = transformCoordinate('POINT(%s %s)' % (
-                        tileBounds[0], tileBounds[1]), 4326, 21781
-                    ).GetPoints()[0]
-                    pointB = transformCoordinate('POINT(%s %s)' % (
-                        tileBounds[2], tileBounds[3]), 4326, 21781
-                    ).GetPoints()[0]
-                    length = int(round(c2d.distance(pointA, pointB)))
-                    msg += 'At zoom %s:\n' % zoom
-                    msg += 'We expect %s tiles overall\n' % nbTiles
-                    msg += 'Min X is %s, Max X is %s\n' % (tileMinX, tileMaxX)
-                    msg += '%s columns over X\n' % xCount
-                    msg += 'Min Y is %s, Max Y is %s\n' % (tileMinY, tileMaxY)
-                    msg += '%s rows over Y\n' % yCount
-                    msg += '\n'
-                    msg += 'A tile side is around %s meters' % length
-                    if nbTiles > 0 and nbObjects is not None:
-                        msg += 'We have an average of about %s triangles ' \
-                               'per tile\n' % int(round(nbObjects / nbTiles))
-                    msg += '\n\n'
-            msg += '%s tiles in total.' % total
+                estimator = FeatureEstimator(session, samplePercent)
+                for zoom in planner.zooms:
+                    model = getModelsPyramid().getModelByZoom(zoom)
+                    if exact:
+                        estimate = estimator.exact(model, planner.bounds)
+                    else:
+                        estimate = estimator.estimate(model, planner.bounds)
+                    estimatesPerZoom[zoom] = estimate
         except Exception as e:
             logger.error('An error occured during statistics collection')
             logger.error('%s' % e, exc_info=True)
@@ -556,16 +1151,22 @@ class TilerManager:
         finally:
             db.userEngine.dispose()
 
-        return (total, msg)
+        return (
+            planner.numberOfTiles(),
+            self._statsMessage(planner, estimatesPerZoom)
+        )
 
     def numOfTiles(self):
-        (total, msg) = self._stats(False)
-        return total
+        return self._planner().numberOfTiles()
 
     def stats(self):
         (total, msg) = self._stats(True)
         logger.info(msg)
 
+    def statsExact(self):
+        (total, msg) = self._stats(True, exact=True)
+        logger.info(msg)
+
     def statsNoDb(self):
         (total, msg) = self._stats(False)
         logger.info(msg)
@@ -2,8 +2,17 @@
 
 from gatilegrid import getTileGrid
 
+from forge.lib.planner import TileRangePlanner
+from forge.lib.footprint import Footprint
+from forge.lib import sfc
+from forge.lib.queue_worker import DEFAULT_VISIBILITY_TIMEOUT
 
-def grid(bounds, minZ, maxZ):
+
+def grid(bounds, minZ, maxZ, order=sfc.ROW, footprint=None):
+    if order != sfc.ROW or footprint is not None:
+        for tile in plannedGrid(bounds, minZ, maxZ, order, footprint):
+            yield tile
+        return
     geodetic = getTileGrid(4326)(extent=bounds, originCorner='bottom-left', tmsCompatible=True)
     gridGenerator = geodetic.iterGrid(
         minZ,
@@ -12,11 +21,84 @@ def grid(bounds, minZ, maxZ):
         yield (tileBounds, (tileX, tileY, tileZ))
 
 
+# Same tiles as grid, ordered along a space filling curve within each zoom
+# and/or restricted to a footprint
+def plannedGrid(bounds, minZ, maxZ, order, footprint):
+    planner = TileRangePlanner(bounds, minZ, maxZ, footprint=footprint)
+    for zoom in planner.zooms:
+        for tile in zoomGrid(planner, zoom, order):
+            yield tile
+
+
+# Tiles of one zoom level, optionally restricted to the rows minY to maxY
+def zoomGrid(planner, zoom, order, minY=None, maxY=None):
+    r = planner.zoomRange(zoom)
+    minY = r.minY if minY is None else max(minY, r.minY)
+    maxY = r.maxY if maxY is None else min(maxY, r.maxY)
+    if order == sfc.ROW:
+        cells = ((x, y) for y in xrange(minY, maxY + 1)
+                 for x in xrange(r.minX, r.maxX + 1))
+    else:
+        cells = sfc.iterRange(
+            r.minX, minY, r.maxX, maxY, sfc.orderAtZoom(zoom), order)
+    mask = None
+    if planner.footprint is not None:
+        mask = planner.footprint.mask(r)
+    for tileX, tileY in cells:
+        if mask is not None and not mask[tileY - r.minY, tileX - r.minX]:
+            continue
+        yield (planner.tileBounds(zoom, tileX, tileY), (tileX, tileY, zoom))
+
+
+# Tiles (x, y) of one zoom level in the order of their keys z/x/y.terrain
+# sorted by name, the order of the bucket listings
+def keyOrderedTiles(planner, zoom):
+    r = planner.zoomRange(zoom)
+    mask = None
+    if planner.footprint is not None:
+        mask = planner.footprint.mask(r)
+    ys = sorted(xrange(r.minY, r.maxY + 1), key=str)
+    for tileX in sorted(xrange(r.minX, r.maxX + 1), key=str):
+        for tileY in ys:
+            if mask is not None and not mask[tileY - r.minY, tileX - r.minX]:
+                continue
+            yield (tileX, tileY)
+
+
+# Splits the pyramid in bands of rows (zoom, minY, maxY) of about
+# nbTiles tiles each. Bands are aligned on the space filling curve blocks.
+def partitions(planner, nbTiles, blockSize=16):
+    parts = []
+    for zoom in planner.zooms:
+        r = planner.zoomRange(zoom)
+        rows = max(1, nbTiles // r.xCount)
+        rows = ((rows + blockSize - 1) // blockSize) * blockSize
+        y = r.minY
+        while y <= r.maxY:
+            # Keep the bands aligned with the grid
+            end = min(r.maxY, (y // blockSize) * blockSize + rows - 1)
+            parts.append((zoom, y, end))
+            y = end + 1
+    return parts
+
+
+def tileOrder(tmsConfig):
+    order = sfc.ROW
+    if tmsConfig.has_option('General', 'tileOrder'):
+        order = tmsConfig.get('General', 'tileOrder')
+    if order not in sfc.ORDERS:
+        raise ValueError('Unknown tile order %s' % order)
+    return order
+
+
 class Tiles:
 
     def __init__(self, bounds, minZoom, maxZoom, t0,
-                 basePath=None, tFormat=None, gridOrigin=None, tilesURLs=None):
+                 basePath=None, tFormat=None, gridOrigin=None, tilesURLs=None,
+                 order=sfc.ROW, footprint=None):
         self.t0 = t0
+        self.order = order
+        self.footprint = footprint
         self.bounds = bounds
         self.tileMinZ = minZoom
         self.tileMaxZ = maxZoom
@@ -27,7 +109,8 @@ class Tiles:
 
     def __iter__(self):
 
-        for bounds, tileXYZ in grid(self.bounds, self.tileMinZ, self.tileMaxZ):
+        for bounds, tileXYZ in grid(self.bounds, self.tileMinZ, self.tileMaxZ,
+                                    order=self.order, footprint=self.footprint):
             if self.basePath and self.tFormat:
                 yield (
                     bounds, tileXYZ, self.t0, self.basePath,
@@ -56,22 +139,50 @@ class TerrainTiles:
         self.hasLighting = tmsConfig.getint('Extensions', 'lighting')
         self.hasWatermask = tmsConfig.getint('Extensions', 'watermask')
 
+        self.order = tileOrder(tmsConfig)
+        self.footprint = Footprint.fromConfig(tmsConfig)
+
         self.dbConfigFile = dbConfigFile
 
     def __iter__(self):
-        for bounds, tileXYZ in grid(self.bounds, self.tileMinZ, self.tileMaxZ):
+        for bounds, tileXYZ in grid(self.bounds, self.tileMinZ, self.tileMaxZ,
+                                    order=self.order, footprint=self.footprint):
+            yield (bounds, tileXYZ, self.t0, self.dbConfigFile,
+                   self.bucketBasePath, self.hasLighting, self.hasWatermask)
+
+    def partitions(self, nbTiles):
+        return partitions(TileRangePlanner.fromTerrainTiles(self), nbTiles)
+
+    # Same tiles as __iter__ restricted to one of the partitions
+    def iterPartition(self, partition, planner=None):
+        (zoom, minY, maxY) = partition
+        if planner is None:
+            planner = TileRangePlanner.fromTerrainTiles(self)
+        for bounds, tileXYZ in zoomGrid(planner, zoom, self.order, minY, maxY):
             yield (bounds, tileXYZ, self.t0, self.dbConfigFile,
                    self.bucketBasePath, self.hasLighting, self.hasWatermask)
 
 
 class QueueTerrainTiles:
 
-    def __init__(self, qName, dbConfigFile, tmsConfig, t0, num):
+    def __init__(self, qName, dbConfigFile, tmsConfig, t0, num,
+                 queueURL=None):
         self.t0 = t0
         self.dbConfigFile = dbConfigFile
         self.qName = qName
+        # None for AWS SQS (see forge.lib.queues)
+        self.queueURL = queueURL
         self.num = num
 
+        # Seconds without any message before a worker stops
+        self.idleTimeout = 20
+        if tmsConfig.has_option('General', 'queueIdleTimeout'):
+            self.idleTimeout = tmsConfig.getint('General', 'queueIdleTimeout')
+        self.visibilityTimeout = DEFAULT_VISIBILITY_TIMEOUT
+        if tmsConfig.has_option('General', 'queueVisibilityTimeout'):
+            self.visibilityTimeout = tmsConfig.getint(
+                'General', 'queueVisibilityTimeout')
+
         self.bucketBasePath = tmsConfig.get('General', 'bucketPath')
 
         self.hasLighting = tmsConfig.getint('Extensions', 'lighting')
@@ -79,5 +190,6 @@ class QueueTerrainTiles:
 
     def __iter__(self):
         for i in range(0, self.num):
-            yield (self.qName, self.t0, self.dbConfigFile,
-                self.bucketBasePath, self.hasLighting, self.hasWatermask)
+            yield (self.qName, self.queueURL, self.t0, self.dbConfigFile,
+                self.bucketBasePath, self.hasLighting, self.hasWatermask,
+                self.idleTimeout, self.visibilityTimeout)
@@ -1,46 +1,69 @@
 # -*- coding: utf-8 -*-
 
-import requests
+import time
+import datetime
 import cStringIO
 
-from forge.lib.tiler import grid
-from forge.lib.helpers import gzipFileObject
-from forge.lib.boto_conn import getBucket, writeToS3
+from forge.lib.tiles import grid, keyOrderedTiles
+from forge.lib.planner import TileRangePlanner
+from forge.lib.sync import missingKeys
+from forge.lib.tile_import import HTTPTileSource, TileImporter
+from forge.lib.boto_conn import threadBucket, writeToS3
 
 
 def tilePathTemplate(x, y, z):
     return '%s/%s/%s.terrain' % (z, x, y)
 
 
-def loadTileContent(baseURL, key, headers):
-    url = '%s%s' % (baseURL, key)
-    r = requests.get(url, headers=headers)
-    if r.status_code != requests.codes.ok:
-        raise Exception('Failed to request %s, status code: %s' % (
-            url, r.status_code
-        ))
-    return r.content
+# Keys (relative to bucketBasePath) of the tiles of the given zooms not yet
+# in the bucket. The sorted keys of each zoom are merged with the listing of
+# the zoom, so that the keys of the bucket are never held in memory.
+def missingTileKeys(bucketBasePath, bounds, zooms, skipped):
+    planner = TileRangePlanner(bounds, zooms[0], zooms[len(zooms) - 1])
+    for zoom in zooms:
+        prefix = '%s%s/' % (bucketBasePath, zoom)
+        names = (key.name[len(bucketBasePath):]
+                 for key in threadBucket().list(prefix=prefix))
+        keys = (tilePathTemplate(x, y, zoom)
+                for x, y in keyOrderedTiles(planner, zoom))
+        for key in missingKeys(keys, names, skipped):
+            yield key
 
 
-def copyAGITiles(zooms, bounds, bucketBasePath):
-    count = 0
+# Downloads the tiles from AGI and uploads them to the bucket, with
+# nbDownloads downloads, nbCompressors compressions and nbUploads uploads
+# in flight. With resume, the tiles already in the bucket are skipped.
+def copyAGITiles(zooms, bounds, bucketBasePath, nbDownloads=16,
+                 nbCompressors=4, nbUploads=16, resume=True):
+    t0 = time.time()
     headers = {
         'Accept': 'application/vnd.quantized-mesh;' +
         'extensions=octvertexnormals-' +
         'watermask,application/octet-stream;q=0.9,*/*;q=0.01'}
     baseURL = 'http://assets.agi.com/stk-terrain/world/'
-    bucket = getBucket()
-    for bxyz in grid(bounds, zooms[0], zooms[len(zooms) - 1]):
-        f = cStringIO.StringIO()
-        tilebounds, [x, y, z] = bxyz
-        bucketKey = tilePathTemplate(x, y, z)
-        f.write(loadTileContent(baseURL, bucketKey, headers))
-        f.seek(0)
-        compressedFile = gzipFileObject(f)
+    source = HTTPTileSource(baseURL, headers=headers)
+
+    def store(bucketKey, data):
         writeToS3(
-            bucket, bucketKey, compressedFile,
+            threadBucket(), bucketKey, cStringIO.StringIO(data),
             'poc_watermask', bucketBasePath)
-        count += 1
-        if count % 20 == 0:
-            print 'Copying %s...' % bucketKey
-            print '%s tiles have been copied so far.' % count
+
+    def progress(done, failed):
+        print '%s tiles have been copied so far (%s skipped, %s failed) ' \
+            'in %s.' % (done, importer.skipped.value, failed,
+                        str(datetime.timedelta(seconds=time.time() - t0)))
+
+    importer = TileImporter(
+        source.fetch, store, nbDownloads=nbDownloads,
+        nbCompressors=nbCompressors, nbUploads=nbUploads)
+    if resume:
+        keys = missingTileKeys(
+            bucketBasePath, bounds, zooms, importer.skipped)
+    else:
+        keys = (
+            tilePathTemplate(x, y, z) for tilebounds, [x, y, z] in
+            grid(bounds, zooms[0], zooms[len(zooms) - 1]))
+    importer.run(keys, progress=progress)
+    for stage, key, e in importer.errors:
+        print 'Could not copy %s: %s' % (key, e)
+    progress(importer.pipeline.done.value, importer.failed)
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from sqlalchemy.sql import func, and_
+from sqlalchemy.sql import func, and_, true
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import FunctionElement, text
 from geoalchemy2.elements import WKBElement
@@ -72,9 +72,24 @@ class Vector(object):
         geomColumn = cls.geometryColumn()
         return and_(
             geomColumn.intersects(wkbGeometry),
-            func.ST_Intersects(geomColumn, wkbGeometry)
+            func.ST_Intersects(geomColumn, wkbGeometry),
+            cls.partitionIntersects(bbox) if fromSrid == 4326 else true()
         )
 
+    """
+    Returns a sqlalchemy.sql.elements.ClauseElement
+    Restricts a query to the partitions possibly holding geometries
+    intersecting a bbox (always true if the table is not partitioned)
+    :params bbox: A list of 4 coordinates [minX, minY, maxX, maxY] in EPSG:4326
+    """
+    @classmethod
+    def partitionIntersects(cls, bbox):
+        partitions = getattr(cls, '__partitions__', None)
+        if partitions is None:
+            return true()
+        return cls.__mapper__.columns['partitionkey'].in_(
+            partitions.keysIntersecting(bbox))
+
     """
     Returns a slqalchemy.sql.functions.Function (interesects function)
     Use it as a filter to determine if a geometry should be returned (True or False)
@@ -169,3 +184,78 @@ def tableExtentLiteral(schemaname, tablename, srid):
                 "FROM (SELECT ST_Collect(ST_Transform(the_geom, %d)) AS r "
                 "FROM %s.%s) AS foo" % (srid, schemaname, tablename)
                 )
+
+
+"""
+Returns a sqlalchemy.sql.expression.text
+The number of rows of a table according to the planner statistics.
+The rows of a partitioned table are the ones of its partitions.
+:params schemaname: the schema name
+:params tablename: the table name
+"""
+
+
+def estimatedRowCountLiteral(schemaname, tablename):
+    return text("SELECT CASE WHEN c.relkind = 'p' THEN ("
+                "SELECT sum(greatest(p.reltuples, 0))::bigint "
+                "FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid "
+                "WHERE i.inhparent = c.oid) "
+                "ELSE c.reltuples::bigint END FROM pg_class c "
+                "WHERE c.oid = to_regclass('%s.%s')" % (schemaname, tablename)
+                )
+
+
+"""
+Returns a sqlalchemy.sql.expression.text
+The schema, the name and the estimated number of rows of the partitions
+of a table (no rows if the table is not partitioned)
+:params schemaname: the schema name
+:params tablename: the table name
+"""
+
+
+def partitionsLiteral(schemaname, tablename):
+    return text("SELECT n.nspname, c.relname, "
+                "greatest(c.reltuples, 0)::bigint FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE i.inhparent = to_regclass('%s.%s') "
+                "ORDER BY c.relname" % (schemaname, tablename)
+                )
+
+
+"""
+Returns a sqlalchemy.sql.expression.text
+The extent of a table as cached by the planner statistics (ST_EstimatedExtent)
+:params schemaname: the schema name
+:params tablename: the table name
+:params geomcolumn: the geometry column name
+"""
+
+
+def estimatedExtentLiteral(schemaname, tablename, geomcolumn='the_geom'):
+    return text("SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) "
+                "FROM ST_EstimatedExtent('%s', '%s', '%s') AS e" % (
+                    schemaname, tablename, geomcolumn)
+                )
+
+
+"""
+Returns a sqlalchemy.sql.expression.text
+Counts the sampled rows and the sampled rows intersecting a bbox.
+Bind parameters: minX, minY, maxX, maxY and percent.
+:params schemaname: the schema name
+:params tablename: the table name
+:params geomcolumn: the geometry column name
+:params srid: Spatial reference system numerical ID of the bbox
+"""
+
+
+def sampledBBoxCountLiteral(schemaname, tablename, geomcolumn='the_geom',
+                            srid=4326):
+    return text("SELECT count(*), count(*) FILTER (WHERE %(geom)s && "
+                "ST_MakeEnvelope(:minX, :minY, :maxX, :maxY, %(srid)d)) "
+                "FROM %(schema)s.%(table)s TABLESAMPLE SYSTEM (:percent)" % dict(
+                    geom=geomcolumn, srid=srid,
+                    schema=schemaname, table=tablename)
+                )
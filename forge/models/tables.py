@@ -2,12 +2,15 @@
 
 import os
 import ConfigParser
-from sqlalchemy import Column, Sequence, BigInteger, Text
+from sqlalchemy import Column, Sequence, BigInteger, Integer, SmallInteger, \
+    Text, DateTime, Float, Boolean, func
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from geoalchemy2.types import Geometry
 
 from forge.models import Vector
 from forge.lib.helpers import isShapefile
+from forge.lib.partitions import PartitionGrid
 
 
 Base = declarative_base()
@@ -34,14 +37,84 @@ class Lakes(Base, Vector):
     the_geom = Column('the_geom', WGS84Polygon2D)
 
 
-def modelFactory(BaseClass, tablename, shapefiles, classname):
+# Extents of the source data changed by a reingestion, the tiles they cover
+# are regenerated by the update command of tms_writer.py
+class TileChanges(Base):
+    __tablename__ = 'tile_changes'
+    __table_args__ = table_args
+    id = Column(
+        BigInteger(), Sequence('id_tile_changes_seq', schema=table_args['schema']),
+        nullable=False, primary_key=True
+    )
+    tablename = Column('tablename', Text, nullable=False)
+    shapefilepath = Column('shapefilepath', Text)
+    the_geom = Column('the_geom', WGS84Polygon2D)
+    changed = Column('changed', DateTime, server_default=func.now())
+    regenerated = Column('regenerated', DateTime)
+
+
+# Shapefiles loaded by populate, so that unchanged shapefiles are skipped
+# and changed ones replaced
+class IngestedShapefiles(Base):
+    __tablename__ = 'ingested_shapefiles'
+    __table_args__ = table_args
+    tablename = Column('tablename', Text, primary_key=True)
+    # Path of the source shapefile (see database.cfg)
+    shapefilepath = Column('shapefilepath', Text, primary_key=True)
+    # Path stored with the features (after the reprojection)
+    storedpath = Column('storedpath', Text, nullable=False)
+    checksum = Column('checksum', Text, nullable=False)
+    size = Column('size', BigInteger, nullable=False)
+    mtime = Column('mtime', Float, nullable=False)
+    features = Column('features', BigInteger, nullable=False)
+    # Partitions holding the features (partitioned tables only)
+    partitionkeys = Column('partitionkeys', ARRAY(Integer))
+    ingested = Column('ingested', DateTime, server_default=func.now())
+
+
+# Triangles of the table of a zoom level overlapping each tile, built by
+# the tileindex command of tms_writer.py (see forge/lib/tile_index.py)
+class TileIndex(Base):
+    __tablename__ = 'tile_index'
+    __table_args__ = table_args
+    zoom = Column('zoom', SmallInteger, primary_key=True, autoincrement=False)
+    x = Column('x', Integer, primary_key=True, autoincrement=False)
+    y = Column('y', Integer, primary_key=True, autoincrement=False)
+    tablename = Column('tablename', Text, nullable=False)
+    ids = Column('ids', ARRAY(BigInteger), nullable=False)
+    nbtriangles = Column('nbtriangles', Integer, nullable=False)
+
+
+# Zoom levels whose tile index is complete, with the table it was built
+# from. A zoom is stale once features of its table were replaced until the
+# update command reindexes the changed tiles.
+class TileIndexZooms(Base):
+    __tablename__ = 'tile_index_zooms'
+    __table_args__ = table_args
+    zoom = Column('zoom', SmallInteger, primary_key=True, autoincrement=False)
+    tablename = Column('tablename', Text, nullable=False)
+    stale = Column('stale', Boolean, nullable=False, default=False)
+    indexed = Column('indexed', DateTime, server_default=func.now())
+
+
+# partitions: an optional forge.lib.partitions.PartitionGrid, the table is
+# then list partitioned by the cells of the grid (see DB.createPartitions)
+def modelFactory(BaseClass, tablename, shapefiles, classname, partitions=None):
     sequence = Sequence('id_%s_seq' % tablename, schema=table_args['schema'])
+    args = table_args
+    if partitions is not None:
+        args = dict(table_args, postgresql_partition_by='LIST (partitionkey)')
 
     class NewClass(BaseClass, Vector):
         __tablename__ = tablename
-        __table_args__ = table_args
+        __table_args__ = args
         __shapefiles__ = shapefiles
+        __partitions__ = partitions
         id = Column(BigInteger(), sequence, nullable=False, primary_key=True)
+        if partitions is not None:
+            partitionkey = Column(
+                'partitionkey', Integer, primary_key=True, autoincrement=False)
+        # Indexed, features are replaced by shapefile (see DB.createTables)
         shapefilepath = Column('shapefilepath', Text)
         the_geom = Column('the_geom', WGS84Polygon3D)
     NewClass.__name__ = classname
@@ -57,9 +130,15 @@ class ModelsPyramid:
         self.shpsBaseDir = dbConfig.get('Data', 'shapefiles').split(',')
         self.tablenames = dbConfig.get('Data', 'tablenames').split(',')
         self.modelnames = dbConfig.get('Data', 'modelnames').split(',')
+        self.partitions = None
+        if dbConfig.has_option('Data', 'partitionZoom') and \
+                dbConfig.get('Data', 'partitionZoom').strip():
+            self.partitions = PartitionGrid(
+                dbConfig.getint('Data', 'partitionZoom'))
         self.tmsConfigFile = tmsConfigFile
 
         self.models = []
+        self.lakeModels = {}
         self._createModels()
 
     def _createModels(self):
@@ -71,7 +150,8 @@ class ModelsPyramid:
             else:
                 shapefiles = []
             self.models.append(modelFactory(
-                Base, self.tablenames[i], shapefiles, self.modelnames[i]
+                Base, self.tablenames[i], shapefiles, self.modelnames[i],
+                partitions=self.partitions
             ))
 
         self._buildModelsPyramid()
@@ -99,14 +179,26 @@ class ModelsPyramid:
             ]
         return None
 
+    # Declared once per zoom
     def getLakeModelByZoom(self, zoom):
-        class LakeNewClass(Base, Vector):
-            __tablename__ = 'lakes_%s' % zoom
-            __table_args__ = {'schema': 'public', 'extend_existing': True}
-            id = Column(BigInteger(), nullable=False, primary_key=True)
-            the_geom = Column('the_geom', WGS84Polygon2D)
-        return LakeNewClass
-
-
-modelsPyramid = ModelsPyramid('configs/terrain/database.cfg',
-    'configs/terrain/tms.cfg')
+        zoom = str(zoom)
+        if zoom not in self.lakeModels:
+            class LakeNewClass(Base, Vector):
+                __tablename__ = 'lakes_%s' % zoom
+                __table_args__ = {'schema': 'public', 'extend_existing': True}
+                id = Column(BigInteger(), nullable=False, primary_key=True)
+                the_geom = Column('the_geom', WGS84Polygon2D)
+            self.lakeModels[zoom] = LakeNewClass
+        return self.lakeModels[zoom]
+
+
+_modelsPyramid = None
+
+
+# Built on first use, the models of the pyramid are declared then
+def getModelsPyramid():
+    global _modelsPyramid
+    if _modelsPyramid is None:
+        _modelsPyramid = ModelsPyramid('configs/terrain/database.cfg',
+            'configs/terrain/tms.cfg')
+    return _modelsPyramid
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import numpy
 from forge.lib.tilejson import _TileJSON
 
 
@@ -44,3 +45,31 @@ class TerrainMetadata(_TileJSON):
         )
 
         self._initPyramidMetadata()
+
+    # Availability of the tiles according to the available ranges of an
+    # existing layer.json, one boolean array (y, x) per zoom level
+    def availabilityMasks(self, available):
+        masks = {}
+        for z in range(self.tileMinZoom, self.tileMaxZoom + 1):
+            minX, maxX = self.metadata[z]['x']
+            minY, maxY = self.metadata[z]['y']
+            mask = numpy.zeros((maxY - minY + 1, maxX - minX + 1), dtype=bool)
+            if z < len(available):
+                for r in available[z]:
+                    x0 = max(r['startX'], minX)
+                    x1 = min(r['endX'], maxX)
+                    y0 = max(r['startY'], minY)
+                    y1 = min(r['endY'], maxY)
+                    if x0 <= x1 and y0 <= y1:
+                        mask[y0 - minY:y1 - minY + 1,
+                             x0 - minX:x1 - minX + 1] = True
+            masks[z] = mask
+        return masks
+
+    def removeUnavailable(self, masks):
+        for z, mask in masks.iteritems():
+            minX = self.metadata[z]['x'][0]
+            minY = self.metadata[z]['y'][0]
+            ys, xs = numpy.nonzero(~mask)
+            for i in xrange(0, len(xs)):
+                self.removeTile(int(xs[i]) + minX, int(ys[i]) + minY, z)
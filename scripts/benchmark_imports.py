@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import getopt
+import subprocess
+from textwrap import dedent
+from forge.lib.helpers import error
+
+
+modules = [
+    'forge.configs',
+    'forge.lib.logs',
+    'forge.models.tables',
+    'forge.lib.boto_conn',
+    'forge.db',
+    'forge.lib.tiler',
+]
+
+# Imports a module in a fresh interpreter, reports the time it took and the
+# network connections opened meanwhile (an import must open none)
+importProgram = dedent('''\
+    import sys
+    import json
+    import time
+    import socket
+    connections = []
+    connect = socket.socket.connect
+
+    def recordConnect(self, address):
+        connections.append(str(address))
+        return connect(self, address)
+    socket.socket.connect = recordConnect
+    t0 = time.time()
+    __import__(sys.argv[1])
+    print json.dumps(dict(
+        seconds=time.time() - t0, connections=connections))
+''')
+
+
+def usage():
+    print(dedent('''\
+        Usage: venv/bin/python scripts/benchmark_imports.py
+               [-n <runs>|--runs=<runs>]
+               [--max=<seconds>]
+
+        Times the import of the forge modules and the statsnodb command of
+        tms_writer.py, each in fresh interpreters (best of <runs>, default
+        5). Fails if an import opens a network connection or if statsnodb
+        takes more than <seconds> (default 1).
+    '''))
+
+
+def timeImport(module, runs):
+    results = []
+    for i in xrange(0, runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', importProgram, module])
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return (
+        min(r['seconds'] for r in results),
+        max(len(r['connections']) for r in results))
+
+
+def timeCommand(args, runs):
+    timings = []
+    for i in xrange(0, runs):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, time, subprocess; t0 = time.time(); '
+            'subprocess.check_call(sys.argv[1:], stdout=open("/dev/null", "w")); '
+            'print time.time() - t0'
+        ] + args)
+        timings.append(float(output.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'n:', ['runs=', 'max='])
+    except getopt.GetoptError as err:
+        error(str(err), 2, usage=usage)
+
+    runs = 5
+    maxSeconds = 1.0
+    for o, a in opts:
+        if o in ('-n', '--runs'):
+            runs = int(a)
+        elif o == '--max':
+            maxSeconds = float(a)
+
+    failed = False
+    print '%-24s %10s %12s' % ('module', 'seconds', 'connections')
+    for module in modules:
+        (seconds, connections) = timeImport(module, runs)
+        print '%-24s %10.3f %12s' % (module, seconds, connections)
+        failed = failed or connections > 0
+
+    seconds = timeCommand(
+        [sys.executable, 'scripts/tms_writer.py', 'statsnodb'], runs)
+    print '%-24s %10.3f' % ('tms_writer.py statsnodb', seconds)
+    failed = failed or seconds > maxSeconds
+    if failed:
+        error('imports open connections or statsnodb takes more than '
+              '%s seconds' % maxSeconds, 1)
+
+
+if __name__ == '__main__':
+    main()
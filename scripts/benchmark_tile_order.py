@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import getopt
+import ConfigParser
+from itertools import islice
+from textwrap import dedent
+from forge.db import DB
+from forge.lib import sfc
+from forge.lib.tiles import TerrainTiles
+from forge.lib.helpers import error
+from forge.models.tables import getModelsPyramid
+
+
+def usage():
+    print(dedent('''\
+        Usage: venv/bin/python scripts/benchmark_tile_order.py
+               [-d database.cfg|--database=database.cfg]
+               [-c tms.cfg|--config=tms.cfg]
+               [-n <number of tiles>|--number=<number of tiles>]
+               <row|hilbert|morton>
+
+        Runs the clipping query of the first n tiles of the pyramid in the
+        given order and reports the shared buffer hits and reads.
+        Restart PostgreSQL (and drop the OS page cache) between two runs
+        to compare the orders with a cold cache.
+    '''))
+
+
+def planBuffers(plan):
+    hits = plan.get('Shared Hit Blocks', 0)
+    reads = plan.get('Shared Read Blocks', 0)
+    return hits, reads
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'd:c:n:', ['database=', 'config=', 'number='])
+    except getopt.GetoptError as err:
+        error(str(err), 2, usage=usage)
+
+    dbConfigFile = 'configs/terrain/database.cfg'
+    tmsConfigFile = 'configs/terrain/tms.cfg'
+    nbTiles = 1000
+    for o, a in opts:
+        if o in ('-d', '--database'):
+            dbConfigFile = a
+        elif o in ('-c', '--config'):
+            tmsConfigFile = a
+        elif o in ('-n', '--number'):
+            nbTiles = int(a)
+
+    if len(args) < 1 or args[0] not in sfc.ORDERS:
+        error('you must specify a tile order', 3, usage=usage)
+    order = args[0]
+
+    tmsConfig = ConfigParser.RawConfigParser()
+    tmsConfig.read(tmsConfigFile)
+    t0 = time.time()
+    tiles = TerrainTiles(dbConfigFile, tmsConfig, t0)
+    tiles.order = order
+
+    db = DB(dbConfigFile)
+    totalHits = 0
+    totalReads = 0
+    try:
+        with db.userSession() as session:
+            conn = session.connection()
+            for tile in islice(tiles, nbTiles):
+                bounds, tileXYZ = tile[0], tile[1]
+                model = getModelsPyramid().getModelByZoom(tileXYZ[2])
+                query = session.query(
+                    model.id, model.bboxClippedGeom(bounds).label('clip')
+                ).filter(model.bboxIntersects(bounds))
+                compiled = query.statement.compile(dialect=conn.dialect)
+                result = conn.execute(
+                    'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) %s' % compiled,
+                    compiled.params
+                ).scalar()
+                if isinstance(result, basestring):
+                    result = json.loads(result)
+                hits, reads = planBuffers(result[0]['Plan'])
+                totalHits += hits
+                totalReads += reads
+    finally:
+        db.userEngine.dispose()
+
+    total = totalHits + totalReads
+    ratio = float(totalHits) / total if total > 0 else 0.0
+    print('Order: %s' % order)
+    print('Tiles: %s' % nbTiles)
+    print('Shared buffer hits: %s' % totalHits)
+    print('Shared buffer reads: %s' % totalReads)
+    print('Hit ratio: %.4f' % ratio)
+    print('Time: %.2fs' % (time.time() - t0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import getopt
+import ConfigParser
+from itertools import islice
+from textwrap import dedent
+from sqlalchemy.sql import and_
+from sqlalchemy.orm import scoped_session, sessionmaker
+from forge.db import DB
+from forge.lib.tiles import TerrainTiles
+from forge.lib.helpers import error, createBBox
+from forge.lib.tile_queries import TileQueries
+from forge.lib.tile_index import upToDateZooms
+from forge.models.tables import getModelsPyramid, TileIndex, TileIndexZooms
+
+
+def usage():
+    print(dedent('''\
+        Usage: venv/bin/python scripts/benchmark_tile_queries.py
+               [-d database.cfg|--database=database.cfg]
+               [-c tms.cfg|--config=tms.cfg]
+               [-n <number of tiles>|--number=<number of tiles>]
+
+        Runs the corner and clipping queries of the first n tiles of the
+        pyramid built per tile with the ORM (before) and as createTile runs
+        them (after): prepared statements, with the tile index of the
+        indexed zooms if tileIndex is set, and the clipping of the tiles
+        having more than tileFetchSize triangles planned per tile for their
+        server side cursor. Reports the CPU time spent on the client to
+        build and compile them and the planning time of PostgreSQL.
+    '''))
+
+
+# The queries of createTile as they were built for each tile
+def ormQueries(session, model, bounds):
+    pts = [
+        (bounds[0], bounds[1], 0),
+        (bounds[0], bounds[3], 0),
+        (bounds[2], bounds[3], 0),
+        (bounds[2], bounds[1], 0)
+    ]
+    subqueries = [
+        session.query(
+            model.id, model.interpolateHeightOnPlane(pts[i])
+        ).filter(
+            and_(
+                model.bboxIntersects(createBBox(pts[i], 0.01)),
+                model.pointIntersects(pts[i])
+            )
+        ).subquery('p%s' % i) for i in range(0, len(pts))]
+    return [
+        session.query(*subqueries),
+        session.query(
+            model.id, model.bboxClippedGeom(bounds).label('clip')
+        ).filter(model.bboxIntersects(bounds))
+    ]
+
+
+def planningTime(cursor, sql, params):
+    cursor.execute('EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) %s' % sql, params)
+    result = cursor.fetchone()[0]
+    if isinstance(result, basestring):
+        result = json.loads(result)
+    return result[0]['Planning Time'] / 1000.0
+
+
+def main():
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'd:c:n:', ['database=', 'config=', 'number='])
+    except getopt.GetoptError as err:
+        error(str(err), 2, usage=usage)
+
+    dbConfigFile = 'configs/terrain/database.cfg'
+    tmsConfigFile = 'configs/terrain/tms.cfg'
+    nbTiles = 1000
+    for o, a in opts:
+        if o in ('-d', '--database'):
+            dbConfigFile = a
+        elif o in ('-c', '--config'):
+            tmsConfigFile = a
+        elif o in ('-n', '--number'):
+            nbTiles = int(a)
+
+    tmsConfig = ConfigParser.RawConfigParser()
+    tmsConfig.read(tmsConfigFile)
+    t0 = time.time()
+    tiles = TerrainTiles(dbConfigFile, tmsConfig, t0)
+
+    fetchSize = 10000
+    if tmsConfig.has_option('General', 'tileFetchSize'):
+        fetchSize = tmsConfig.getint('General', 'tileFetchSize')
+    db = DB(dbConfigFile)
+    indexedZooms = frozenset()
+    if tmsConfig.has_option('General', 'tileIndex') and \
+            tmsConfig.getboolean('General', 'tileIndex'):
+        pyramid = getModelsPyramid()
+        tablenameByZoom = {}
+        for zoom in range(tiles.tileMinZ, tiles.tileMaxZ + 1):
+            model = pyramid.getModelByZoom(zoom)
+            if model is not None:
+                tablenameByZoom[zoom] = model.__tablename__
+        with db.userSession() as userSession:
+            indexedZooms = upToDateZooms(
+                userSession, TileIndexZooms, tablenameByZoom)
+    session = scoped_session(sessionmaker())
+    connection = db.userEngine.raw_connection()
+    dialect = db.userEngine.dialect
+    queriesByZoom = {}
+    # [client CPU, server planning] in seconds
+    before = [0.0, 0.0]
+    after = [0.0, 0.0]
+    nbStreamed = 0
+    try:
+        cursor = connection.cursor()
+        for tile in islice(tiles, nbTiles):
+            bounds, tileXYZ = tile[0], tile[1]
+            model = getModelsPyramid().getModelByZoom(tileXYZ[2])
+
+            c0 = time.clock()
+            compiled = [
+                query.statement.compile(dialect=dialect)
+                for query in ormQueries(session, model, bounds)]
+            before[0] += time.clock() - c0
+            for statement in compiled:
+                before[1] += planningTime(
+                    cursor, str(statement), statement.params)
+
+            c0 = time.clock()
+            queries = queriesByZoom.get(tileXYZ[2])
+            if queries is None:
+                queries = queriesByZoom[tileXYZ[2]] = TileQueries(
+                    model, indexModel=TileIndex
+                    if tileXYZ[2] in indexedZooms else None)
+            ids = None
+            if queries.ids is not None:
+                ids = queries.triangleIds(connection, bounds, tileXYZ)
+            values = queries.values(bounds, ids=ids)
+            after[0] += time.clock() - c0
+            literals = [queries.corners.executeLiteral()]
+            queries.corners.prepare(connection)
+            if queries.isStreamed(ids, fetchSize):
+                # The query of the cursor, planned for the tile
+                nbStreamed += 1
+                c0 = time.clock()
+                literals.append(queries.clip.queryLiteral())
+                after[0] += time.clock() - c0
+            else:
+                queries.clip.prepare(connection)
+                literals.append(queries.clip.executeLiteral())
+            for literal in literals:
+                after[1] += planningTime(cursor, literal, values)
+        cursor.close()
+        connection.rollback()
+    finally:
+        connection.close()
+        db.userEngine.dispose()
+
+    print('Tiles: %s (%s streamed)' % (nbTiles, nbStreamed))
+    print('%-10s %16s %16s' % ('', 'client CPU (s)', 'planning (s)'))
+    print('%-10s %16.3f %16.3f' % ('before', before[0], before[1]))
+    print('%-10s %16.3f %16.3f' % ('after', after[0], after[1]))
+    print('Time: %.2fs' % (time.time() - t0))
+
+
+if __name__ == '__main__':
+    main()
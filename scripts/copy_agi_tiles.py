@@ -1,22 +1,57 @@
 # -*- coding: utf-8 -*-
 
+import sys
+import getopt
 from textwrap import dedent
-from forge.configs import tmsConfig
+from forge.configs import getTmsConfig
+from forge.lib.helpers import error
 from forge.lib.utils import copyAGITiles
 
 
 # One might want to provide an extent also later on
 def usage():
     print(dedent('''\
-        Usage: venv/bin/python scripts/copy_agi_tiles.py')
+        Usage: venv/bin/python scripts/copy_agi_tiles.py
+               [-d <downloads>|--downloads=<downloads>]
+               [-c <compressors>|--compressors=<compressors>]
+               [-u <uploads>|--uploads=<uploads>]
+               [--no-resume]
+
+        <downloads> tiles are downloaded (default 16), <compressors> tiles
+        compressed (default 4) and <uploads> tiles uploaded (default 16)
+        at the same time. The tiles already in the bucket are skipped
+        unless --no-resume is given.
     '''))
 
 
 def main():
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'd:c:u:',
+            ['downloads=', 'compressors=', 'uploads=', 'no-resume'])
+    except getopt.GetoptError as err:
+        error(str(err), 2, usage=usage)
+
+    nbDownloads = 16
+    nbCompressors = 4
+    nbUploads = 16
+    resume = True
+    for o, a in opts:
+        if o in ('-d', '--downloads'):
+            nbDownloads = int(a)
+        elif o in ('-c', '--compressors'):
+            nbCompressors = int(a)
+        elif o in ('-u', '--uploads'):
+            nbUploads = int(a)
+        elif o == '--no-resume':
+            resume = False
+
     zooms = range(0, 8)
     bounds = [-180, -90, 180, 90]
-    bucketBasePath = tmsConfig.get('General', 'bucketpath')
-    copyAGITiles(zooms, bounds, bucketBasePath)
+    bucketBasePath = getTmsConfig().get('General', 'bucketpath')
+    copyAGITiles(
+        zooms, bounds, bucketBasePath, nbDownloads=nbDownloads,
+        nbCompressors=nbCompressors, nbUploads=nbUploads, resume=resume)
 
 
 if __name__ == '__main__':
@@ -1,19 +1,69 @@
 # -*- coding: utf-8 -*-
 
+import sys
+import getopt
 from textwrap import dedent
-from forge.lib.boto_conn import copyKeys
+from forge.lib.helpers import error
+from forge.lib.boto_conn import copyKeys, syncKeys
+
+
+fromPrefix = '1.0.0/ch.swisstopo.terrain.3d/default/20160115/4326/'
+toPrefix = '1.0.0/ch.swisstopo.terrain.3d/default/20190902/4326/'
 
 
 # One might want to provide an extent also later on
 def usage():
     print(dedent('''\
-        Usage: venv/bin/python scripts/copy_tiles.py')
+        Usage: venv/bin/python scripts/copy_tiles.py
+               [-t <threads>|--threads=<threads>]
+               [--from=<prefix>] [--to=<prefix>] [--delete] [--dry-run]
+               [<command>]
+
+        Commands:
+            copy:               server side copy of all the tiles from
+                                one prefix to the other (default)
+            sync:               only copy the missing or changed tiles,
+                                with --delete also delete the tiles
+                                missing in the source, with --dry-run only
+                                report the differences per zoom
+
+        <threads> requests are kept in flight (default 64).
     '''))
 
 
 def main():
-    copyKeys('1.0.0/ch.swisstopo.terrain.3d/default/20160115/4326/',
-        '1.0.0/ch.swisstopo.terrain.3d/default/20190902/4326/', range(0, 14))
+    global fromPrefix, toPrefix
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:], 't:',
+            ['threads=', 'from=', 'to=', 'delete', 'dry-run'])
+    except getopt.GetoptError as err:
+        error(str(err), 2, usage=usage)
+
+    nbWorkers = 64
+    delete = False
+    dryRun = False
+    for o, a in opts:
+        if o in ('-t', '--threads'):
+            nbWorkers = int(a)
+        elif o == '--from':
+            fromPrefix = a
+        elif o == '--to':
+            toPrefix = a
+        elif o == '--delete':
+            delete = True
+        elif o == '--dry-run':
+            dryRun = True
+
+    zooms = range(0, 14)
+    command = args[0] if len(args) > 0 else 'copy'
+    if command == 'copy':
+        copyKeys(fromPrefix, toPrefix, zooms, nbWorkers=nbWorkers)
+    elif command == 'sync':
+        syncKeys(fromPrefix, toPrefix, zooms, delete=delete, dryRun=dryRun,
+                 nbWorkers=nbWorkers)
+    else:
+        error("unknown command '%(command)s'" % {'command': command}, 4, usage=usage)
 
 
 if __name__ == '__main__':
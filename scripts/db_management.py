@@ -18,7 +18,12 @@ def usage():
             createuser:         create the user only
             createdb:           create the DB only
             setupfunctions:     setup custom sql functions
-            populate:           imports shapefiles
+            populate:           imports new or changed shapefiles (unchanged
+                                ones are skipped, changed ones replaced)
+            reingest <shp>...:  replaces the features of the given shapefiles,
+                                even unchanged, and records the changed extents
+            reindex:            rebuilds the indexes of the partitions of the
+                                tables in parallel (see partitionZoom)
             populatelakes:      imports lakes shapefile
             dropuser:           drop the user only
             dropdb:             drop the db only
@@ -55,6 +60,12 @@ def main():
         db.setupFunctions()
     elif command == 'populate':
         db.populate()
+    elif command == 'reingest':
+        if len(args) < 2:
+            error('you must specify the shapefiles to reingest', 3, usage=usage)
+        db.reingest(args[1:])
+    elif command == 'reindex':
+        db.reindexPartitions()
     elif command == 'populatelakes':
         db.populateLakes()
     elif command == 'dropuser':
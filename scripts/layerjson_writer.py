@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import cStringIO
-from forge.configs import tmsConfig
+from forge.configs import getTmsConfig
 from forge.lib.helpers import gzipFileObject
 from forge.lib.boto_conn import getBucket, writeToS3
 
 bucket = getBucket()
 layerJSONPath = 'forge/data/json-conf/layer.json'
-bucketBasePath = tmsConfig.get('General', 'bucketpath')
+bucketBasePath = getTmsConfig().get('General', 'bucketpath')
 
 with open(layerJSONPath) as f:
     fileObj = cStringIO.StringIO()
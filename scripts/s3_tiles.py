@@ -3,7 +3,7 @@
 import sys
 import getopt
 from textwrap import dedent
-from forge.configs import tmsConfig
+from forge.configs import getTmsConfig
 from forge.lib.helpers import error
 from forge.lib.boto_conn import S3Keys
 
@@ -12,39 +12,71 @@ from forge.lib.boto_conn import S3Keys
 def usage():
     print(dedent('''\
         Usage: venv/bin/python scripts/s3_tiles.py
-               [-p <prefix>|--prefix=<prefix>] <command>')
+               [-p <prefix>|--prefix=<prefix>] [-t <threads>|--threads=<threads>]
+               [--rate=<keys per second>] [-o <file>|--output=<file>]
+               [--format=tsv|jsonl] <command>')
 
         Commands:
-            delete:             delete all keys (tiles)
-            list:               list all keys (tiles)
-            count:              count all keys (tiles)
+            delete:             delete all keys (tiles), the zooms and x
+                                columns being listed and deleted in
+                                parallel by <threads> threads (default 16)
+                                at most <rate> keys per second
+                                (default 3000)
+            list:               list all keys (tiles) to <file> (stdout
+                                by default) in the given format
+                                (default tsv) and summarize them per zoom
+            count:              count all keys (tiles) and summarize their
+                                sizes per zoom
     '''))
 
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'p:', ['p='])
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'p:t:o:',
+            ['p=', 'prefix=', 'threads=', 'rate=', 'output=', 'format='])
     except getopt.GetoptError as err:
         error(str(err), 2, usage=usage)
 
     prefix = None
+    nbWorkers = None
+    rate = None
+    output = None
+    fmt = 'tsv'
     for o, a in opts:
         if o in ('-p', '--prefix'):
             prefix = a
+        elif o in ('-t', '--threads'):
+            nbWorkers = int(a)
+        elif o == '--rate':
+            rate = float(a)
+        elif o in ('-o', '--output'):
+            output = a
+        elif o == '--format':
+            if a not in ('tsv', 'jsonl'):
+                error('unknown format %s' % a, 2, usage=usage)
+            fmt = a
 
     if len(args) < 1:
         error('you must specify a command', 3, usage=usage)
 
-    bucketBasePath = tmsConfig.get('General', 'bucketpath')
+    bucketBasePath = getTmsConfig().get('General', 'bucketpath')
     s3Keys = S3Keys(prefix, bucketBasePath)
+    if nbWorkers is not None:
+        s3Keys.nbWorkers = nbWorkers
+    if rate is not None:
+        s3Keys.deleteRate = rate
 
     command = args[0]
     if command == 'delete':
         s3Keys.delete()
     elif command == 'list':
-        s3Keys.listKeys()
+        # stdout may be the listing, the errors went to stderr
+        if s3Keys.listKeys(output=output, fmt=fmt):
+            sys.exit(1)
     elif command == 'count':
-        s3Keys.count()
+        if s3Keys.count():
+            sys.exit(1)
     else:
         error("unknown command '%(command)s'" % {'command': command}, 4, usage=usage)
 
@@ -23,14 +23,12 @@ from forge.models import Vector, tableExtentLiteral
 from forge.layers.metadata import LayerMetadata
 from forge.lib.helpers import timestamp, degreesToMeters
 from forge.lib.tiles import Tiles
-from forge.lib.logs import getLogger
+from forge.lib.logs import getLogger, startLogListener
 from forge.lib.helpers import gzipFileObject, resourceExists
 from forge.lib.boto_conn import getBucket, writeToS3
 
 
-loggingConfig = ConfigParser.RawConfigParser()
-loggingConfig.read('logging.cfg')
-logger = getLogger(loggingConfig, __name__, suffix=timestamp())
+logger = getLogger(__name__, suffix=timestamp())
 
 
 Base = declarative_base()
@@ -329,6 +327,7 @@ def createS3BasedTileJSON(params):
         tFormat=params.format, gridOrigin=params.gridOrigin,
         tilesURLs=params.tilesURLs
     )
+    startLogListener(logger.suffix)
     pm = PoolManager(factor=1, store=True)
     tMeta = LayerMetadata(
         bounds=params.bounds, minzoom=params.minZoom,
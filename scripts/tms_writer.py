@@ -6,6 +6,7 @@ import getopt
 from textwrap import dedent
 from forge.lib.tiler import TilerManager
 from forge.lib.helpers import error
+from forge.lib.shards import Shard
 
 
 def usage():
@@ -13,31 +14,60 @@ def usage():
         Usage: venv/bin/python scripts/tms_writer.py
                   [-d database.cfg|--database=database.cfg]
                   [-c tms.cfg|--config=tms.cfg]
+                  [--shard=i/N] [--resume]
                   <command>
 
         Commands:
             create:            create the tiles and write them to S3
+                               (with --shard=i/N only the shard i of N,
+                               0 <= i < N, each machine creating one,
+                               with --resume only the tiles not processed
+                               by the previous run)
+            tileindex:         index the triangles overlapping each tile
+                               (run it after the ingestion, see tileIndex
+                               in tms.cfg)
             metadata:          create the metadata file (layer.json)
+            update:            regenerate the tiles touched by reingested
+                               shapefiles (see db_management.py reingest)
+                               and update layer.json
             stats:             provides a report containing the stats
-                               for a given TMS config
+                               for a given TMS config (estimated number
+                               of triangles per tile)
+            statsexact:        same as stats but with an exact count of
+                               the triangles (slow on large tables)
             statsnodb:         provides a short report containing the stats
                                for a given TMS config
+            createqueue:       fill the work queue with all the tiles
+                               (see queueBackend in tms.cfg)
+            createtiles:       create the tiles listed in the work queue
+            deletequeue:       delete the work queue
+            queuestats:        number of messages in the work queue
     '''))
 
 
 def main():
     try:
-        opts, args = getopt.getopt(sys.argv[1:], 'c:', ['config='])
+        opts, args = getopt.getopt(
+            sys.argv[1:], 'd:c:', ['database=', 'config=', 'shard=', 'resume'])
     except getopt.GetoptError as err:
         error(str(err), 2, usage=usage)
 
     dbConfigFile = 'configs/terrain/database.cfg'
     tmsConfigFile = 'configs/terrain/tms.cfg'
+    shard = None
+    resume = False
     for o, a in opts:
         if o in ('-d', '--database'):
             dbConfigFile = a
         elif o in ('-c', '--config'):
             tmsConfigFile = a
+        elif o == '--shard':
+            try:
+                shard = Shard.parse(a)
+            except ValueError as err:
+                error(str(err), 2, usage=usage)
+        elif o == '--resume':
+            resume = True
 
     if not os.path.exists(dbConfigFile) and os.path.exists(tmsConfigFile):
         error('config file(s) does/do not exist(s)', 1, usage=usage)
@@ -48,14 +78,23 @@ def main():
 
     command = args[0]
     if command == 'create':
-        tiler.create()
+        try:
+            tiler.create(shard=shard, resume=resume)
+        except ValueError as err:
+            error(str(err), 1)
+    elif command == 'tileindex':
+        tiler.buildTileIndex()
     elif command == 'metadata':
         tiler.metadata()
+    elif command == 'update':
+        tiler.update()
     elif command == 'stats':
         tiler.stats()
+    elif command == 'statsexact':
+        tiler.statsExact()
     elif command == 'statsnodb':
         tiler.statsNoDb()
-    # aws queue specific functions
+    # work queue (distributed mode) functions
     elif command == 'createqueue':
         tiler.createQueue()
     elif command == 'createtiles':
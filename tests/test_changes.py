@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from shapely.geometry import box
+from forge.lib.changes import changedGeometry, dirtyPlanners
+from forge.lib.footprint import Footprint
+
+
+class TestChanges(unittest.TestCase):
+
+    def testDirtyPlanners(self):
+        bounds = [7.0, 46.0, 8.0, 47.0]
+        tables = {9: 'break_0', 10: 'break_0', 11: 'break_1'}
+        # A map sheet changed in break_0, another one outside of the pyramid
+        extents = {'break_0': [(7.1, 46.1, 7.2, 46.15), (9.0, 46.0, 9.1, 46.1)]}
+        planners = dirtyPlanners(bounds, [9, 10, 11], tables.get, extents)
+        self.assertEqual(sorted(planners.keys()), [9, 10])
+        tiles = list(planners[10].iterTiles())
+        self.assertTrue(len(tiles) > 0)
+        geometry = changedGeometry(extents['break_0'])
+        for x, y, z in tiles:
+            self.assertEqual(z, 10)
+            tileBounds = planners[10].tileBounds(z, x, y)
+            self.assertTrue(tileBounds[2] >= 7.1 and tileBounds[0] <= 7.2)
+            self.assertTrue(tileBounds[3] >= 46.1 and tileBounds[1] <= 46.15)
+            self.assertTrue(geometry.intersects(box(*tileBounds)))
+
+        # Changes outside of the footprint are ignored
+        footprint = Footprint.fromWKT(
+            'POLYGON((7.5 46.5, 8 46.5, 8 47, 7.5 47, 7.5 46.5))')
+        planners = dirtyPlanners(
+            bounds, [9, 10, 11], tables.get, extents, footprint=footprint)
+        self.assertEqual(planners, {})
+
+    def testChangesTouchingTheEdge(self):
+        bounds = [7.0, 46.0, 8.0, 47.0]
+        tables = {9: 'break_0', 10: 'break_0'}
+        # Clipped to a line along the east edge and to a corner point
+        extents = {'break_0': [(8.0, 46.2, 8.1, 46.3), (6.9, 45.9, 7.0, 46.0)]}
+        planners = dirtyPlanners(bounds, [9, 10], tables.get, extents)
+        self.assertEqual(planners, {})
+        # Along the edge of the footprint
+        footprint = Footprint.fromWKT(
+            'POLYGON((7.5 46.5, 8 46.5, 8 47, 7.5 47, 7.5 46.5))')
+        extents = {'break_0': [(7.2, 46.6, 7.5, 46.7)]}
+        planners = dirtyPlanners(
+            bounds, [9, 10], tables.get, extents, footprint=footprint)
+        self.assertEqual(planners, {})
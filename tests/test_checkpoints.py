@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from forge.lib.planner import TileRangePlanner
+from forge.lib.checkpoints import CheckpointWriter, CompletedTiles, \
+    BITMAPS_FILE, logFiles, logPath, clearDirectory
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.planner = TileRangePlanner([7.0, 46.0, 8.0, 47.0], 8, 12)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testResume(self):
+        tiles = [(None, xyz) for xyz in self.planner.iterTiles()]
+        done = [t[1] for t in tiles[::3]]
+        for i, pid in enumerate([100, 101]):
+            writer = CheckpointWriter(logPath(self.tmpDir, 1, pid))
+            for xyz in done[i::2]:
+                writer.add(xyz)
+            writer.close()
+        # Tiles outside of the plan are ignored
+        writer = CheckpointWriter(logPath(self.tmpDir, 1, 102))
+        writer.add((0, 0, 8))
+        writer.close()
+        # A crash in the middle of a record
+        with open(logPath(self.tmpDir, 1, 101), 'ab') as f:
+            f.write('\x0c\x01')
+
+        completed = CompletedTiles.fromDirectory(self.tmpDir, self.planner)
+        self.assertEqual(completed.numberOfTiles(), len(done))
+        remaining = list(completed.filter(tiles))
+        self.assertEqual(len(remaining), len(tiles) - len(done))
+        self.assertFalse(set(t[1] for t in remaining) & set(done))
+
+        # The logs are merged in the bitmaps file
+        completed.compact(self.tmpDir)
+        self.assertEqual(logFiles(self.tmpDir), [])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpDir, BITMAPS_FILE)))
+        again = CompletedTiles.fromDirectory(self.tmpDir, self.planner)
+        self.assertEqual(again.numberOfTiles(), len(done))
+        self.assertTrue(done[-1] in again)
+
+        clearDirectory(self.tmpDir)
+        self.assertEqual(os.listdir(self.tmpDir), [])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from forge.lib.costs import UniformCostModel, DensityCostModel, \
+    TimingsCostModel, TileIndexCostModel, balancedChunks, formatTiming, \
+    parseTiming, sampledDensity, SAMPLE_SEED
+
+
+class TestCosts(unittest.TestCase):
+
+    def testBalancedChunksUniform(self):
+        tiles = [(None, (x, 0, 3)) for x in range(0, 10)]
+        chunks = list(balancedChunks(tiles, UniformCostModel(), 4))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+
+    def testBalancedChunksWeighted(self):
+        timings = {(0, 0, 3): 10.0, (1, 0, 3): 1.0, (2, 0, 3): 1.0}
+        model = TimingsCostModel(timings)
+        tiles = [(None, (x, 0, 3)) for x in range(0, 3)]
+        chunks = list(balancedChunks(tiles, model, 2.0))
+        self.assertEqual([len(c) for c in chunks], [1, 2])
+        chunks = list(balancedChunks(tiles, model, 100.0, maxTiles=2))
+        self.assertEqual([len(c) for c in chunks], [2, 1])
+
+    def testTimingsFallback(self):
+        model = TimingsCostModel({(0, 0, 3): 3.0, (1, 0, 3): 1.0})
+        self.assertEqual(model.cost((5, 5, 3)), 2.0)
+        self.assertEqual(model.cost((5, 5, 4)), 2.0)
+        model = TimingsCostModel({}, fallback=UniformCostModel())
+        self.assertEqual(model.cost((5, 5, 4)), 1.0)
+
+    def testTimingsFromLogs(self):
+        folder = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(folder, 'timings_1.log'), 'w') as f:
+                f.write(formatTiming((1, 2, 3), 0.5, 10))
+                f.write('garbage\n')
+            with open(os.path.join(folder, 'timings_2.log'), 'w') as f:
+                f.write(formatTiming((2, 2, 3), 1.5, 0))
+            model = TimingsCostModel.fromLogs(
+                os.path.join(folder, 'timings_*.log'))
+            self.assertEqual(model.cost((1, 2, 3)), 0.5)
+            self.assertEqual(model.cost((2, 2, 3)), 1.5)
+        finally:
+            shutil.rmtree(folder)
+        self.assertEqual(parseTiming('3 1 2 0.25 4'), ((1, 2, 3), 0.25))
+        self.assertTrue(parseTiming('3 1') is None)
+
+    def testDensity(self):
+        counts = {'t': {(4, 4): 4000, (5, 4): 0}}
+        model = DensityCostModel(counts, 3, {2: 't', 3: 't', 4: 't'})
+        self.assertEqual(model.cost((4, 4, 3)), 5.0)
+        self.assertEqual(model.cost((5, 4, 3)), 1.0)
+        # Coarser zoom sums the cells, finer zoom splits them
+        self.assertEqual(model.triangles((2, 2, 2)), 4000.0)
+        self.assertEqual(model.triangles((8, 9, 4)), 1000.0)
+
+    def testTileIndex(self):
+        model = TileIndexCostModel({(1, 2, 3): 2000})
+        self.assertEqual(model.cost((1, 2, 3)), 3.0)
+        self.assertEqual(model.cost([1, 2, 3]), 3.0)
+        self.assertEqual(model.cost((2, 2, 3)), 1.0)
+
+    def testSampledDensityIsRepeatable(self):
+        executed = []
+
+        class Session:
+            def execute(self, query, params):
+                executed.append((str(query), params))
+                return [(4.0, 5.0, 3)]
+
+        class Model:
+            __tablename__ = 'break_0'
+            __table_args__ = {'schema': 'data'}
+
+        density = sampledDensity(Session(), Model, (0, 0, 10, 10), 10, 2.0)
+        self.assertEqual(density, {(4, 5): 150.0})
+        self.assertTrue('REPEATABLE (:seed)' in executed[0][0])
+        self.assertEqual(executed[0][1]['seed'], SAMPLE_SEED)
+
+    def testDeterministic(self):
+        self.assertTrue(UniformCostModel.deterministic)
+        self.assertTrue(DensityCostModel.deterministic)
+        self.assertTrue(TileIndexCostModel.deterministic)
+        self.assertFalse(TimingsCostModel.deterministic)
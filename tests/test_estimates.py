@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib.estimates import estimateFromSample, exactEstimate, \
+    containsExtent, intersectsExtent, unionExtents, FeatureEstimator
+from forge.models import estimatedRowCountLiteral, estimatedExtentLiteral, \
+    partitionsLiteral
+
+
+class Result:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalar(self):
+        return self.rows[0][0] if self.rows else None
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+# Answers the statistics queries of a FeatureEstimator from the rows
+# registered for each query
+class StatsSession:
+
+    def __init__(self):
+        self.results = {}
+
+    def register(self, query, rows):
+        self.results[str(query)] = rows
+
+    def execute(self, query, params=None):
+        return Result(self.results[str(query)])
+
+    def rollback(self):
+        pass
+
+
+class PartitionedModel:
+    __tablename__ = 'break_0'
+    __table_args__ = {'schema': 'data'}
+
+
+class TestFeatureEstimates(unittest.TestCase):
+
+    def testEstimateFromSample(self):
+        estimate = estimateFromSample(1000000, 10000, 2500)
+        self.assertEqual(estimate.count, 250000)
+        self.assertTrue(estimate.low < 250000 < estimate.high)
+        # 1.96 * sqrt(0.25 * 0.75 / 10000) ~ 0.0085
+        self.assertTrue(240000 < estimate.low)
+        self.assertTrue(estimate.high < 260000)
+        self.assertEqual(estimate.method, 'sample')
+
+    def testEstimateFromSampleBounds(self):
+        estimate = estimateFromSample(1000, 100, 0)
+        self.assertEqual(estimate.low, 0)
+        self.assertTrue(estimate.high > 0)
+        estimate = estimateFromSample(1000, 100, 100)
+        self.assertEqual(estimate.high, 1000)
+        self.assertTrue(estimate.low < 1000)
+        self.assertRaises(ValueError, estimateFromSample, 1000, 0, 0)
+
+    def testPerTile(self):
+        estimate = exactEstimate(1000).perTile(4)
+        self.assertEqual(estimate.count, 250)
+        self.assertEqual(estimate.low, 250)
+        self.assertEqual(estimate.high, 250)
+        self.assertTrue(exactEstimate(1000).perTile(0) is None)
+
+    def testExtents(self):
+        bounds = [5.8, 45.8, 10.9, 47.8]
+        self.assertTrue(containsExtent(bounds, [6.0, 46.0, 7.0, 47.0]))
+        self.assertFalse(containsExtent(bounds, [5.0, 46.0, 7.0, 47.0]))
+        self.assertTrue(intersectsExtent(bounds, [5.0, 46.0, 7.0, 47.0]))
+        self.assertFalse(intersectsExtent(bounds, [0.0, 0.0, 1.0, 1.0]))
+
+    def testUnionExtents(self):
+        self.assertEqual(unionExtents([]), None)
+        self.assertEqual(unionExtents([
+            (6.0, 46.0, 7.0, 47.0), (7.0, 45.5, 8.0, 46.5)]),
+            (6.0, 45.5, 8.0, 47.0))
+
+    def testPartitionedTable(self):
+        session = StatsSession()
+        # The rows and the extents of a partitioned table are the ones of
+        # its partitions, its default partition is empty
+        session.register(estimatedRowCountLiteral('data', 'break_0'), [(300,)])
+        session.register(partitionsLiteral('data', 'break_0'), [
+            ('data', 'break_0_default', 0),
+            ('data', 'break_0_p1', 100),
+            ('data', 'break_0_p2', 200)])
+        session.register(estimatedExtentLiteral('data', 'break_0_p1'),
+                         [(6.0, 46.0, 7.0, 47.0)])
+        session.register(estimatedExtentLiteral('data', 'break_0_p2'),
+                         [(7.0, 45.5, 8.0, 46.5)])
+        estimator = FeatureEstimator(session)
+        estimate = estimator.estimate(PartitionedModel, [5.0, 45.0, 9.0, 48.0])
+        self.assertEqual(estimate.count, 300)
+        self.assertEqual(estimate.method, 'extent')
+        estimate = estimator.estimate(PartitionedModel, [0.0, 0.0, 1.0, 1.0])
+        self.assertEqual(estimate.count, 0)
+        self.assertEqual(estimate.method, 'extent')
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from shapely.geometry import box
+from forge.lib.footprint import Footprint
+from forge.lib.planner import TileRangePlanner
+from forge.lib.tiles import grid
+
+
+bounds = (5.86725126512748, 45.8026860136571, 10.9209100671547, 47.8661652478939)
+
+# A concave polygon with a hole, covering part of the extent
+footprintWKT = 'POLYGON((6 46, 10 46, 10 47.5, 8 46.6, 6 47.5, 6 46),' \
+    '(8.5 46.1, 9.5 46.1, 9.5 46.3, 8.5 46.3, 8.5 46.1))'
+
+
+class TestFootprint(unittest.TestCase):
+
+    def testMaskMatchesIntersects(self):
+        footprint = Footprint.fromWKT(footprintWKT)
+        planner = TileRangePlanner(bounds, 7, 10, footprint=footprint)
+        for tileBounds, (x, y, z) in grid(bounds, 7, 10):
+            expected = footprint.geometry.intersects(box(*tileBounds))
+            self.assertEqual((x, y, z) in planner, expected)
+
+    def testGridAndCounts(self):
+        footprint = Footprint.fromWKT(footprintWKT)
+        planner = TileRangePlanner(bounds, 7, 10, footprint=footprint)
+        fullPlanner = TileRangePlanner(bounds, 7, 10)
+        tiles = list(grid(bounds, 7, 10, footprint=footprint))
+        self.assertEqual(planner.numberOfTiles(), len(tiles))
+        self.assertTrue(len(tiles) < fullPlanner.numberOfTiles())
+        self.assertEqual(
+            len(tiles) + len(list(planner.iterOutsideTiles())),
+            fullPlanner.numberOfTiles())
+        self.assertEqual(
+            [t[1] for t in tiles], list(planner.iterTiles()))
+        hilbertTiles = list(
+            grid(bounds, 7, 10, order='hilbert', footprint=footprint))
+        self.assertEqual(sorted(hilbertTiles), sorted(tiles))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from forge.lib.ingest import ingestAction, shapefileChecksum, shapefileStat, \
+    SKIP, LOAD, REPLACE
+
+
+class Registered:
+
+    def __init__(self, checksum, size, mtime):
+        self.checksum = checksum
+        self.size = size
+        self.mtime = mtime
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.shp = os.path.join(self.tmpDir, 'sheet.shp')
+        for ext, content in (('.shp', 'geometries'), ('.dbf', 'attributes')):
+            with open(os.path.join(self.tmpDir, 'sheet' + ext), 'w') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def register(self):
+        (size, mtime) = shapefileStat(self.shp)
+        return Registered(shapefileChecksum(self.shp), size, mtime)
+
+    def testActions(self):
+        self.assertEqual(ingestAction(None, self.shp)[0], LOAD)
+        registered = self.register()
+        self.assertEqual(registered.size, 20)
+        self.assertEqual(ingestAction(registered, self.shp)[0], SKIP)
+        self.assertEqual(ingestAction(registered, self.shp, force=True)[0],
+                         REPLACE)
+
+        # Touched but identical
+        mtime = time.time() + 10
+        os.utime(self.shp, (mtime, mtime))
+        self.assertEqual(ingestAction(registered, self.shp),
+                         (SKIP, registered.checksum))
+
+        # Same size, different content
+        with open(os.path.join(self.tmpDir, 'sheet.dbf'), 'w') as f:
+            f.write('ATTRIBUTES')
+        (action, checksum) = ingestAction(registered, self.shp)
+        self.assertEqual(action, REPLACE)
+        self.assertNotEqual(checksum, registered.checksum)
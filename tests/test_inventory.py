@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+from forge.lib.inventory import InventorySummary, formatTSV, formatJSONL, \
+    zoomOf
+
+
+class TestInventory(unittest.TestCase):
+
+    def testZoomOf(self):
+        self.assertEqual(zoomOf('v/12/3/4.terrain', 'v/'), 12)
+        self.assertEqual(zoomOf('v/layer.json', 'v/'), None)
+        self.assertEqual(zoomOf('w/12/3/4.terrain', 'v/'), None)
+
+    def testSummary(self):
+        summary = InventorySummary()
+        summary.add(3, 10)
+        summary.add(3, 30)
+        summary.add(4, 5)
+        summary.add(None, 100)
+        self.assertEqual(summary.zooms[3], [2, 40, 30])
+        self.assertEqual(summary.nbKeys, 4)
+        self.assertEqual(summary.totalSize, 145)
+        lines = str(summary).split('\n')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[1].split(), ['3', '2', '40', '20', '30'])
+        self.assertEqual(lines[3].split()[0], 'other')
+        self.assertEqual(lines[4].split(), ['all', '4', '145', '36', '100'])
+
+    def testFormats(self):
+        self.assertEqual(formatTSV('a', 1, 'd'), 'a\t1\td\n')
+        self.assertEqual(json.loads(formatJSONL('a', 1, 'd')),
+                         dict(name='a', size=1, modified='d'))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import unittest
+import multiprocessing
+import forge.lib.logs as logs
+from forge.lib.logs import getLogger, startLogListener, stopLogListener, \
+    LogSummary, QueueHandler
+
+loggingConfig = '''\
+[loggers]
+keys=root
+
+[handlers]
+keys=fileHandler
+
+[formatters]
+keys=simpleFormatter
+
+[logger_root]
+level=DEBUG
+handlers=fileHandler
+
+[handler_fileHandler]
+class=FileHandler
+level=DEBUG
+formatter=simpleFormatter
+args=('%(logfile)s',)
+
+[formatter_simpleFormatter]
+format=%(name)s %(message)s
+
+[Logging]
+logfile: forge_%(timestamp)s.log
+'''
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpDir = tempfile.mkdtemp()
+        os.chdir(self.tmpDir)
+        with open('logging.cfg', 'w') as f:
+            f.write(loggingConfig)
+        self.configured = (logs._configured, logs._configuredPid)
+        logs._configured = False
+        logs._configuredPid = None
+
+    def tearDown(self):
+        stopLogListener()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            handler.close()
+            root.removeHandler(handler)
+        (logs._configured, logs._configuredPid) = self.configured
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpDir)
+
+    def readLog(self, path):
+        logging.getLogger().handlers[0].flush()
+        with open(path) as f:
+            return f.read().splitlines()
+
+    def testLazy(self):
+        logger = getLogger('forge.a', suffix='a')
+        other = getLogger('forge.b', suffix='b')
+        self.assertFalse(os.path.exists('forge_a.log'))
+        logger.info('first')
+        other.info('second')
+        # Configured once, by the first logger used
+        self.assertFalse(os.path.exists('forge_b.log'))
+        self.assertEqual(self.readLog('forge_a.log'), [
+            'forge.a first', 'forge.b second'])
+
+    def testListener(self):
+        logger = getLogger('forge.c', suffix='a')
+        startLogListener('a')
+        logger.info('parent')
+
+        def work():
+            try:
+                raise ValueError('oops')
+            except ValueError:
+                logger.error('worker %s', 1, exc_info=True)
+            # The worker does not write the file itself
+            handlers = logging.getLogger().handlers
+            sys.exit(0 if isinstance(handlers[0], QueueHandler) else 1)
+
+        worker = multiprocessing.Process(target=work)
+        worker.start()
+        worker.join()
+        self.assertEqual(worker.exitcode, 0)
+        stopLogListener()
+        lines = self.readLog('forge_a.log')
+        self.assertEqual(lines[:2], ['forge.c parent', 'forge.c worker 1'])
+        self.assertEqual(lines[-1], 'ValueError: oops')
+
+
+class Recorder:
+
+    def __init__(self):
+        self.messages = []
+
+    def log(self, level, message):
+        self.messages.append(message)
+
+
+class TestLogSummary(unittest.TestCase):
+
+    def testSummary(self):
+        recorder = Recorder()
+        summary = LogSummary(recorder, '%(count)s %(key)s', interval=3600)
+        for key in ('a', 'b', 'c'):
+            summary.add(key=key)
+        self.assertEqual(recorder.messages, [])
+        summary.flush()
+        summary.flush()
+        self.assertEqual(recorder.messages, ['3 c'])
+        summary.interval = 0
+        summary.add(key='d')
+        self.assertEqual(recorder.messages, ['3 c', '1 d'])
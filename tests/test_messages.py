@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib import sfc
+from forge.lib.messages import TileRectangle, MessageVersionError, \
+    toRectangles, encodeTiles, encodeLegacyTiles, decodeRectangles, \
+    decodeTiles, nbTilesInMessage, encodeTilesWithin
+
+
+class TestMessages(unittest.TestCase):
+
+    def testRectangles(self):
+        tiles = [(x, y, 5) for x in range(2, 6) for y in range(3, 7)]
+        tiles += [(9, 3, 5), (9, 4, 5), (1, 1, 6)]
+        rectangles = toRectangles(tiles)
+        self.assertEqual(rectangles, [
+            TileRectangle(5, 2, 3, 5, 6),
+            TileRectangle(5, 9, 3, 9, 4),
+            TileRectangle(6, 1, 1, 1, 1)
+        ])
+
+    def testRoundTrip(self):
+        tiles = [(x, y, 10) for x, y in sfc.iterRange(
+            100, 200, 163, 263, 11, sfc.HILBERT)][:1234]
+        body = encodeTiles(tiles)
+        self.assertTrue(body.startswith('v2;'))
+        self.assertEqual(sorted(decodeTiles(body)), sorted(tiles))
+        self.assertEqual(nbTilesInMessage(body), len(tiles))
+        # Much smaller than the legacy encoding
+        self.assertTrue(len(body) * 20 < len(encodeLegacyTiles(tiles)))
+
+    def testLegacy(self):
+        body = encodeLegacyTiles([(133, 98, 7), (134, 98, 7)])
+        self.assertEqual(body, '133,98,7,134,98,7')
+        self.assertEqual(list(decodeTiles(body)), [(133, 98, 7), (134, 98, 7)])
+        self.assertRaises(ValueError, decodeRectangles, '133,98')
+
+    def testVersions(self):
+        self.assertRaises(MessageVersionError, decodeRectangles,
+                          'v3;7,133,98,134,98')
+        self.assertRaises(ValueError, decodeRectangles, 'vx;7,133,98,134,98')
+        self.assertRaises(ValueError, decodeRectangles, 'v2;7,133,98')
+        self.assertRaises(ValueError, decodeRectangles, 'v2;7,134,98,133,98')
+
+    def testEncodeWithin(self):
+        tiles = [(x, 0, 10) for x in range(0, 200, 2)]
+        bodies = encodeTilesWithin(tiles, 200)
+        self.assertTrue(len(bodies) > 1)
+        self.assertTrue(all(len(b) <= 200 for b in bodies))
+        decoded = []
+        for body in bodies:
+            decoded += list(decodeTiles(body))
+        self.assertEqual(sorted(decoded), sorted(tiles))
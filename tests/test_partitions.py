@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib.partitions import PartitionGrid
+
+
+class TestPartitions(unittest.TestCase):
+
+    def testCells(self):
+        grid = PartitionGrid(2)
+        self.assertEqual(grid.cellSize, 45.0)
+        key = grid.key((7.0, 46.0, 7.1, 46.1))
+        self.assertEqual(grid.cell(key), (4, 3))
+        self.assertEqual(grid.cellBounds(key), (0.0, 45.0, 45.0, 90.0))
+        self.assertEqual(grid.key((179.9, 89.9, 180.0, 90.0)),
+                         grid.cellKey(7, 3))
+
+    def testLargeTriangles(self):
+        grid = PartitionGrid(2)
+        self.assertEqual(grid.key((0.0, 0.0, 46.0, 1.0)), grid.DEFAULT_KEY)
+        self.assertEqual(grid.key((0.0, 0.0, 1.0, 46.0)), grid.DEFAULT_KEY)
+
+    def testKeysIntersecting(self):
+        grid = PartitionGrid(2)
+        keys = grid.keysIntersecting((10.0, 50.0, 20.0, 60.0))
+        self.assertEqual(sorted(keys), sorted([
+            grid.DEFAULT_KEY,
+            grid.cellKey(3, 2), grid.cellKey(4, 2),
+            grid.cellKey(3, 3), grid.cellKey(4, 3)]))
+
+    def testTrianglesAreFound(self):
+        # A triangle crossing a cell edge is found from both cells
+        grid = PartitionGrid(4)
+        triangle = (11.2, 45.0, 11.4, 45.2)
+        key = grid.key(triangle)
+        for bbox in [(11.0, 45.0, 11.24, 45.1), (11.26, 45.1, 11.5, 45.3)]:
+            self.assertTrue(key in grid.keysIntersecting(bbox))
+
+    def testPartitionName(self):
+        self.assertEqual(PartitionGrid.partitionName('bl', 12), 'bl_p12')
+        self.assertEqual(
+            PartitionGrid.partitionName('bl', PartitionGrid.DEFAULT_KEY),
+            'bl_default')
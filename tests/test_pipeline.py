@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+from forge.lib.pipeline import Pipeline, ThreadCounter, RateLimiter, \
+    retry, background
+
+
+class TestPipeline(unittest.TestCase):
+
+    def testCounter(self):
+        counter = ThreadCounter()
+
+        def count():
+            for i in xrange(0, 10000):
+                counter.add()
+        threads = [threading.Thread(target=count) for i in xrange(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.value, 80000)
+
+    def testRun(self):
+        seen = []
+        pipeline = Pipeline(seen.append, nbWorkers=4, nbProducers=2,
+                            queueSize=5)
+        nbDone = pipeline.run([xrange(0, 100), xrange(100, 150), []])
+        self.assertEqual(nbDone, 150)
+        self.assertEqual(sorted(seen), range(0, 150))
+
+    def testFailures(self):
+        def work(item):
+            if item % 10 == 0:
+                raise ValueError(item)
+        pipeline = Pipeline(work, nbWorkers=3)
+        self.assertEqual(pipeline.run([xrange(0, 100)]), 90)
+        self.assertEqual(pipeline.failed.value, 10)
+        self.assertEqual(
+            sorted(item for item, e in pipeline.errors), range(0, 100, 10))
+
+    def testProducerError(self):
+        def source():
+            yield 1
+            raise IOError('listing failed')
+        pipeline = Pipeline(lambda item: None, nbWorkers=2)
+        self.assertRaises(IOError, pipeline.run, [source()])
+
+    def testRetry(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            if len(calls) < 3:
+                raise IOError('slow down')
+            return 'ok'
+        self.assertEqual(
+            retry(call, lambda e: isinstance(e, IOError), delay=0), 'ok')
+        self.assertEqual(len(calls), 3)
+        del calls[:]
+        self.assertRaises(
+            IOError, retry, call, lambda e: False, delay=0)
+        self.assertEqual(len(calls), 1)
+
+    def testBackground(self):
+        self.assertEqual(list(background(xrange(0, 50), queueSize=3)),
+                         range(0, 50))
+
+        def source():
+            yield 1
+            raise IOError('listing failed')
+        self.assertRaises(IOError, list, background(source()))
+
+    def testRateLimiter(self):
+        limiter = RateLimiter(1000, burst=10)
+        t0 = time.time()
+        for i in xrange(0, 6):
+            limiter.acquire(10)
+        # The burst is free, the 50 other requests take about 50ms
+        self.assertTrue(time.time() - t0 >= 0.04)
+        RateLimiter(None).acquire(10 ** 6)
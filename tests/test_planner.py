@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import ConfigParser
+from forge.lib.tiles import grid, keyOrderedTiles, TerrainTiles
+from forge.lib.planner import TileRangePlanner
+
+
+bounds = (5.86725126512748, 45.8026860136571, 10.9209100671547, 47.8661652478939)
+
+
+def tmsConfig():
+    config = ConfigParser.RawConfigParser()
+    config.add_section('General')
+    config.set('General', 'bucketpath', '')
+    config.set('General', 'tileOrder', 'hilbert')
+    config.add_section('Extent')
+    config.set('Extent', 'minLon', bounds[0])
+    config.set('Extent', 'minLat', bounds[1])
+    config.set('Extent', 'maxLon', bounds[2])
+    config.set('Extent', 'maxLat', bounds[3])
+    config.add_section('Zooms')
+    config.set('Zooms', 'tileMinZ', 7)
+    config.set('Zooms', 'tileMaxZ', 11)
+    config.add_section('Extensions')
+    config.set('Extensions', 'lighting', 0)
+    config.set('Extensions', 'watermask', 0)
+    return config
+
+
+class TestTileRangePlanner(unittest.TestCase):
+
+    def testNumberOfTilesMatchesGrid(self):
+        minZoom = 0
+        maxZoom = 9
+        planner = TileRangePlanner(bounds, minZoom, maxZoom)
+        tiles = list(grid(bounds, minZoom, maxZoom))
+
+        self.assertEqual(planner.numberOfTiles(), len(tiles))
+        for z in range(minZoom, maxZoom + 1):
+            nbTiles = len([t for t in tiles if t[1][2] == z])
+            self.assertEqual(planner.numberOfTilesAtZoom(z), nbTiles)
+
+    def testRangesContainGridTiles(self):
+        planner = TileRangePlanner(bounds, 8, 10)
+        for tileBounds, tileXYZ in grid(bounds, 8, 10):
+            self.assertTrue(tileXYZ in planner)
+            self.assertEqual(
+                planner.tileBounds(tileXYZ[2], tileXYZ[0], tileXYZ[1]),
+                tileBounds)
+        zRange = planner.zoomRange(8)
+        self.assertFalse((zRange.maxX + 1, zRange.minY, 8) in planner)
+        self.assertFalse((zRange.minX, zRange.minY, 11) in planner)
+
+    def testKeyOrderedTiles(self):
+        # 32 columns and 16 rows, 10 sorts before 9
+        world = [-180, -90, 180, 90]
+        planner = TileRangePlanner(world, 4, 4)
+        tiles = list(keyOrderedTiles(planner, 4))
+        keys = ['4/%s/%s.terrain' % (x, y) for x, y in tiles]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(sorted(tiles), sorted(
+            (x, y) for tileBounds, (x, y, z) in grid(world, 4, 4)))
+
+    def testTileDiagonal(self):
+        planner = TileRangePlanner(bounds, 8, 9)
+        self.assertTrue(planner.tileDiagonal(8) > planner.tileDiagonal(9))
+        # A tile is about 78km by 54km at zoom 8 around 46.8 degrees
+        self.assertTrue(90000 < planner.tileDiagonal(8) < 100000)
+
+    def testPartitionsCoverTheGrid(self):
+        tiles = TerrainTiles(None, tmsConfig(), 0)
+        allTiles = [t[1] for t in tiles]
+        parts = tiles.partitions(500)
+        self.assertTrue(len(parts) > tiles.tileMaxZ - tiles.tileMinZ + 1)
+        partTiles = []
+        for part in parts:
+            partTiles += [t[1] for t in tiles.iterPartition(part)]
+        self.assertEqual(sorted(partTiles), sorted(allTiles))
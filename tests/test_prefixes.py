@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib.prefixes import prefixPartitions
+
+
+class TestPrefixes(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = {
+            'v/': (['v/0/', 'v/1/'], True),
+            'v/0/': (['v/0/0/', 'v/0/1/'], False),
+            'v/1/': (['v/1/0/'], False),
+            'v/0/0/': ([], True),
+            'v/0/1/': ([], True),
+            'v/1/0/': ([], True),
+        }
+        self.listed = []
+
+    def listPrefix(self, prefix):
+        self.listed.append(prefix)
+        return self.tree.get(prefix, ([], False))
+
+    def testZoomsAndColumns(self):
+        partitions = prefixPartitions(self.listPrefix, 'v/', 2)
+        self.assertEqual(partitions, [
+            ('v/', False),
+            ('v/0/0/', True), ('v/0/1/', True), ('v/1/0/', True)])
+        # The columns are not listed to find partitions
+        self.assertEqual(self.listed, ['v/', 'v/0/', 'v/1/'])
+
+    def testDepth(self):
+        self.assertEqual(
+            prefixPartitions(self.listPrefix, 'v/1/', 1), [('v/1/0/', True)])
+        self.assertEqual(
+            prefixPartitions(self.listPrefix, 'v/1/0/', 0),
+            [('v/1/0/', True)])
+        self.assertEqual(prefixPartitions(self.listPrefix, 'w/', 2), [])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import unittest
+
+from forge.lib.queue_worker import MessageWork, VisibilityHeartbeat, \
+    MessagePrefetcher, MAX_VISIBILITY_TIMEOUT
+
+
+class TestQueueWorker(unittest.TestCase):
+
+    def testHeartbeatExtendsCloseDeadlines(self):
+        changes = []
+        heartbeat = VisibilityHeartbeat(
+            lambda m, t: changes.append((m, t)), 40, secondsPerTile=2.0)
+        self.assertEqual(heartbeat.interval, 10)
+        current = MessageWork(100)
+        current.nbDone = 90
+        heartbeat.track('current', current)
+        heartbeat.track('prefetched', MessageWork(100))
+        # Deadlines are 40 seconds away, 2 intervals is 20 seconds
+        heartbeat.beat()
+        self.assertEqual(changes, [])
+
+        heartbeat._tracked['current'] = (current, time.time())
+        heartbeat._tracked['prefetched'] = (
+            heartbeat.work('prefetched'), time.time())
+        heartbeat.beat()
+        # The visibility covers the work in front of each message
+        self.assertEqual(changes[0], ('current', int(10 * 2.0 * 1.5) + 20))
+        self.assertEqual(changes[1], ('prefetched', int(110 * 2.0 * 1.5) + 20))
+
+        heartbeat.untrack('current')
+        self.assertIsNone(heartbeat.work('current'))
+        self.assertEqual(heartbeat.timeoutFor(10 ** 9), MAX_VISIBILITY_TIMEOUT)
+
+    def testPrefetcher(self):
+        messages = ['5,6,7', '1,2,3,4,5,6', None]
+        released = []
+        heartbeat = VisibilityHeartbeat(lambda m, t: None, 120)
+
+        def read():
+            if messages:
+                return messages.pop(0)
+            time.sleep(0.01)
+
+        prefetcher = MessagePrefetcher(
+            read, released.append, lambda m: len(m.split(',')) // 3,
+            heartbeat)
+        prefetcher.start()
+        self.assertEqual(prefetcher.get(5), '5,6,7')
+        self.assertEqual(heartbeat.work('5,6,7').nbTiles, 1)
+        # Wait for the second message to be prefetched
+        for i in xrange(500):
+            if prefetcher._messages.full():
+                break
+            time.sleep(0.01)
+        self.assertEqual(heartbeat.work('1,2,3,4,5,6').nbTiles, 2)
+        prefetcher.stop()
+        prefetcher.join(5)
+        self.assertEqual(released, ['1,2,3,4,5,6'])
+        self.assertIsNone(heartbeat.work('1,2,3,4,5,6'))
+        self.assertIsNone(prefetcher.get(0.01))
+        self.assertTrue(prefetcher.waited > 0)
+
+    def testPrefetcherStopWhileReading(self):
+        released = []
+        warnings = []
+        reading = threading.Event()
+        calls = []
+
+        class Logger:
+            def warning(self, msg, exc_info=False):
+                warnings.append(msg)
+
+        # Fails once, then returns a message only after the prefetcher was
+        # asked to stop
+        def read():
+            calls.append(1)
+            if len(calls) == 1:
+                raise Exception('connection reset')
+            reading.set()
+            time.sleep(0.2)
+            return '1,2,3'
+
+        heartbeat = VisibilityHeartbeat(lambda m, t: None, 120)
+        prefetcher = MessagePrefetcher(
+            read, released.append, lambda m: 1, heartbeat, logger=Logger())
+        prefetcher.start()
+        self.assertTrue(reading.wait(5))
+        prefetcher.stop()
+        self.assertFalse(prefetcher.is_alive())
+        self.assertEqual(released, ['1,2,3'])
+        self.assertIsNone(heartbeat.work('1,2,3'))
+        self.assertIsNone(prefetcher.get(0.01))
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue('connection reset' in warnings[0])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from forge.lib.queues import DBQueue, openQueue
+
+
+class TestDBQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.url = 'sqlite:///%s' % os.path.join(self.tmpDir, 'queue.db')
+        self.queue = openQueue('test', self.url)
+        self.queue.create(120)
+
+    def tearDown(self):
+        self.queue.engine.dispose()
+        shutil.rmtree(self.tmpDir)
+
+    def testLifecycle(self):
+        self.assertTrue(self.queue.exists())
+        self.assertFalse(DBQueue('other', self.url).exists())
+        self.assertEqual(self.queue.write('m%s' % i for i in xrange(1234)), 1234)
+        self.assertEqual(self.queue.count(), 1234)
+
+        m = self.queue.read(120, 0)
+        self.assertEqual(m.body, 'm0')
+        self.assertEqual(self.queue.read(120, 0).body, 'm1')
+        stats = self.queue.stats()
+        self.assertEqual(stats['ApproximateNumberOfMessages'], 1232)
+        self.assertEqual(stats['ApproximateNumberOfMessagesNotVisible'], 2)
+
+        # Released messages can be read again
+        self.queue.changeVisibility(m, 0)
+        again = self.queue.read(120, 0)
+        self.assertEqual(again.body, 'm0')
+        # The first lease is gone
+        self.queue.deleteMessage(m)
+        self.assertEqual(self.queue.stats()[
+            'ApproximateNumberOfMessagesNotVisible'], 2)
+        self.queue.deleteMessage(again)
+        self.assertEqual(self.queue.stats()[
+            'ApproximateNumberOfMessagesNotVisible'], 1)
+
+        self.queue.delete()
+        self.assertFalse(self.queue.exists())
+        self.assertIsNone(self.queue.read(120, 0))
+
+    def testConcurrentReaders(self):
+        self.queue.write(str(i) for i in xrange(200))
+
+        def consume(i):
+            q = self.queue.copy()
+            bodies = []
+            while True:
+                m = q.read(120, 0)
+                if m is None:
+                    return bodies
+                q.deleteMessage(m)
+                bodies.append(m.body)
+
+        pool = ThreadPool(4)
+        try:
+            results = pool.map(consume, range(4))
+        finally:
+            pool.close()
+            pool.join()
+        bodies = sorted(int(b) for r in results for b in r)
+        # Each message is read exactly once
+        self.assertEqual(bodies, range(200))
+        self.assertEqual(self.queue.count(), 0)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib import sfc
+from forge.lib.tiles import grid
+
+
+bounds = (5.86725126512748, 45.8026860136571, 10.9209100671547, 47.8661652478939)
+
+
+class TestSpaceFillingCurves(unittest.TestCase):
+
+    def testMortonKey(self):
+        self.assertEqual(sfc.mortonKey(0, 0, 2), 0)
+        self.assertEqual(sfc.mortonKey(1, 0, 2), 1)
+        self.assertEqual(sfc.mortonKey(0, 1, 2), 2)
+        self.assertEqual(sfc.mortonKey(1, 1, 2), 3)
+        self.assertEqual(sfc.mortonKey(2, 0, 2), 4)
+        self.assertEqual(sfc.mortonKey(3, 3, 2), 15)
+
+    def testHilbertKeyIsContinuous(self):
+        order = 4
+        n = 1 << order
+        cells = sorted(
+            ((x, y) for x in range(0, n) for y in range(0, n)),
+            key=lambda c: sfc.hilbertKey(c[0], c[1], order))
+        keys = [sfc.hilbertKey(x, y, order) for x, y in cells]
+        self.assertEqual(keys, range(0, n * n))
+        for i in range(1, len(cells)):
+            dx = abs(cells[i][0] - cells[i - 1][0])
+            dy = abs(cells[i][1] - cells[i - 1][1])
+            self.assertEqual(dx + dy, 1)
+
+    def testIterRangeFollowsCurve(self):
+        for curve in (sfc.HILBERT, sfc.MORTON):
+            key = sfc.curveKey(curve)
+            cells = list(sfc.iterRange(3, 5, 40, 21, 7, curve, blockBits=3))
+            expected = sorted(
+                ((x, y) for x in range(3, 41) for y in range(5, 22)),
+                key=lambda c: key(c[0], c[1], 7))
+            self.assertEqual(cells, expected)
+
+    def testCurveGridHasSameTiles(self):
+        rowTiles = list(grid(bounds, 6, 9))
+        for curve in (sfc.HILBERT, sfc.MORTON):
+            curveTiles = list(grid(bounds, 6, 9, order=curve))
+            self.assertEqual(sorted(rowTiles), sorted(curveTiles))
+            self.assertNotEqual(rowTiles, curveTiles)
+
+    def testUnknownCurve(self):
+        self.assertRaises(ValueError, sfc.curveKey, 'peano')
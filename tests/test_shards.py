@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import time
+import unittest
+import cStringIO
+from forge.lib import sfc
+from forge.lib.costs import UniformCostModel, TimingsCostModel, totalCost
+from forge.lib.shards import Shard, parseManifest, conflictingShards
+
+
+class TestShards(unittest.TestCase):
+
+    def tiles(self):
+        return [(None, (x, y, 9)) for x, y in sfc.iterRange(
+            0, 0, 63, 31, sfc.orderAtZoom(9), sfc.HILBERT)]
+
+    def testParse(self):
+        shard = Shard.parse('2/5')
+        self.assertEqual((shard.index, shard.count), (2, 5))
+        self.assertEqual(str(shard), '2/5')
+        self.assertRaises(ValueError, Shard.parse, '5/5')
+        self.assertRaises(ValueError, Shard.parse, '1')
+
+    def testPartition(self):
+        tiles = self.tiles()
+        # Tiles of the left half cost 3 times more
+        timings = dict((t[1], 3.0 if t[1][0] < 32 else 1.0) for t in tiles)
+        model = TimingsCostModel(timings)
+        total = totalCost(tiles, model)
+        shards = [Shard(i, 4) for i in range(0, 4)]
+        parts = [list(s.filter(tiles, model, total)) for s in shards]
+        # Each tile belongs to exactly one shard, ranges are contiguous
+        self.assertEqual(sum(parts, []), tiles)
+        for shard in shards:
+            self.assertTrue(abs(shard.cost - total / 4) <= 3.0)
+        self.assertTrue(len(parts[0]) < len(parts[3]))
+        # Same input, same shards
+        again = Shard(1, 4)
+        self.assertEqual(list(again.filter(tiles, model, total)), parts[1])
+
+    def testManifest(self):
+        tiles = self.tiles()
+        shard = Shard(0, 2)
+        list(shard.filter(tiles, UniformCostModel(), len(tiles)))
+        manifest = json.loads(shard.manifest({'order': 'hilbert'},
+                                             time.time(), 1000, 24))
+        self.assertEqual(manifest['shard'], '0/2')
+        self.assertEqual(manifest['nbTiles'], 1024)
+        self.assertEqual(manifest['zooms']['9']['nbTiles'], 1024)
+        self.assertEqual(manifest['zooms']['9']['first'], list(tiles[0][1][:2]))
+        self.assertEqual(shard.manifestName(), 'shard-0-of-2.json')
+
+    def testConflictingShards(self):
+        plan = dict(order='hilbert', costModel='DensityCostModel',
+                    totalCost=1234.5)
+        manifests = []
+        for i in range(0, 3):
+            shard = Shard(i, 3)
+            other = dict(plan)
+            if i == 2:
+                other['totalCost'] = 1300.0
+            manifest = shard.manifest(other, time.time(), 0, 0)
+            # As written to the bucket
+            content = cStringIO.StringIO()
+            gz = gzip.GzipFile(fileobj=content, mode='w')
+            gz.write(manifest)
+            gz.close()
+            manifests.append(parseManifest(content.getvalue()))
+        self.assertEqual(parseManifest(manifest)['shard'], '2/3')
+        self.assertEqual(conflictingShards(manifests, Shard(0, 3), plan),
+                         ['2/3'])
+        self.assertEqual(conflictingShards(manifests, Shard(2, 3), plan), [])
+        plan['totalCost'] = 1300.0
+        self.assertEqual(conflictingShards(manifests, Shard(2, 3), plan),
+                         ['0/3', '1/3'])
+        # Another split
+        self.assertEqual(conflictingShards(manifests, Shard(0, 2), plan), [])
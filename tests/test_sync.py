@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib.sync import diffListings, missingKeys, SyncReport, MISSING, \
+    CHANGED, EXTRA, UNCHANGED
+from forge.lib.pipeline import ThreadCounter
+
+
+class TestSync(unittest.TestCase):
+
+    def testDiff(self):
+        src = [
+            ('3/0/0.terrain', 10, '"a"'),
+            ('3/0/1.terrain', 10, '"b"'),
+            ('3/1/0.terrain', 12, '"c"'),
+            ('3/2/0.terrain', 12, '"d"'),
+        ]
+        dst = [
+            ('3/0/0.terrain', 10, '"a"'),
+            ('3/0/1.terrain', 10, '"x"'),
+            ('3/0/2.terrain', 10, '"e"'),
+            ('3/2/0.terrain', 11, '"d"'),
+            ('3/3/0.terrain', 11, '"f"'),
+        ]
+        self.assertEqual(list(diffListings(src, dst)), [
+            (UNCHANGED, '3/0/0.terrain'),
+            (CHANGED, '3/0/1.terrain'),
+            (EXTRA, '3/0/2.terrain'),
+            (MISSING, '3/1/0.terrain'),
+            (CHANGED, '3/2/0.terrain'),
+            (EXTRA, '3/3/0.terrain'),
+        ])
+
+    def testEmptyListings(self):
+        self.assertEqual(list(diffListings([], [])), [])
+        self.assertEqual(
+            list(diffListings(iter([('a', 1, 'e')]), iter([]))),
+            [(MISSING, 'a')])
+        self.assertEqual(
+            list(diffListings([], [('a', 1, 'e')])), [(EXTRA, 'a')])
+
+    def testMissingKeys(self):
+        skipped = ThreadCounter()
+        keys = ['3/0/0.terrain', '3/0/1.terrain', '3/1/0.terrain',
+                '3/10/0.terrain', '3/2/0.terrain']
+        names = iter(['3/0/1.terrain', '3/1/0.terrain', '3/1/5.terrain',
+                      '3/2/0.terrain'])
+        self.assertEqual(list(missingKeys(keys, names, skipped)),
+                         ['3/0/0.terrain', '3/10/0.terrain'])
+        self.assertEqual(skipped.value, 3)
+
+    def testReport(self):
+        report = SyncReport([3, 4])
+        report.add(3, MISSING)
+        report.add(4, MISSING)
+        report.add(4, UNCHANGED)
+        self.assertEqual(report.total(MISSING), 2)
+        self.assertEqual(report.counts[4][UNCHANGED], 1)
+        self.assertEqual(len(str(report).split('\n')), 4)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import json
 import unittest
 from forge.terrain.metadata import TerrainMetadata
 
@@ -135,3 +136,35 @@ class TestTerrainMetadata(unittest.TestCase):
         self.assertTrue(tMeta.meta['available'][2][3]['endX'] == 7)
         self.assertTrue(tMeta.meta['available'][2][3]['startY'] == 3)
         self.assertTrue(tMeta.meta['available'][2][3]['endY'] == 3)
+
+    def testTerrainMetadataAvailabilityMasks(self):
+        minZoom = 1
+        maxZoom = 2
+        tMeta = TerrainMetadata(minzoom=minZoom, maxzoom=maxZoom)
+        matrices = {minZoom: matrix_1, maxZoom: matrix_2}
+        for z in range(minZoom, maxZoom + 1):
+            minX = tMeta.metadata[z]['x'][0]
+            maxY = tMeta.metadata[z]['y'][1]
+            for localY, row in enumerate(matrices[z]):
+                for localX, value in enumerate(row):
+                    if value == 0:
+                        tMeta.removeTile(localX + minX, maxY - localY, z)
+        layer = json.loads(tMeta.toJSON())
+
+        # A layer.json built again from its availability is identical
+        updated = TerrainMetadata(minzoom=minZoom, maxzoom=maxZoom)
+        masks = updated.availabilityMasks(layer['available'])
+        self.assertEqual(int(masks[1].sum()), 6)
+        self.assertEqual(int(masks[2].sum()), 26)
+        updated.removeUnavailable(masks)
+        self.assertEqual(json.loads(updated.toJSON()), layer)
+
+        # A tile (bottom left corner of zoom 2) becomes unavailable
+        masks[2][0, 0] = False
+        updated = TerrainMetadata(minzoom=minZoom, maxzoom=maxZoom)
+        updated.removeUnavailable(masks)
+        available = json.loads(updated.toJSON())['available']
+        masks = TerrainMetadata(
+            minzoom=minZoom, maxzoom=maxZoom).availabilityMasks(available)
+        self.assertEqual(int(masks[2].sum()), 25)
+        self.assertFalse(masks[2][0, 0])
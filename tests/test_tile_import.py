@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import threading
+import unittest
+import cStringIO
+import BaseHTTPServer
+from forge.lib.pipeline import StagedPipeline
+from forge.lib.tile_import import HTTPTileSource, TileImporter, gzipBytes
+
+
+class TileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.endswith('/404.terrain'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = 'tile %s' % self.path
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=cStringIO.StringIO(data)).read()
+
+
+class TestTileImport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), TileHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.baseURL = 'http://127.0.0.1:%s/world/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testImport(self):
+        stored = {}
+        source = HTTPTileSource(self.baseURL)
+        importer = TileImporter(
+            source.fetch, stored.__setitem__, nbDownloads=3, nbCompressors=2,
+            nbUploads=2, queueSize=2)
+        keys = ['0/%s/0.terrain' % x for x in range(0, 20)] + ['0/404.terrain']
+        existing = frozenset(['0/3/0.terrain', '0/4/0.terrain'])
+        self.assertEqual(importer.run(keys, existing=existing), 18)
+        self.assertEqual(importer.skipped.value, 2)
+        self.assertEqual(importer.failed, 1)
+        self.assertEqual(importer.errors[0][:2], (0, '0/404.terrain'))
+        self.assertEqual(len(stored), 18)
+        self.assertFalse('0/3/0.terrain' in stored)
+        self.assertEqual(gunzip(stored['0/5/0.terrain']),
+                         'tile /world/0/5/0.terrain')
+
+    def testGzip(self):
+        self.assertEqual(gunzip(gzipBytes('abc' * 100)), 'abc' * 100)
+
+
+class TestStagedPipeline(unittest.TestCase):
+
+    def testStages(self):
+        out = []
+        pipeline = StagedPipeline([
+            (lambda x: x * 2, 3),
+            (lambda x: x if x % 4 else None, 1),
+            (out.append, 2),
+        ], queueSize=2)
+        # append returns None: nothing comes out of the last stage
+        self.assertEqual(pipeline.run(xrange(0, 100)), 0)
+        self.assertEqual(sorted(out), [x * 2 for x in range(0, 100) if x % 2])
+
+    def testFailures(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        pipeline = StagedPipeline([(fail, 2), (lambda x: x, 2)])
+        self.assertEqual(pipeline.run(xrange(0, 10)), 9)
+        self.assertEqual(pipeline.failed.value, 1)
+        self.assertEqual(pipeline.errors[0][:2], (0, 3))
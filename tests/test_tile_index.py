@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from forge.lib.planner import TileRangePlanner
+from forge.lib.tile_index import indexBands, bandBounds, tileRange
+
+
+class TestTileIndex(unittest.TestCase):
+
+    def testBandsCoverPlanner(self):
+        planner = TileRangePlanner([5.5, 45.5, 10.5, 48.0], 7, 9)
+        bands = list(indexBands(planner, 20))
+        for zoom in planner.zooms:
+            r = planner.zoomRange(zoom)
+            tiles = set()
+            for (z, minX, minY, maxX, maxY) in bands:
+                if z != zoom:
+                    continue
+                self.assertTrue((maxX - minX + 1) * (maxY - minY + 1) <= 20)
+                for y in range(minY, maxY + 1):
+                    for x in range(minX, maxX + 1):
+                        self.assertFalse((x, y) in tiles)
+                        tiles.add((x, y))
+            self.assertEqual(len(tiles), r.nbTiles)
+
+    def testWideRowsAreNotSplit(self):
+        planner = TileRangePlanner([5.5, 45.5, 10.5, 48.0], 9, 9)
+        r = planner.zoomRange(9)
+        bands = list(indexBands(planner, 1))
+        self.assertEqual(len(bands), r.yCount)
+        self.assertEqual(bands[0], (9, r.minX, r.minY, r.maxX, r.minY))
+
+    def testBandBounds(self):
+        planner = TileRangePlanner([5.5, 45.5, 10.5, 48.0], 8, 8)
+        r = planner.zoomRange(8)
+        band = (8, r.minX, r.minY, r.minX + 1, r.minY + 2)
+        bounds = bandBounds(band, r.tileSize)
+        first = planner.tileBounds(8, r.minX, r.minY)
+        last = planner.tileBounds(8, r.minX + 1, r.minY + 2)
+        for i, value in enumerate(first[:2] + last[2:]):
+            self.assertAlmostEqual(bounds[i], value)
+
+    def testTileRange(self):
+        extent = (5.5, 45.5, 10.5, 48.0)
+        for zoom in (5, 8, 11):
+            r = TileRangePlanner(list(extent), zoom, zoom).zoomRange(zoom)
+            self.assertEqual(r.tileSize, 180.0 / 2 ** zoom)
+            (minX, minY, maxX, maxY) = tileRange(zoom, extent)
+            self.assertTrue(minX <= r.minX and r.maxX <= maxX)
+            self.assertTrue(minY <= r.minY and r.maxY <= maxY)
+            self.assertTrue(r.minX - minX <= 1 and r.minY - minY <= 1)
+        # Touching the edge of a tile
+        tileSize = 180.0 / 2 ** 8
+        self.assertEqual(tileRange(8, (tileSize - 180.0, 0.0,
+                                       2 * tileSize - 180.0, 0.0))[::2],
+                         (0, 2))
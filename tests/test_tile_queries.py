@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import re
+import unittest
+import numpy as np
+from shapely.geometry import Polygon
+from quantized_mesh_tile import encode
+from forge.lib.partitions import PartitionGrid
+from forge.lib.tile_queries import TileQueries, PackedRingsBuilder
+
+
+class Model:
+    __tablename__ = 'break_0'
+    __table_args__ = {'schema': 'data'}
+    __partitions__ = None
+
+
+class PartitionedModel(Model):
+    __partitions__ = PartitionGrid(3)
+
+
+class IndexModel:
+    __tablename__ = 'tile_index'
+    __table_args__ = {'schema': 'data'}
+
+
+class Cursor:
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.rows = list(connection.rows)
+
+    def execute(self, sql, values=None):
+        self.connection.executed.append((sql, values))
+
+    def fetchall(self):
+        rows = self.rows
+        self.rows = []
+        return rows
+
+    def fetchmany(self, size):
+        rows = self.rows[:size]
+        self.rows = self.rows[size:]
+        self.connection.fetched.append(len(rows))
+        return rows
+
+    def close(self):
+        pass
+
+
+# DBAPI connection of a pool, with its info
+class Connection:
+
+    def __init__(self, rows=()):
+        self.info = {}
+        self.rows = rows
+        self.executed = []
+        self.fetched = []
+        self.cursorNames = []
+
+    def cursor(self, name=None):
+        self.cursorNames.append(name)
+        return Cursor(self, name)
+
+
+def parameterNumbers(sql):
+    return sorted(set(int(n) for n in re.findall(r'\$(\d+)', sql)))
+
+
+class TestTileQueries(unittest.TestCase):
+
+    def testParameters(self):
+        queries = TileQueries(PartitionedModel)
+        self.assertEqual(queries.clip.params, [
+            ('minx', 'float8'), ('miny', 'float8'), ('maxx', 'float8'),
+            ('maxy', 'float8'), ('partitionkeys', 'int[]')])
+        for statement in (queries.corners, queries.clip):
+            self.assertEqual(
+                parameterNumbers(statement.sql),
+                range(1, len(statement.params) + 1))
+        self.assertEqual(queries.corners.sql.count('FROM data.break_0 f'), 4)
+        self.assertTrue(queries.ids is None)
+        self.assertTrue(queries.watermask is None)
+
+    def testTileIndex(self):
+        queries = TileQueries(Model, indexModel=IndexModel)
+        self.assertEqual(queries.clip.name, 'tile_clip_break_0_indexed')
+        self.assertTrue('f.id = ANY($5)' in queries.clip.sql)
+        self.assertFalse('&&' in queries.clip.sql)
+        self.assertEqual(queries.ids.params, [
+            ('zoom', 'smallint'), ('x', 'int'), ('y', 'int')])
+
+    def testValues(self):
+        bounds = (7.0, 46.0, 7.5, 46.5)
+        values = TileQueries(Model).values(bounds, tileXYZ=(10, 20, 9))
+        self.assertEqual(values, dict(
+            minx=7.0, miny=46.0, maxx=7.5, maxy=46.5, x=10, y=20, zoom=9))
+        values = TileQueries(PartitionedModel).values(bounds, ids=(3, 4))
+        self.assertEqual(values['ids'], [3, 4])
+        self.assertEqual(
+            values['partitionkeys'],
+            PartitionedModel.__partitions__.keysIntersecting(
+                (6.995, 45.995, 7.505, 46.505)))
+
+    def testPreparedOncePerConnection(self):
+        queries = TileQueries(Model)
+        connection = Connection()
+        for i in range(0, 3):
+            rings = queries.clippedRings(connection, (7.0, 46.0, 7.5, 46.5))
+            self.assertEqual(len(rings), 0)
+        sqls = [sql for sql, values in connection.executed]
+        self.assertEqual(len(sqls), 4)
+        self.assertTrue(sqls[0].startswith(
+            'PREPARE tile_clip_break_0 (float8, float8, float8, float8) AS '))
+        self.assertEqual(
+            sqls[1], 'EXECUTE tile_clip_break_0 (%(minx)s, %(miny)s, '
+            '%(maxx)s, %(maxy)s)')
+        queries.clippedRings(Connection(), (7.0, 46.0, 7.5, 46.5))
+        self.assertEqual(len(connection.executed), 4)
+
+    def testQueryLiteral(self):
+        queries = TileQueries(PartitionedModel)
+        sql = queries.clip.queryLiteral()
+        self.assertEqual(parameterNumbers(sql), [])
+        self.assertTrue('ST_MakeEnvelope(%(minx)s::float8, %(miny)s::float8, '
+                        '%(maxx)s::float8, %(maxy)s::float8, 4326)' in sql)
+        self.assertTrue('f.partitionkey = ANY(%(partitionkeys)s::int[])' in sql)
+
+    def testStreamed(self):
+        queries = TileQueries(Model, indexModel=IndexModel)
+        connection = Connection(rows=clipRows(ringsById))
+        rings = queries.clippedRings(
+            connection, (7.0, 46.0, 7.5, 46.5), ids=sorted(ringsById),
+            fetchSize=2)
+        self.assertEqual(len(rings), 3)
+        # A named cursor, no prepared statement
+        self.assertEqual(connection.cursorNames, ['tile_clip_break_0_indexed'])
+        self.assertEqual(len(connection.executed), 1)
+        self.assertFalse(connection.info)
+        self.assertEqual(connection.fetched, [2, 1, 0])
+
+    def testSparseTilesArePrepared(self):
+        queries = TileQueries(Model, indexModel=IndexModel)
+        self.assertTrue(queries.isStreamed(range(0, 3), 2))
+        self.assertFalse(queries.isStreamed(range(0, 2), 2))
+        self.assertFalse(queries.isStreamed(range(0, 3), 0))
+        # Without the tile index, the number of triangles is unknown
+        self.assertFalse(queries.isStreamed(None, 2))
+        connection = Connection(rows=clipRows(ringsById))
+        rings = queries.clippedRings(
+            connection, (7.0, 46.0, 7.5, 46.5), ids=sorted(ringsById),
+            fetchSize=10)
+        self.assertEqual(len(rings), 3)
+        self.assertEqual(connection.cursorNames, [None, None])
+        self.assertTrue(connection.executed[1][0].startswith('EXECUTE '))
+
+    def testNotIndexedTilesArePrepared(self):
+        # Without the tile index, the tiles are never streamed
+        queries = TileQueries(Model)
+        connection = Connection(rows=clipRows(ringsById))
+        rings = queries.clippedRings(
+            connection, (7.0, 46.0, 7.5, 46.5), fetchSize=2)
+        self.assertEqual(len(rings), 3)
+        self.assertEqual(connection.cursorNames, [None, None])
+        self.assertEqual(connection.fetched, [])
+        self.assertTrue(connection.executed[1][0].startswith(
+            'EXECUTE tile_clip_break_0 '))
+
+
+# Closed rings by id
+ringsById = {
+    12: [(7.0, 46.0, 1.0), (7.1, 46.0, 2.0), (7.0, 46.1, 3.0),
+         (7.0, 46.0, 1.0)],
+    5: [(7.1, 46.0, 2.0), (7.2, 46.0, 4.0), (7.2, 46.1, 5.0),
+        (7.15, 46.12, 6.0), (7.1, 46.1, 7.0), (7.1, 46.0, 2.0)],
+    8: [(7.2, 46.0, 4.0), (7.3, 46.0, 1.0), (7.2, 46.1, 5.0),
+        (7.2, 46.0, 4.0)],
+}
+
+
+# Clip statement rows of closed rings given by id
+def clipRows(ringsById):
+    return [
+        (i, len(ring), buffer(np.array(ring, dtype='<f8').tostring()))
+        for i, ring in sorted(ringsById.items())]
+
+
+def packedRings(ringsById, batchSize=2):
+    builder = PackedRingsBuilder()
+    rows = clipRows(ringsById)
+    for i in range(0, len(rows), batchSize):
+        builder.add(rows[i:i + batchSize])
+    return builder.packed()
+
+
+class TestPackedRings(unittest.TestCase):
+
+    def testEmpty(self):
+        packed = PackedRingsBuilder().packed()
+        self.assertEqual(len(packed), 0)
+        self.assertEqual(packed.rings(), [])
+
+    def testRings(self):
+        packed = packedRings(ringsById)
+        self.assertEqual(len(packed), 3)
+        rings = packed.rings()
+        # In the order of the rows, without the closing point
+        self.assertEqual(rings[0], [list(c) for c in ringsById[5][:-1]])
+        for i, fid in ((1, 8), (2, 12)):
+            self.assertTrue(isinstance(rings[i], np.ndarray))
+            self.assertEqual(rings[i].tolist(), [
+                list(c) for c in ringsById[fid][:-1]])
+
+    def testGrowth(self):
+        builder = PackedRingsBuilder(nbRings=1)
+        rows = clipRows(ringsById) * 10
+        for i in range(0, len(rows), 7):
+            builder.add(rows[i:i + 7])
+        packed = builder.packed()
+        self.assertEqual(len(packed), 30)
+        self.assertEqual(packed.ids.tolist(), [5, 8, 12] * 10)
+        self.assertEqual(len(packed.coords), 140)
+
+    def testSetHeight(self):
+        packed = packedRings(ringsById)
+        packed.setHeight(12, (7.0, 46.0, 10.0))
+        packed.setHeight(13, (7.0, 46.0, 20.0))
+        rings = packed.rings()
+        self.assertEqual(rings[2][0].tolist(), [7.0, 46.0, 10.0])
+        self.assertEqual(rings[0][0], [7.1, 46.0, 2.0])
+
+    def testEncodedAsPolygons(self):
+        bounds = [7.0, 46.0, 7.5, 46.5]
+        packed = packedRings(ringsById)
+        expected = encode(
+            [Polygon(ringsById[i]) for i in sorted(ringsById)],
+            bounds=bounds, autocorrectGeometries=True)
+        tile = encode(packed.rings(), bounds=bounds, autocorrectGeometries=True)
+        self.assertEqual(tile.toBytesIO().getvalue(),
+                         expected.toBytesIO().getvalue())